@@ -23,7 +23,7 @@ def runserver(ctx, development=False):
                 'YOG_EMAIL_PORT': '8025',
                 'YOG_EMAIL_SENDER_ADDRESS': 'yog_sothoth@localhost',
                 'YOG_MANAGERS_ADDRESSES': 'yog_managers@localhost',
-                'YOG_MATRIX_URL': 'http://127.0.0.1:8000/v1/matrix',
+                'YOG_MATRIX_URL': 'http://127.0.0.1:8008',
                 'YOG_MATRIX_REGISTRATION_SHARED_SECRET': 'fakesecret',
             }
         )
@@ -32,6 +32,76 @@ def runserver(ctx, development=False):
                 echo=True)
 
 
+@task(
+    help={
+        'development': 'run a development worker'
+    }
+)
+def worker(ctx, development=False):
+    """Run a dedicated task worker, consuming jobs such as emails."""
+    if development:
+        ctx.run(
+            'python -m yog_sothoth.worker',
+            echo=True,
+            pty=True,
+            env={
+                'YOG_DEVELOPMENT_MODE': 'true',
+                'YOG_REDIS_HOST': '127.0.0.1',
+                'YOG_ALLOWED_HOSTS': '127.0.0.1',
+                'YOG_EMAIL_HOST': '127.0.0.1',
+                'YOG_EMAIL_PORT': '8025',
+                'YOG_EMAIL_SENDER_ADDRESS': 'yog_sothoth@localhost',
+                'YOG_MANAGERS_ADDRESSES': 'yog_managers@localhost',
+                'YOG_MATRIX_URL': 'http://127.0.0.1:8008',
+                'YOG_MATRIX_REGISTRATION_SHARED_SECRET': 'fakesecret',
+            }
+        )
+    else:
+        ctx.run('python -m yog_sothoth.worker', echo=True)
+
+
+@task(
+    help={
+        'source': 'cache alias where legacy keys are stored (defaults to default)',
+        'batch_size': 'keys per pipelined batch (defaults to 500)',
+        'dry_run': 'count keys to migrate without changing anything',
+    }
+)
+def migrate_keys(ctx, source='default', batch_size=500, dry_run=False):
+    """Migrate cache keys to the namespaced and versioned keys schema."""
+    ctx.run(f'python -m yog_sothoth.cache.migrations --source {source} '
+            f'--batch-size {batch_size}{" --dry-run" if dry_run else ""}', echo=True)
+
+
+@task(
+    help={
+        'items': 'file with one JSON item per line with the rid, manager_token and '
+                 'username of approved registrations (- for stdin)',
+        'concurrency': 'maximum accounts being created at the same time (defaults '
+                       'to the YOG_MATRIX_BULK_CONCURRENCY setting)',
+    }
+)
+def create_accounts(ctx, items, concurrency=None):
+    """Create Matrix accounts for many approved registration requests."""
+    concurrency_arg = f' --concurrency {concurrency}' if concurrency else ''
+    ctx.run(f'python -m yog_sothoth.provisioning {items}{concurrency_arg}',
+            echo=True)
+
+
+@task(
+    help={
+        'count': 'emails to send per round (defaults to 1000)',
+        'concurrency': 'emails being sent at the same time (defaults to 5)',
+        'levels': 'comma separated log levels, a round each (defaults to '
+                  'INFO,DEBUG)',
+    }
+)
+def benchmark_emails(ctx, count=1000, concurrency=5, levels='INFO,DEBUG'):
+    """Benchmark the overhead of sending emails to a local SMTP stand-in."""
+    ctx.run(f'python -m yog_sothoth.emails.benchmark --count {count} '
+            f'--concurrency {concurrency} --levels {levels}', echo=True)
+
+
 @task
 def lint(ctx):
     """Lint code and static analysis."""
@@ -61,6 +131,28 @@ def aiosmtpd(ctx):
             echo_stdin=False)
 
 
+@task(
+    help={
+        'latency': 'response latency distribution in seconds, such as '
+                   'uniform:0.05:0.2 (defaults to none)',
+        'error_rate': 'fraction of requests answered with an error (defaults to 0)',
+        'rate_limit': 'registrations per second, answering M_LIMIT_EXCEEDED when '
+                      'exceeded (defaults to no limit)',
+    }
+)
+def matrix(ctx, latency=None, error_rate=None, rate_limit=None):
+    """Run a local Matrix homeserver stand-in for development."""
+    args = ''
+    if latency:
+        args += f' --latency {latency}'
+    if error_rate:
+        args += f' --error-rate {error_rate}'
+    if rate_limit:
+        args += f' --rate-limit {rate_limit}'
+    ctx.run(f'python -m yog_sothoth.matrix_standin{args}', echo=True, pty=True,
+            echo_stdin=False)
+
+
 @task
 def build(ctx, tag):
     """Build Yog-Sothoth API Docker image."""
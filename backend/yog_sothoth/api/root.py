@@ -1,10 +1,22 @@
 """Application main endpoints."""
+import asyncio
+from typing import Dict
+from typing import Optional
+
 from fastapi import APIRouter
 from fastapi import Header
 from starlette import status
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.responses import PlainTextResponse
 from starlette.responses import Response
 
+from yog_sothoth.cache import CacheState
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import LazyCache
 from yog_sothoth.conf import settings
+from yog_sothoth.utils.circuit_breaker import get_circuit_breakers
+from yog_sothoth.utils.metrics import registry
 from .utils import build_prefix
 
 router = APIRouter()
@@ -20,3 +32,53 @@ def read_the_docs(response: Response, user_agent: str = Header(None)):
     else:
         # Redirect machine
         response.headers['Location'] = build_prefix(settings.OPENAPI_URL_PATH)
+
+
+if settings.METRICS_URL_PATH:
+    @router.get(settings.METRICS_URL_PATH, include_in_schema=False)
+    def read_metrics() -> Response:
+        """Get this worker metrics in Prometheus text format."""
+        return PlainTextResponse(registry.render(),
+                                 media_type='text/plain; version=0.0.4')
+
+
+async def _check_cache(cache: LazyCache) -> Dict[str, any]:
+    latency: Optional[float]
+    try:
+        latency = await asyncio.wait_for(cache.ping(),
+                                         timeout=settings.REDIS_CONNECTION_TIMEOUT)
+    except (CacheUnavailableError, asyncio.TimeoutError):
+        latency = None
+    return {
+        'state': cache.state,
+        'latency': latency,
+    }
+
+
+if settings.HEALTH_URL_PATH:
+    @router.get(settings.HEALTH_URL_PATH, include_in_schema=False)
+    async def read_health(request: Request) -> Response:
+        """Get this worker readiness and its dependencies state.
+
+        Each cache reports its state and round-trip latency in seconds. Circuit
+        breakers state is informative: an open one doesn't affect readiness.
+        """
+        caches: Dict[str, LazyCache] = request.app.caches
+        checks = await asyncio.gather(*(_check_cache(cache)
+                                        for cache in caches.values()))
+        ready = all(check['state'] == CacheState.ready for check in checks)
+        if ready:
+            status_code = status.HTTP_200_OK
+        else:
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return JSONResponse(
+            {
+                'status': 'ready' if ready else 'unavailable',
+                'caches': dict(zip(caches, checks)),
+                'circuit_breakers': {
+                    name: breaker.state
+                    for name, breaker in get_circuit_breakers().items()
+                },
+            },
+            status_code=status_code,
+        )
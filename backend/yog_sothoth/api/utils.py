@@ -1,15 +1,105 @@
 """Helper functions and classes definition for API endpoints."""
+import logging
+from typing import Optional
+
 from aioredis import Redis
+from fastapi import HTTPException
+from starlette import status
 from starlette.requests import Request
 
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import RATE_LIMIT_CACHE_ALIAS
+from yog_sothoth.cache import REGISTRATIONS_CACHE_ALIAS
+from yog_sothoth.cache import TASKS_CACHE_ALIAS
 from yog_sothoth.conf import settings
+from yog_sothoth.objects import RateLimit
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceUnavailableException(HTTPException):
+    """Service unavailable exception.
+
+    To be raised when a dependency, such as the cache, is temporarily unavailable.
+    """
+
+    def __init__(self) -> None:
+        """Service unavailable exception (a dependency is temporarily unavailable)."""
+        super().__init__(status.HTTP_503_SERVICE_UNAVAILABLE,
+                         'Service temporarily unavailable, try again later',
+                         {'Retry-After': str(settings.REDIS_RECONNECT_MAX_DELAY)})
+
+
+async def get_cache_by_alias(request: Request, alias: str) -> Redis:
+    """Get the cache for the given alias from the application.
+
+    :raises CacheUnavailableError: The cache is not available at the moment.
+    """
+    return await request.app.caches[alias].get()
+
 
+async def get_cache(request: Request) -> Redis:
+    """Registrations cache session dependency for FastAPI.
 
-def get_cache(request: Request) -> Redis:
-    """Cache session dependency for FastAPI."""
-    return request.app.cache
+    :raises ServiceUnavailableException: The cache is not available at the moment.
+    """
+    try:
+        return await get_cache_by_alias(request, REGISTRATIONS_CACHE_ALIAS)
+    except CacheUnavailableError:
+        raise ServiceUnavailableException()
+
+
+async def get_tasks_cache(request: Request) -> Optional[Redis]:
+    """Tasks cache session dependency for FastAPI.
+
+    :return: The tasks cache, or None if it's not available at the moment.
+    """
+    try:
+        return await get_cache_by_alias(request, TASKS_CACHE_ALIAS)
+    except CacheUnavailableError:
+        return None
 
 
 def build_prefix(api_prefix: str) -> str:
     """Build API URL prefix."""
     return f'{settings.API_PREFIX}{api_prefix}'
+
+
+def get_rate_limit_identifier(request: Request) -> str:
+    """Get the identifier of the client of a request for the rate limit."""
+    identifying_headers = ('user-agent', 'x-forwarded-for', 'x-real-ip')
+    return ':'.join(request.headers.get(header, '') for header in identifying_headers)
+
+
+async def charge_rate_limit(request: Request, cost: int) -> None:
+    """Count a costly request as many requests for the rate limit of its client.
+
+    Requests are already counted once by the rate limit middleware. If the cache
+    is not available, the request is let through.
+
+    :param request: Request to charge.
+    :param cost: Number of requests to count.
+    :raises HTTPException: The rate limit is reached (429).
+    """
+    identifier = get_rate_limit_identifier(request)
+    try:
+        cache = await get_cache_by_alias(request, RATE_LIMIT_CACHE_ALIAS)
+        limiting = RateLimit(cache, settings.RATE_LIMIT)
+        below_limit = await limiting.verify_below(identifier, cost)
+    except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+        logger.warning('Rate limit charge skipped because the cache is not '
+                       'available: %s', repr(exc))
+        return
+    if below_limit:
+        return
+
+    try:
+        retry_after = await limiting.get_expiration_time(identifier)
+    except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+        logger.warning('Rate limit expiration time unknown because the cache is not '
+                       'available: %s', repr(exc))
+        retry_after = limiting.compute_expiration_time(limiting.limit)
+    raise HTTPException(status.HTTP_429_TOO_MANY_REQUESTS,
+                        'Maximum allowed requests reached',
+                        {'Retry-After': str(retry_after)})
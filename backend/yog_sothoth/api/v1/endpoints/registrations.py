@@ -1,5 +1,9 @@
 """Registration endpoints."""
+import logging
+import math
+from typing import AsyncIterator
 from typing import Dict
+from typing import Optional
 from typing import Tuple
 
 from aioredis import Redis
@@ -8,13 +12,23 @@ from fastapi import BackgroundTasks
 from fastapi import Depends
 from fastapi import HTTPException
 from fastapi import Path
+from fastapi import Query
 from starlette import status
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
 
 from yog_sothoth import crud
+from yog_sothoth import objects
 from yog_sothoth import schemas
 from yog_sothoth import tasks
 from yog_sothoth.api import auth
+from yog_sothoth.api.utils import charge_rate_limit
 from yog_sothoth.api.utils import get_cache
+from yog_sothoth.api.utils import get_tasks_cache
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.conf import settings
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -23,10 +37,42 @@ def _get_hidden_fields_for_manager() -> Tuple[str, ...]:
     return 'username', 'email', 'password', 'token', 'manager_token'
 
 
+async def _schedule(
+        tasks_cache: Optional[Redis],
+        background_tasks: BackgroundTasks,
+        registration: objects.Registration,
+        *registration_tasks: tasks.TRegistrationTask,
+        delays: Optional[Dict[tasks.TRegistrationTask, float]] = None,
+) -> None:
+    """Enqueue registration tasks, or run them in this worker if they can't be.
+
+    Tasks that can't be enqueued are run concurrently in a single background task,
+    right away even if they should be delayed.
+    """
+    delays = delays or {}
+    not_enqueued = []
+    for task in registration_tasks:
+        if tasks_cache is not None:
+            try:
+                await tasks.enqueue_registration_task(tasks_cache, task, registration,
+                                                      delay=delays.get(task, 0))
+            except CACHE_ERRORS as exc:
+                logger.warning('Could not enqueue %s for %s, running it in the '
+                               'background: %s', task.__name__, registration.rid,
+                               repr(exc))
+            else:
+                continue
+        not_enqueued.append(task)
+    if not_enqueued:
+        background_tasks.add_task(tasks.run_registration_tasks, registration,
+                                  *not_enqueued)
+
+
 @router.post('/', response_model=schemas.RegistrationInfo)
 async def create_registration_request(
         *,
         cache: Redis = Depends(get_cache),
+        tasks_cache: Optional[Redis] = Depends(get_tasks_cache),
         registration_new: schemas.RegistrationCreate,
         background_tasks: BackgroundTasks,
 ) -> Dict[str, any]:
@@ -40,17 +86,66 @@ async def create_registration_request(
         raise HTTPException(status.HTTP_507_INSUFFICIENT_STORAGE,
                             detail='Create operation failed for an unknown reason')
 
-    if registration_crud.registration.email:
-        background_tasks.add_task(tasks.task_notify_user_registration_received,
-                                  registration_crud.registration)
-    # ToDo: wait for 5' before sending request to managers (to allow the user to
-    #  cancel its reg)
-    background_tasks.add_task(tasks.task_notify_managers_registration_received,
-                              registration_crud.registration)
+    registration = registration_crud.registration
+    registration_tasks = [tasks.task_notify_managers_registration_received]
+    if registration.email:
+        registration_tasks.append(tasks.task_notify_user_registration_received)
+    # Delay notifying managers to allow the user to delete the registration
+    delays = {
+        tasks.task_notify_managers_registration_received:
+            settings.TASKS_MANAGERS_NOTIFICATION_DELAY,
+    }
+    await _schedule(tasks_cache, background_tasks, registration, *registration_tasks,
+                    delays=delays)
 
     return await registration_crud.registration.as_dict()
 
 
+async def _as_json_lines(
+        results: AsyncIterator[schemas.RegistrationBulkCreateAccountResult],
+) -> AsyncIterator[str]:
+    async for result in results:
+        yield f'{result.json()}\n'
+
+
+@router.post('/bulk/', response_class=StreamingResponse)
+async def create_accounts_once_approved(
+        *,
+        request: Request,
+        cache: Redis = Depends(get_cache),
+        registrations: schemas.RegistrationBulkCreateAccounts,
+) -> StreamingResponse:
+    """Create Matrix accounts for many approved registration requests.
+
+    Accounts are created concurrently and each result is streamed as a JSON line
+    as soon as it's done. Users are notified as usual, but managers are not.
+
+    Items count for the rate limit, and once there are too many incorrect
+    manager tokens the rest of the items are not processed.
+
+    Each item requires manager authentication:
+    - **rid**: registration id.
+    - **manager_token**: manager token.
+    - **username**: account username.
+    - **email**: [optional] address to receive notifications.
+    """
+    if len(registrations.items) > settings.MATRIX_BULK_MAX_ITEMS:
+        raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'Too many items (the maximum is '
+                                   f'{settings.MATRIX_BULK_MAX_ITEMS})')
+    # Verifying each item is costly: charge them to the rate limit
+    per_request = max(settings.MATRIX_BULK_RATE_LIMIT_ITEMS, 1)
+    await charge_rate_limit(request, math.ceil(len(registrations.items) / per_request))
+
+    results = tasks.task_create_matrix_accounts(
+        cache,
+        registrations.items,
+        concurrency=settings.MATRIX_BULK_CONCURRENCY,
+        max_failed_verifications=settings.MATRIX_BULK_MAX_FAILED_VERIFICATIONS,
+    )
+    return StreamingResponse(_as_json_lines(results), media_type='application/x-ndjson')
+
+
 @router.get('/{rid}/', response_model=schemas.RegistrationInfoReduced)
 async def read_registration_request(
         *,
@@ -78,12 +173,42 @@ async def read_registration_request(
     return await registration_crud.registration.as_dict(hide=hide)
 
 
+@router.get('/{rid}/available/', response_model=schemas.RegistrationUsernameAvailability)
+async def read_username_availability(
+        *,
+        api_user: auth.APIUser = Depends(auth.authenticate_request),
+        rid: str = Path(..., min_length=6, max_length=6, title='Registration ID'),
+        username: str = Query(..., min_length=4, max_length=140, regex=r'^[\w.-]+$'),
+) -> Dict[str, any]:
+    """Check whether a Matrix username is available (requires user authentication).
+
+    Authentication:
+    - **username**: registration id.
+    - **password**: token.
+    """
+    # Verify resource permission
+    if api_user.rid != rid:
+        raise auth.AccessDeniedException()
+
+    # Verify access permission
+    if api_user.is_manager:
+        raise auth.AccessDeniedException()
+
+    available = await tasks.task_check_matrix_username_available(username)
+    if available is None:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Could not check the username availability')
+
+    return {'username': username, 'available': available}
+
+
 @router.put('/{rid}/', response_model=schemas.RegistrationInfoReduced)
 async def approve_or_reject_registration_request(
         *,
         cache: Redis = Depends(get_cache),
         api_user: auth.APIUser = Depends(auth.authenticate_request),
         rid: str = Path(..., min_length=6, max_length=6, title='Registration ID'),
+        tasks_cache: Optional[Redis] = Depends(get_tasks_cache),
         registration_update: schemas.RegistrationUpdateByManager,
         background_tasks: BackgroundTasks,
 ) -> Dict[str, any]:
@@ -114,11 +239,11 @@ async def approve_or_reject_registration_request(
         raise HTTPException(status.HTTP_507_INSUFFICIENT_STORAGE,
                             detail='Update operation failed for an unknown reason')
 
-    if registration_crud.registration.email:
-        background_tasks.add_task(tasks.task_notify_user_status_changed,
-                                  registration_crud.registration)
-    background_tasks.add_task(tasks.task_notify_managers_status_changed,
-                              registration_crud.registration)
+    registration = registration_crud.registration
+    registration_tasks = [tasks.task_notify_managers_status_changed]
+    if registration.email:
+        registration_tasks.append(tasks.task_notify_user_status_changed)
+    await _schedule(tasks_cache, background_tasks, registration, *registration_tasks)
 
     hide = _get_hidden_fields_for_manager()
     return await registration_crud.registration.as_dict(hide=hide)
@@ -130,6 +255,7 @@ async def create_account_once_approved(
         cache: Redis = Depends(get_cache),
         api_user: auth.APIUser = Depends(auth.authenticate_request),
         rid: str = Path(..., min_length=6, max_length=6, title='Registration ID'),
+        tasks_cache: Optional[Redis] = Depends(get_tasks_cache),
         registration_update: schemas.RegistrationUpdateByUser,
         background_tasks: BackgroundTasks,
 ) -> Dict[str, any]:
@@ -157,6 +283,14 @@ async def create_account_once_approved(
                             detail='The registration request is not yet approved or '
                                    'already in process')
 
+    # Fail early if the username is not available, unless it can't be checked
+    available = await tasks.task_check_matrix_username_available(
+        registration_update.username,
+    )
+    if available is False:
+        raise HTTPException(status.HTTP_409_CONFLICT,
+                            detail='The username is not available')
+
     if not registration_update.email:
         registration_update.email = registration_crud.registration.email
     update = schemas.RegistrationUpdateMatrixStatus(**registration_update.dict())
@@ -164,12 +298,10 @@ async def create_account_once_approved(
         raise HTTPException(status.HTTP_507_INSUFFICIENT_STORAGE,
                             detail='Update operation failed for an unknown reason')
 
-    # Don't get password from user, create instead
-    registration_crud.registration.generate_password()
     registration_crud.registration.username = registration_update.username
 
-    background_tasks.add_task(tasks.task_create_matrix_account,
-                              registration_crud.registration)
+    await _schedule(tasks_cache, background_tasks, registration_crud.registration,
+                    tasks.task_create_matrix_account)
 
     return await registration_crud.registration.as_dict()
 
@@ -178,11 +310,14 @@ async def create_account_once_approved(
 async def delete_registration_request(
         *,
         cache: Redis = Depends(get_cache),
+        tasks_cache: Optional[Redis] = Depends(get_tasks_cache),
         api_user: auth.APIUser = Depends(auth.authenticate_request),
         rid: str = Path(..., min_length=6, max_length=6, title='Registration ID'),
 ) -> Dict[str, any]:
     """Delete a registration request (requires user authentication).
 
+    Managers are not notified of the registration request if they weren't yet.
+
     Note that registration requests are automatically deleted, no matter what,
     after certain given time.
 
@@ -204,4 +339,15 @@ async def delete_registration_request(
         raise HTTPException(status.HTTP_507_INSUFFICIENT_STORAGE,
                             detail='Delete operation failed for an unknown reason')
 
+    if tasks_cache is not None:
+        try:
+            await tasks.cancel_registration_task(
+                tasks_cache,
+                tasks.task_notify_managers_registration_received,
+                rid,
+            )
+        except CACHE_ERRORS as exc:
+            logger.warning('Could not cancel notifying managers of %s: %s', rid,
+                           repr(exc))
+
     return await registration_crud.registration.as_dict()
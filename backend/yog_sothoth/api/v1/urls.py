@@ -1,8 +1,6 @@
 """Application URL's."""
 from fastapi import APIRouter
 
-from yog_sothoth.conf import settings
-from .endpoints import matrix
 from .endpoints import registrations
 
 version_prefix = '/v1'
@@ -13,10 +11,3 @@ api_router.include_router(
     prefix='/registrations',
     tags=['registrations'],
 )
-
-if settings.DEVELOPMENT_MODE:
-    api_router.include_router(
-        matrix.router,
-        prefix='/matrix',
-        tags=['matrix'],
-    )
@@ -1,17 +1,118 @@
 """Application events."""
-from yog_sothoth.cache import close_connection
-from yog_sothoth.cache import get_default_cache_pool
+import asyncio
+
+from yog_sothoth.cache import REGISTRATIONS_CACHE_ALIAS
+from yog_sothoth.cache import TASKS_CACHE_ALIAS
+from yog_sothoth.cache import close_lazy_caches
+from yog_sothoth.cache import get_lazy_caches
+from yog_sothoth.conf import settings
+from yog_sothoth.connectors.matrix import close_nonce_pools
+from yog_sothoth.emails import OUTBOX_QUEUE
+from yog_sothoth.emails import close_smtp_pool
+from yog_sothoth.emails import close_spool
+from yog_sothoth.emails import get_spool_job_handlers
+from yog_sothoth.emails import open_smtp_pool
+from yog_sothoth.emails import open_spool
+from yog_sothoth.messages.templates import compile_templates
+from yog_sothoth.queue import Consumer
+from yog_sothoth.queue import Scheduler
+from yog_sothoth.tasks import TASK_QUEUES
+from yog_sothoth.tasks import get_registration_job_handlers
+from yog_sothoth.tasks import is_managers_digest_enabled
+from yog_sothoth.tasks import recover_registration_tasks
+from yog_sothoth.tasks import task_refresh_matrix_api_version
+from yog_sothoth.tasks import task_send_managers_digests
+from yog_sothoth.utils.connectors import add_request_observer
+from yog_sothoth.utils.connectors import close_session
+from yog_sothoth.utils.connectors import open_session
+from yog_sothoth.utils.inflight import get_in_flight
+from yog_sothoth.utils.request_metrics import observe_request
 from .fastapi import app
 
 
+def _start_consumer(consumer: Consumer) -> None:
+    # noinspection PyUnresolvedReferences
+    app.consumers.append(consumer)
+    # noinspection PyUnresolvedReferences
+    app.consumer_tasks.append(asyncio.ensure_future(consumer.run()))
+
+
 @app.on_event('startup')
 async def startup() -> None:
-    """Initialize the cache."""
-    app.cache = await get_default_cache_pool()
+    """Initialize the caches, HTTP and SMTP clients, messages and background tasks.
+
+    There's one cache connection pool per alias, created lazily so the worker boot
+    doesn't depend on the cache: connections are started in the background.
+
+    Emails are spooled. Unless disabled, the worker consumes jobs from the task
+    queues and the email spool, enqueues delayed jobs once due and sends the
+    managers digest as well.
+    """
+    app.caches = get_lazy_caches()
+    for cache in app.caches.values():
+        cache.warm_up()
+    add_request_observer(observe_request)
+    await open_session(
+        limit=settings.REQUESTS_POOL_LIMIT,
+        limit_per_host=settings.REQUESTS_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=settings.REQUESTS_KEEPALIVE_TIMEOUT,
+    )
+    await open_smtp_pool()
+    open_spool(app.caches[TASKS_CACHE_ALIAS])
+    compile_templates()
+    app.background_tasks = [
+        asyncio.ensure_future(task_refresh_matrix_api_version()),
+    ]
+    app.consumers = []
+    app.consumer_tasks = []
+    if settings.TASKS_CONSUMER_CONCURRENCY:
+        handlers = get_registration_job_handlers(
+            app.caches[REGISTRATIONS_CACHE_ALIAS].get,
+        )
+        for queue in TASK_QUEUES:
+            _start_consumer(Consumer(
+                app.caches[TASKS_CACHE_ALIAS], queue, handlers,
+                concurrency=settings.TASKS_CONSUMER_CONCURRENCY,
+                drain_timeout=settings.TASKS_SHUTDOWN_DRAIN_TIMEOUT,
+            ))
+            scheduler = Scheduler(app.caches[TASKS_CACHE_ALIAS], queue)
+            app.background_tasks.append(asyncio.ensure_future(scheduler.run()))
+        _start_consumer(Consumer(
+            app.caches[TASKS_CACHE_ALIAS], OUTBOX_QUEUE, get_spool_job_handlers(),
+            concurrency=settings.TASKS_CONSUMER_CONCURRENCY,
+            drain_timeout=settings.TASKS_SHUTDOWN_DRAIN_TIMEOUT,
+        ))
+        if is_managers_digest_enabled():
+            app.background_tasks.append(asyncio.ensure_future(
+                task_send_managers_digests(app.caches[REGISTRATIONS_CACHE_ALIAS].get),
+            ))
 
 
 @app.on_event('shutdown')
 async def shutdown() -> None:
-    """Close connection to the cache."""
+    """Drain running work, and close connections to the caches, HTTP and SMTP.
+
+    Consumers stop reading jobs, and both their running jobs and the in-flight
+    background tasks (the registration tasks that could not be enqueued) are
+    waited for, up to a timeout, before closing connections. Unfinished jobs are
+    retried, and unfinished background tasks are enqueued again.
+    """
+    # noinspection PyUnresolvedReferences
+    for consumer in app.consumers:
+        consumer.stop()
+    unfinished = await get_in_flight().drain(settings.TASKS_SHUTDOWN_DRAIN_TIMEOUT)
+    # noinspection PyUnresolvedReferences
+    await recover_registration_tasks(app.caches[TASKS_CACHE_ALIAS].get, unfinished)
+    # noinspection PyUnresolvedReferences
+    await asyncio.gather(*app.consumer_tasks, return_exceptions=True)
+    # noinspection PyUnresolvedReferences
+    for task in app.background_tasks:
+        task.cancel()
+    # noinspection PyUnresolvedReferences
+    await asyncio.gather(*app.background_tasks, return_exceptions=True)
+    close_spool()
+    await close_nonce_pools()
+    await close_session()
+    await close_smtp_pool()
     # noinspection PyUnresolvedReferences
-    await close_connection(app.cache)
+    await close_lazy_caches(app.caches)
@@ -1,14 +1,24 @@
 """Application middlewares."""
+import logging
+
 from starlette import status
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
 
+from yog_sothoth.api.utils import build_prefix
+from yog_sothoth.api.utils import get_cache_by_alias
+from yog_sothoth.api.utils import get_rate_limit_identifier
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import RATE_LIMIT_CACHE_ALIAS
 from yog_sothoth.conf import settings
 from yog_sothoth.objects import RateLimit
 from .fastapi import app
 
+logger = logging.getLogger(__name__)
+
 # List of defaults for localhost
 ALLOWED_ORIGINS = [
     'http://127.0.0.1:3000',  # Frontend
@@ -16,6 +26,13 @@ ALLOWED_ORIGINS = [
 # HTTPS protocol hardcoded :)
 ALLOWED_ORIGINS.extend(f'https://{host}' for host in settings.ALLOWED_HOSTS)
 
+# Operational endpoints that are periodically polled, not rate limited
+RATE_LIMIT_EXEMPT_PATHS = frozenset(
+    build_prefix(path)
+    for path in (settings.HEALTH_URL_PATH, settings.METRICS_URL_PATH)
+    if path
+)
+
 app.add_middleware(
     TrustedHostMiddleware,
     allowed_hosts=settings.ALLOWED_HOSTS,
@@ -33,17 +50,34 @@ app.add_middleware(
 
 @app.middleware('http')
 async def rate_limit(request: Request, call_next):
-    """Rate limit clients to avoid spammers/lammers."""
-    identifying_headers = ('user-agent', 'x-forwarded-for', 'x-real-ip')
-    identifier_parts = (request.headers.get(header, '')
-                        for header in identifying_headers)
-    identifier = ':'.join(identifier_parts)
-    limiting = RateLimit(request.app.cache, settings.RATE_LIMIT)
-    if await limiting.verify_below(identifier):
+    """Rate limit clients to avoid spammers/lammers.
+
+    If the cache is not available, requests are let through: the rate limit must
+    not take the app down.
+    """
+    if request.url.path in RATE_LIMIT_EXEMPT_PATHS:
+        return await call_next(request)
+
+    identifier = get_rate_limit_identifier(request)
+    try:
+        cache = await get_cache_by_alias(request, RATE_LIMIT_CACHE_ALIAS)
+        limiting = RateLimit(cache, settings.RATE_LIMIT)
+        below_limit = await limiting.verify_below(identifier)
+    except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+        logger.warning('Rate limit skipped because the cache is not available: %s',
+                       repr(exc))
+        below_limit = True
+    if below_limit:
         response = await call_next(request)
         return response
 
-    retry_after = await limiting.get_expiration_time(identifier)
+    try:
+        retry_after = await limiting.get_expiration_time(identifier)
+    except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+        # The counter was just set, so it expires no sooner than this
+        logger.warning('Rate limit expiration time unknown because the cache is not '
+                       'available: %s', repr(exc))
+        retry_after = limiting.compute_expiration_time(limiting.limit)
     return Response(
         'Maximum allowed requests reached',
         status.HTTP_429_TOO_MANY_REQUESTS,
@@ -1,8 +1,44 @@
 """Expose cache utils."""
+from .cache import DEFAULT_CACHE_ALIAS
+from .cache import RATE_LIMIT_CACHE_ALIAS
+from .cache import REGISTRATIONS_CACHE_ALIAS
+from .cache import TASKS_CACHE_ALIAS
+from .cache import close_cache
+from .cache import get_cache_pool
 from .cache import get_default_cache_pool
+from .keys import DIGEST_KEYS
+from .keys import KeySchema
+from .keys import RATE_LIMIT_KEYS
+from .keys import REGISTRATION_KEYS
+from .keys import TASK_KEYS
+from .lazy import CACHE_ERRORS
+from .lazy import CacheState
+from .lazy import CacheUnavailableError
+from .lazy import LazyCache
+from .lazy import close_lazy_caches
+from .lazy import get_lazy_caches
 from .redis import close_connection
+from .redis import get_redis_connection
 
 __all__ = (
-    'get_default_cache_pool',
+    'DEFAULT_CACHE_ALIAS',
+    'RATE_LIMIT_CACHE_ALIAS',
+    'REGISTRATIONS_CACHE_ALIAS',
+    'TASKS_CACHE_ALIAS',
+    'DIGEST_KEYS',
+    'RATE_LIMIT_KEYS',
+    'REGISTRATION_KEYS',
+    'TASK_KEYS',
+    'CACHE_ERRORS',
+    'CacheState',
+    'CacheUnavailableError',
+    'KeySchema',
+    'LazyCache',
+    'close_cache',
     'close_connection',
+    'close_lazy_caches',
+    'get_cache_pool',
+    'get_default_cache_pool',
+    'get_lazy_caches',
+    'get_redis_connection',
 )
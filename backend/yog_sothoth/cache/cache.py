@@ -1,11 +1,35 @@
 """Cache base classes and functions."""
 from aioredis import Redis
 
+from yog_sothoth.conf import settings
+from .pipelining import AutoPipeline
+from .redis import close_connection
 from .redis import get_redis_pool
 
 DEFAULT_CACHE_ALIAS = 'default'
+RATE_LIMIT_CACHE_ALIAS = 'rate_limit'
+REGISTRATIONS_CACHE_ALIAS = 'registrations'
+TASKS_CACHE_ALIAS = 'tasks'
+
+
+async def get_cache_pool(alias: str) -> Redis:
+    """Get a cache connection pool object for the given alias.
+
+    If the alias is configured to, commands are automatically pipelined.
+    """
+    redis = await get_redis_pool(alias)
+    if settings.CACHE[alias].get('AUTO_PIPELINE'):
+        return AutoPipeline(redis, alias=alias)
+    return redis
 
 
 async def get_default_cache_pool() -> Redis:
     """Get a cache connection pool object."""
-    return await get_redis_pool(DEFAULT_CACHE_ALIAS)
+    return await get_cache_pool(DEFAULT_CACHE_ALIAS)
+
+
+async def close_cache(cache: Redis) -> None:
+    """Close the connection for a cache object, sending pending commands first."""
+    if isinstance(cache, AutoPipeline):
+        await cache.flush()
+    await close_connection(cache)
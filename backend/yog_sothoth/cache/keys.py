@@ -0,0 +1,40 @@
+"""Cache keys schema.
+
+Every key is namespaced and versioned as in `<namespace>:<kind>:v<version>:<id>`,
+such as `yog:reg:v1:<rid>`, so that each kind of data can be targeted with
+SCAN MATCH and its format can be changed without a flag day.
+"""
+from typing import NamedTuple
+
+KEY_NAMESPACE = 'yog'
+
+
+class KeySchema(NamedTuple):
+    """Namespaced and versioned key schema for a kind of data."""
+
+    kind: str
+    version: int
+
+    @property
+    def prefix(self) -> str:
+        """Get the prefix shared by every key of this schema."""
+        return f'{KEY_NAMESPACE}:{self.kind}:v{self.version}:'
+
+    @property
+    def pattern(self) -> str:
+        """Get the pattern matching every key of this schema (for SCAN MATCH)."""
+        return f'{self.prefix}*'
+
+    def key(self, identifier: str) -> str:
+        """Get the key for the given identifier."""
+        return f'{self.prefix}{identifier}'
+
+    def identifier(self, key: str) -> str:
+        """Get the identifier from the given key."""
+        return key[len(self.prefix):]
+
+
+DIGEST_KEYS = KeySchema('digest', 1)
+RATE_LIMIT_KEYS = KeySchema('rl', 1)
+REGISTRATION_KEYS = KeySchema('reg', 1)
+TASK_KEYS = KeySchema('task', 1)
@@ -0,0 +1,168 @@
+"""Lazily created cache connection pools."""
+import asyncio
+import logging
+import random
+from enum import Enum
+from time import monotonic
+from typing import Dict
+from typing import Optional
+
+from aioredis import Redis
+from aioredis import RedisError
+
+from yog_sothoth.conf import settings
+from yog_sothoth.utils.metrics import registry
+from .cache import close_cache
+from .cache import get_cache_pool
+
+logger = logging.getLogger(__name__)
+
+cache_ready_gauge = registry.gauge(
+    'yog_cache_ready',
+    'Whether the cache connection pool is ready (1) or not (0)',
+)
+
+# Errors raised when the connection to Redis fails
+CACHE_ERRORS = (OSError, RedisError, asyncio.TimeoutError)
+
+
+class CacheUnavailableError(Exception):
+    """The cache is not available."""
+
+
+class CacheState(str, Enum):
+    """Cache connection pool states."""
+
+    idle = 'idle'
+    connecting = 'connecting'
+    ready = 'ready'
+    unavailable = 'unavailable'
+
+
+class LazyCache:
+    """Cache connection pool that is created on first use.
+
+    If connecting fails, it keeps reconnecting in the background using a jittered
+    exponential back-off, failing fast in the meantime.
+    """
+
+    BACKOFF_BASE = 0.5  # Seconds
+
+    __slots__ = ('alias', '_cache', '_state', '_lock', '_reconnecting')
+
+    def __init__(self, alias: str):
+        """Lazily create a cache connection pool for the given alias."""
+        self.alias: str = alias
+        self._cache: Optional[Redis] = None
+        self._state: CacheState = CacheState.idle
+        self._lock: Optional[asyncio.Lock] = None
+        self._reconnecting: Optional[asyncio.Task] = None
+
+    @property
+    def state(self) -> CacheState:
+        """Get the connection pool state."""
+        return self._state
+
+    def _set_state(self, state: CacheState) -> None:
+        self._state = state
+        cache_ready_gauge.set(int(state == CacheState.ready), alias=self.alias)
+
+    async def _connect(self) -> Redis:
+        if not self._lock:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._cache is None:
+                self._set_state(CacheState.connecting)
+                try:
+                    self._cache = await get_cache_pool(self.alias)
+                except CACHE_ERRORS:
+                    self._set_state(CacheState.unavailable)
+                    raise
+                self._set_state(CacheState.ready)
+                logger.info('Connected to the %s cache', self.alias)
+        return self._cache
+
+    async def _reconnect(self, *, wait_first: bool = True) -> None:
+        attempt = 0
+        while self._cache is None:
+            if wait_first or attempt:
+                # Full jitter: wait a random time up to the exponential back-off
+                backoff = min(settings.REDIS_RECONNECT_MAX_DELAY,
+                              self.BACKOFF_BASE * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, backoff))  # noqa: S311  # nosec
+            attempt += 1
+            try:
+                await self._connect()
+            except CACHE_ERRORS as exc:
+                logger.warning('Connection attempt %d to the %s cache failed: %s',
+                               attempt, self.alias, repr(exc))
+
+    def _start_reconnecting(self, *, wait_first: bool = True) -> None:
+        if not self._reconnecting or self._reconnecting.done():
+            self._reconnecting = asyncio.ensure_future(
+                self._reconnect(wait_first=wait_first),
+            )
+
+    def warm_up(self) -> None:
+        """Start connecting in the background, without waiting for it."""
+        if self._cache is None:
+            self._start_reconnecting(wait_first=False)
+
+    async def get(self) -> Redis:
+        """Get the cache connection pool, creating it if necessary.
+
+        :raises CacheUnavailableError: The cache is not available at the moment.
+        """
+        if self._cache is not None:
+            return self._cache
+        reconnecting = self._reconnecting and not self._reconnecting.done()
+        if reconnecting and self._state == CacheState.unavailable:
+            # Fail fast while waiting for the next reconnection attempt
+            raise CacheUnavailableError(f'The {self.alias} cache is not available')
+
+        try:
+            return await self._connect()
+        except CACHE_ERRORS as exc:
+            logger.warning('Could not connect to the %s cache: %s', self.alias,
+                           repr(exc))
+            self._start_reconnecting()
+            raise CacheUnavailableError(
+                f'The {self.alias} cache is not available',
+            ) from exc
+
+    async def ping(self) -> float:
+        """Ping the cache.
+
+        :return: Round-trip time in seconds.
+        :raises CacheUnavailableError: The cache is not available at the moment.
+        """
+        cache = await self.get()
+        start = monotonic()
+        try:
+            await cache.ping()
+        except CACHE_ERRORS as exc:
+            self._set_state(CacheState.unavailable)
+            raise CacheUnavailableError(
+                f'The {self.alias} cache is not available',
+            ) from exc
+        self._set_state(CacheState.ready)
+        return monotonic() - start
+
+    async def close(self) -> None:
+        """Stop reconnecting and close the connection pool if any."""
+        if self._reconnecting:
+            self._reconnecting.cancel()
+        if self._cache is not None:
+            await close_cache(self._cache)
+            self._cache = None
+        self._set_state(CacheState.idle)
+
+
+def get_lazy_caches() -> Dict[str, LazyCache]:
+    """Get a lazily created cache connection pool for every defined alias."""
+    return {alias: LazyCache(alias) for alias in settings.CACHE}
+
+
+async def close_lazy_caches(caches: Dict[str, LazyCache]) -> None:
+    """Close every lazily created cache connection pool."""
+    await asyncio.gather(*(cache.close() for cache in caches.values()))
@@ -0,0 +1,192 @@
+"""Cache keys migrations.
+
+Rewrite the keys stored before the keys schema existed into their namespaced
+and versioned form. The keyspace is streamed with SCAN and keys are moved in
+pipelined batches using DUMP and RESTORE, which preserves their TTL and allows
+moving them to a different Redis.
+
+Run it with: `python -m yog_sothoth.cache.migrations --help`
+"""
+import argparse
+import asyncio
+import logging
+import re
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Pattern
+
+from aioredis import Redis
+from aioredis import ReplyError
+
+from .cache import DEFAULT_CACHE_ALIAS
+from .cache import RATE_LIMIT_CACHE_ALIAS
+from .cache import REGISTRATIONS_CACHE_ALIAS
+from .cache import close_cache
+from .cache import get_cache_pool
+from .keys import RATE_LIMIT_KEYS
+from .keys import REGISTRATION_KEYS
+
+logger = logging.getLogger(__name__)
+
+
+class KeysMigration(NamedTuple):
+    """Keys migration definition."""
+
+    alias: str  # Cache alias where keys are migrated to
+    match: str  # SCAN MATCH pattern for legacy keys
+    regex: Pattern  # Legacy keys filter, because MATCH is not precise enough
+    rename: Callable[[str], str]  # Get the new key from a legacy one
+
+
+class MigrationStats(NamedTuple):
+    """Keys migration statistics."""
+
+    migrated: int = 0
+    skipped: int = 0
+    failed: int = 0
+
+    def __add__(self, other: 'MigrationStats') -> 'MigrationStats':
+        """Add up statistics."""
+        return MigrationStats(*(mine + theirs for mine, theirs in zip(self, other)))
+
+
+MIGRATIONS = (
+    # Registrations were stored under the bare RID
+    KeysMigration(
+        alias=REGISTRATIONS_CACHE_ALIAS,
+        match='??????',
+        regex=re.compile(r'^[\w-]{6}$'),
+        rename=REGISTRATION_KEYS.key,
+    ),
+    # Rate limit counters were stored as `RateLimit:<hash>`
+    KeysMigration(
+        alias=RATE_LIMIT_CACHE_ALIAS,
+        match='RateLimit:*',
+        regex=re.compile(r'^RateLimit:[0-9a-f]{32}$'),
+        rename=lambda key: RATE_LIMIT_KEYS.key(key.split(':', 1)[1]),
+    ),
+)
+
+
+async def migrate_batch(source: Redis,
+                        target: Redis,
+                        migration: KeysMigration,
+                        keys: List[str],
+                        *,
+                        dry_run: bool = False) -> MigrationStats:
+    """Migrate a batch of legacy keys from the source cache to the target one.
+
+    If a key already exists in the target it means that it was written after
+    the keys schema was deployed, so it's newer and the legacy key is discarded.
+    """
+    pipe = source.pipeline()
+    for key in keys:
+        pipe.pttl(key)
+        pipe.dump(key)
+    dumped = await pipe.execute()
+
+    pending = [(key, ttl, value)
+               for key, ttl, value in zip(keys, dumped[::2], dumped[1::2])
+               if value is not None]  # Otherwise it expired in the meantime
+    skipped = len(keys) - len(pending)
+    if dry_run:
+        return MigrationStats(migrated=len(pending), skipped=skipped)
+    if not pending:
+        return MigrationStats(skipped=skipped)
+
+    pipe = target.pipeline()
+    for key, ttl, value in pending:
+        pipe.restore(migration.rename(key), max(ttl, 0), value)
+    restored = await pipe.execute(return_exceptions=True)
+
+    migrated = failed = 0
+    done = []
+    for (key, _, _), result in zip(pending, restored):
+        if isinstance(result, ReplyError) and str(result).startswith('BUSYKEY'):
+            skipped += 1
+            done.append(key)
+        elif isinstance(result, Exception):
+            logger.warning('Could not migrate key %s: %s', key, repr(result))
+            failed += 1
+        else:
+            migrated += 1
+            done.append(key)
+    if done:
+        await source.delete(*done)
+    return MigrationStats(migrated, skipped, failed)
+
+
+async def migrate(source: Redis,
+                  target: Redis,
+                  migration: KeysMigration,
+                  *,
+                  batch_size: int = 500,
+                  dry_run: bool = False) -> MigrationStats:
+    """Migrate every legacy key from the source cache to the target one."""
+    stats = MigrationStats()
+    batch = []
+    async for key in source.iscan(match=migration.match, count=batch_size):
+        key = key.decode() if isinstance(key, bytes) else key
+        if not migration.regex.match(key):
+            continue
+        batch.append(key)
+        if len(batch) >= batch_size:
+            stats += await migrate_batch(source, target, migration, batch,
+                                         dry_run=dry_run)
+            batch = []
+            logger.debug('Migrating %s keys: %s', migration.alias, stats)
+    if batch:
+        stats += await migrate_batch(source, target, migration, batch, dry_run=dry_run)
+    return stats
+
+
+async def migrate_all(*,
+                      source_alias: str = DEFAULT_CACHE_ALIAS,
+                      batch_size: int = 500,
+                      dry_run: bool = False) -> Dict[str, MigrationStats]:
+    """Migrate every legacy key to the keys schema.
+
+    :return: Migration statistics per target cache alias.
+    """
+    results = {}
+    source = await get_cache_pool(source_alias)
+    try:
+        for migration in MIGRATIONS:
+            target = await get_cache_pool(migration.alias)
+            try:
+                results[migration.alias] = await migrate(source, target, migration,
+                                                         batch_size=batch_size,
+                                                         dry_run=dry_run)
+            finally:
+                await close_cache(target)
+    finally:
+        await close_cache(source)
+    return results
+
+
+def main() -> None:
+    """Run the keys migration from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Migrate cache keys to the namespaced and versioned keys schema.',
+    )
+    parser.add_argument('--source', default=DEFAULT_CACHE_ALIAS,
+                        help='cache alias where legacy keys are stored '
+                             '(defaults to %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='keys per pipelined batch (defaults to %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='count keys to migrate without changing anything')
+    args = parser.parse_args()
+    results = asyncio.run(migrate_all(source_alias=args.source,
+                                      batch_size=args.batch_size,
+                                      dry_run=args.dry_run))
+    for alias, stats in results.items():
+        print(f'{alias}{" (dry run)" if args.dry_run else ""}: '
+              f'{stats.migrated} migrated, {stats.skipped} skipped, '
+              f'{stats.failed} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Automatic Redis commands pipelining.
+
+Commands issued within the same event loop tick, by any coroutine in the
+worker, are coalesced and sent in a single pipeline write instead of one write
+and one round trip each.
+"""
+import asyncio
+import logging
+from typing import Callable
+from typing import List
+from typing import Set
+from typing import Tuple
+
+from aioredis import Redis
+
+from yog_sothoth.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TQueuedCommand = Tuple[str, tuple, dict, asyncio.Future]
+
+batch_size_histogram = registry.histogram(
+    'yog_cache_pipeline_batch_size',
+    'Number of commands sent per automatic pipeline flush',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class AutoPipeline:
+    """Redis commands proxy that automatically pipelines commands.
+
+    Every command is queued and returns a future, and the queue is flushed as a
+    single pipeline on the next event loop iteration.
+    """
+
+    # Attributes that are not commands or must not be pipelined, such as blocking
+    # commands, commands altering the connection state and iterators
+    PASSTHROUGH = frozenset((
+        'auth', 'blpop', 'brpop', 'brpoplpush', 'bzpopmax', 'bzpopmin', 'close',
+        'execute', 'execute_pubsub', 'ihscan', 'iscan', 'isscan', 'izscan',
+        'multi_exec', 'pipeline', 'psubscribe', 'punsubscribe', 'quit', 'select',
+        'subscribe', 'unsubscribe', 'wait', 'wait_closed', 'xread', 'xread_group',
+    ))
+
+    __slots__ = ('_redis', '_alias', '_queue', '_flushing')
+
+    def __init__(self, redis: Redis, *, alias: str = ''):
+        """Automatically pipeline commands sent to the given Redis.
+
+        :param redis: Redis object to send commands through.
+        :param alias: [optional] Cache alias, used to label metrics.
+        """
+        self._redis: Redis = redis
+        self._alias: str = alias
+        self._queue: List[TQueuedCommand] = []
+        self._flushing: Set[asyncio.Future] = set()
+
+    def __repr__(self) -> str:
+        """Get the object representation."""
+        return f'<{self.__class__.__name__} {self._redis!r}>'
+
+    def __getattr__(self, name: str) -> any:
+        """Get a Redis attribute, wrapping commands to be pipelined."""
+        attr = getattr(self._redis, name)
+        if name in self.PASSTHROUGH or name[0] == '_' or not callable(attr):
+            return attr
+        return self._command(name)
+
+    @property
+    def redis(self) -> Redis:
+        """Get the underlying Redis object."""
+        return self._redis
+
+    def _command(self, name: str) -> Callable[..., asyncio.Future]:
+        def command(*args, **kwargs) -> asyncio.Future:
+            loop = asyncio.get_event_loop()
+            future = loop.create_future()
+            if not self._queue:
+                loop.call_soon(self._flush)
+            self._queue.append((name, args, kwargs, future))
+            return future
+
+        return command
+
+    def _flush(self) -> None:
+        queue, self._queue = self._queue, []
+        if not queue:  # Already flushed
+            return
+        flushing = asyncio.ensure_future(self._execute(queue))
+        self._flushing.add(flushing)
+        flushing.add_done_callback(self._flushing.discard)
+
+    async def _execute(self, queue: List[TQueuedCommand]) -> None:
+        batch_size_histogram.observe(len(queue), alias=self._alias)
+        if len(queue) == 1:
+            # No need for a pipeline
+            name, args, kwargs, future = queue[0]
+            try:
+                result = await getattr(self._redis, name)(*args, **kwargs)
+            except Exception as exc:  # noqa: B902  # Deliver any error to the caller
+                result = exc
+            self._resolve(future, result)
+            return
+
+        pipe = self._redis.pipeline()
+        for name, args, kwargs, _ in queue:
+            getattr(pipe, name)(*args, **kwargs)
+        try:
+            results = await pipe.execute(return_exceptions=True)
+        except Exception as exc:  # noqa: B902  # Deliver any error to the callers
+            logger.warning('Error executing a pipeline of %d commands: %s', len(queue),
+                           repr(exc))
+            results = [exc] * len(queue)
+        for (*_, future), result in zip(queue, results):
+            self._resolve(future, result)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: any) -> None:
+        if future.done():  # Cancelled by the caller
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    async def flush(self) -> None:
+        """Wait for every queued command to be sent and its result received."""
+        if self._queue:
+            # Flush right away instead of waiting for the next loop iteration
+            self._flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
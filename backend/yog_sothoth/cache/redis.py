@@ -20,6 +20,16 @@ async def get_redis_pool(alias: str) -> aioredis.Redis:
     return await aioredis.create_redis_pool(address, **opts)
 
 
+async def get_redis_connection(alias: str) -> aioredis.Redis:
+    """Get a single, dedicated Redis connection object.
+
+    Use it for blocking commands, which would otherwise hold a pooled connection
+    shared by other commands.
+    """
+    address, opts = get_address_and_options(alias)
+    return await aioredis.create_redis(address, **opts)
+
+
 async def close_connection(cache: aioredis.Redis) -> None:
     """Close the connection for a Redis cache object."""
     cache.close()
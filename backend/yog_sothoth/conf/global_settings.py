@@ -1,5 +1,6 @@
 """Settings for Yog-Sothoth."""
 import os
+from typing import Dict
 from typing import Optional
 from typing import Tuple
 
@@ -8,7 +9,7 @@ BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # Development mode: this mode sets email usage to a local `aiosmtpd` server for
 # development, enables debug, sets log level to debug and fakes Matrix
-# registration using and internal fake API.
+# registration using a local Matrix homeserver stand-in (see `inv matrix`).
 _development_mode: str = os.getenv('YOG_DEVELOPMENT_MODE', 'false')
 DEVELOPMENT_MODE: bool = True if _development_mode.lower() == 'true' else False
 
@@ -18,13 +19,82 @@ REDIS_PORT: int = int(os.getenv('YOG_REDIS_PORT', 6379))
 REDIS_PASSWORD: Optional[str] = os.getenv('YOG_REDIS_PASSWORD')
 REDIS_DB: int = int(os.getenv('YOG_REDIS_DB', 0))
 REDIS_CONNECTION_TIMEOUT: int = int(os.getenv('YOG_REDIS_CONNECTION_TIMEOUT', 2))
+# Maximum delay in seconds between reconnection attempts: connection pools are
+# created on first use and reconnected in the background using a jittered
+# exponential back-off when the connection fails
+REDIS_RECONNECT_MAX_DELAY: int = int(os.getenv('YOG_REDIS_RECONNECT_MAX_DELAY', 30))
 
-# Cache definition
+# Redis URLs for each cache alias (with protocol, such as redis://host:port/db),
+# they all default to the Redis defined above. Set them to split data with
+# different requirements in different Redis instances: rate limit counters are
+# throwaway values that can live in a volatile LRU Redis while registrations
+# must live in a Redis with a noeviction policy. A password included in the URL
+# takes precedence over the Redis password setting.
+_redis_default_url = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
+REDIS_RATE_LIMIT_URL: str = os.getenv('YOG_REDIS_RATE_LIMIT_URL', _redis_default_url)
+REDIS_REGISTRATIONS_URL: str = os.getenv('YOG_REDIS_REGISTRATIONS_URL',
+                                         _redis_default_url)
+REDIS_TASKS_URL: str = os.getenv('YOG_REDIS_TASKS_URL', _redis_default_url)
+
+# Cache definition: each alias gets its own connection pool
 CACHE_TTL: int = int(os.getenv('YOG_CACHE_TTL', 48 * 3600))
+# Time to live in seconds for finished registrations: rejected ones and those
+# whose Matrix account creation finished, successfully or not (defaults to 12hs)
+CACHE_TTL_FINISHED: int = int(os.getenv('YOG_CACHE_TTL_FINISHED', 12 * 3600))
+# Registrations time to live policy per (status, matrix_status) as a tuple of
+# (time to live in seconds, keep expiry): keep expiry means that saving an
+# already stored registration keeps its current expiry instead of resetting it.
+# Registrations not listed here live for CACHE_TTL since they were last saved.
+CACHE_TTL_POLICY: Dict[Tuple[str, str], Tuple[int, bool]] = {
+    ('pending', 'pending'): (CACHE_TTL, True),
+    ('rejected', 'pending'): (CACHE_TTL_FINISHED, False),
+    ('approved', 'processing'): (CACHE_TTL, True),
+    ('approved', 'success'): (CACHE_TTL_FINISHED, False),
+    ('approved', 'failed'): (CACHE_TTL_FINISHED, False),
+}
+# Read registrations from their legacy key (the bare RID) when not found under
+# the namespaced key: enable it during the transition window, until the keys
+# are migrated with `inv migrate-keys` (defaults to true)
+_cache_legacy_keys_fallback = os.getenv('YOG_CACHE_LEGACY_KEYS_FALLBACK', 'true')
+CACHE_LEGACY_KEYS_FALLBACK: bool = (
+    True if _cache_legacy_keys_fallback.lower() == 'true' else False
+)
+# Automatically pipeline commands issued within the same event loop tick, across
+# concurrent requests, to save round trips (defaults to true)
+_cache_auto_pipeline = os.getenv('YOG_CACHE_AUTO_PIPELINE', 'true')
+CACHE_AUTO_PIPELINE: bool = True if _cache_auto_pipeline.lower() == 'true' else False
 CACHE = {
     'default': {
         'BACKEND': 'yog_sothoth.cache.redis',
-        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        'LOCATION': _redis_default_url,
+        'AUTO_PIPELINE': CACHE_AUTO_PIPELINE,
+        'OPTIONS': {
+            'PASSWORD': REDIS_PASSWORD,
+            'TIMEOUT': REDIS_CONNECTION_TIMEOUT,
+        },
+    },
+    'rate_limit': {
+        'BACKEND': 'yog_sothoth.cache.redis',
+        'LOCATION': REDIS_RATE_LIMIT_URL,
+        'AUTO_PIPELINE': CACHE_AUTO_PIPELINE,
+        'OPTIONS': {
+            'PASSWORD': REDIS_PASSWORD,
+            'TIMEOUT': REDIS_CONNECTION_TIMEOUT,
+        },
+    },
+    'registrations': {
+        'BACKEND': 'yog_sothoth.cache.redis',
+        'LOCATION': REDIS_REGISTRATIONS_URL,
+        'AUTO_PIPELINE': CACHE_AUTO_PIPELINE,
+        'OPTIONS': {
+            'PASSWORD': REDIS_PASSWORD,
+            'TIMEOUT': REDIS_CONNECTION_TIMEOUT,
+        },
+    },
+    'tasks': {
+        'BACKEND': 'yog_sothoth.cache.redis',
+        'LOCATION': REDIS_TASKS_URL,
+        'AUTO_PIPELINE': CACHE_AUTO_PIPELINE,
         'OPTIONS': {
             'PASSWORD': REDIS_PASSWORD,
             'TIMEOUT': REDIS_CONNECTION_TIMEOUT,
@@ -32,12 +102,62 @@ CACHE = {
     },
 }
 
+# Durable task queue, kept in the tasks cache, for notifications and Matrix
+# account creation
+# Seconds a job can go without a heartbeat from its consumer before being
+# reclaimed by another one (failed jobs are retried after it as well)
+TASKS_VISIBILITY_TIMEOUT: int = int(os.getenv('YOG_TASKS_VISIBILITY_TIMEOUT', 60))
+# Maximum deliveries of a job before moving it to the dead letter stream
+TASKS_MAX_DELIVERIES: int = int(os.getenv('YOG_TASKS_MAX_DELIVERIES', 5))
+# Approximate maximum number of jobs kept in the dead letter stream
+TASKS_DEAD_LETTER_MAX_LENGTH: int = int(
+    os.getenv('YOG_TASKS_DEAD_LETTER_MAX_LENGTH', 1000),
+)
+# Seconds to delay notifying managers of a new registration request, so that they
+# are not notified if it's deleted meanwhile (0 to notify them right away)
+TASKS_MANAGERS_NOTIFICATION_DELAY: int = int(
+    os.getenv('YOG_TASKS_MANAGERS_NOTIFICATION_DELAY', 300),
+)
+# Maximum number of jobs of each queue run at the same time by each app worker,
+# 0 to leave them to dedicated task workers
+TASKS_CONSUMER_CONCURRENCY: int = int(os.getenv('YOG_TASKS_CONSUMER_CONCURRENCY', 10))
+# Seconds each app worker waits on shutdown for its running jobs and background
+# tasks to finish before closing connections (the unfinished ones are retried).
+# Keep it below gunicorn's graceful_timeout, when the worker is killed
+TASKS_SHUTDOWN_DRAIN_TIMEOUT: int = int(
+    os.getenv('YOG_TASKS_SHUTDOWN_DRAIN_TIMEOUT', 20),
+)
+# Dedicated task workers (`python -m yog_sothoth.worker`)
+# Maximum number of email jobs run at the same time by each task worker
+TASKS_WORKER_EMAIL_CONCURRENCY: int = int(
+    os.getenv('YOG_TASKS_WORKER_EMAIL_CONCURRENCY', 20),
+)
+# Maximum number of Matrix account creation jobs run at the same time by each
+# task worker
+TASKS_WORKER_MATRIX_CONCURRENCY: int = int(
+    os.getenv('YOG_TASKS_WORKER_MATRIX_CONCURRENCY', 5),
+)
+# Seconds to wait for running jobs to finish when the task worker is stopped
+# (the unfinished ones are retried)
+TASKS_WORKER_DRAIN_TIMEOUT: int = int(os.getenv('YOG_TASKS_WORKER_DRAIN_TIMEOUT', 30))
+# Address where the task worker exposes its metrics in Prometheus text format at
+# /metrics (port 0 to disable)
+TASKS_WORKER_METRICS_HOST: str = os.getenv('YOG_TASKS_WORKER_METRICS_HOST',
+                                           '127.0.0.1')
+TASKS_WORKER_METRICS_PORT: int = int(os.getenv('YOG_TASKS_WORKER_METRICS_PORT', 9100))
+
 # Prefix for your API, such as /api/yog or /yog (must begin with slash)
 API_PREFIX: str = os.getenv('YOG_API_PREFIX', '').rstrip('/')
 # Misc URLs (must begin with slash)
 OPENAPI_URL_PATH: str = os.getenv('YOG_OPENAPI_URL_PATH', '/openapi.json').rstrip('/')
 DOCS_URL_PATH: str = os.getenv('YOG_DOCS_URL_PATH', '/docs').rstrip('/')
 REDOC_URL_PATH: str = os.getenv('YOG_REDOC_URL_PATH', '/redoc').rstrip('/')
+# Health URL path, exposing each worker readiness and dependencies state
+# (must begin with slash, empty to disable)
+HEALTH_URL_PATH: str = os.getenv('YOG_HEALTH_URL_PATH', '/health').rstrip('/')
+# Metrics URL path, exposing each worker metrics in Prometheus text format
+# (must begin with slash, empty to disable)
+METRICS_URL_PATH: str = os.getenv('YOG_METRICS_URL_PATH', '/metrics').rstrip('/')
 
 # Frontend URL if any (with protocol)
 FRONTEND_URL: str = os.getenv('YOG_FRONTEND_URL', '')
@@ -52,9 +172,89 @@ MATRIX_URL: str = os.getenv('YOG_MATRIX_URL', '').rstrip('/')
 MATRIX_REGISTRATION_SHARED_SECRET: Optional[str] = os.getenv(
     'YOG_MATRIX_REGISTRATION_SHARED_SECRET',
 )
+# Matrix accounts bulk creation by managers
+# Maximum number of accounts being created at the same time
+MATRIX_BULK_CONCURRENCY: int = int(os.getenv('YOG_MATRIX_BULK_CONCURRENCY', 10))
+# Maximum number of accounts per request
+MATRIX_BULK_MAX_ITEMS: int = int(os.getenv('YOG_MATRIX_BULK_MAX_ITEMS', 20))
+# Accounts per request counted as one more request for the rate limit
+MATRIX_BULK_RATE_LIMIT_ITEMS: int = int(
+    os.getenv('YOG_MATRIX_BULK_RATE_LIMIT_ITEMS', 10),
+)
+# Incorrect manager tokens after which the rest of the request is not processed
+MATRIX_BULK_MAX_FAILED_VERIFICATIONS: int = int(
+    os.getenv('YOG_MATRIX_BULK_MAX_FAILED_VERIFICATIONS', 3),
+)
+# Seconds to cache the Matrix homeserver API version (it's refreshed in the
+# background before expiring)
+MATRIX_API_VERSION_TTL: int = int(os.getenv('YOG_MATRIX_API_VERSION_TTL', 3600))
+# Matrix usernames availability is checked before creating an account, and
+# cached per worker
+# Seconds to cache an available username (it can be taken at any moment)
+MATRIX_USERNAME_AVAILABLE_TTL: int = int(
+    os.getenv('YOG_MATRIX_USERNAME_AVAILABLE_TTL', 10),
+)
+# Seconds to cache an unavailable username
+MATRIX_USERNAME_UNAVAILABLE_TTL: int = int(
+    os.getenv('YOG_MATRIX_USERNAME_UNAVAILABLE_TTL', 600),
+)
+# Registration nonces of the Matrix homeserver are prefetched in the background
+# so that creating an account takes a single request (only when using the
+# registration shared secret)
+# Maximum number of prefetched nonces (0 to disable)
+MATRIX_NONCE_POOL_SIZE: int = int(os.getenv('YOG_MATRIX_NONCE_POOL_SIZE', 2))
+# Maximum age in seconds of a prefetched nonce (must be lower than the
+# homeserver nonce timeout, which is 60s in Synapse)
+MATRIX_NONCE_MAX_AGE: int = int(os.getenv('YOG_MATRIX_NONCE_MAX_AGE', 30))
+# Requests to the Matrix homeserver are retried on transient errors, waiting a
+# jittered exponential back-off between attempts (account creation is only
+# retried when the homeserver certainly didn't process it)
+# Total attempts, including the first one
+MATRIX_RETRY_MAX_ATTEMPTS: int = int(os.getenv('YOG_MATRIX_RETRY_MAX_ATTEMPTS', 3))
+# Total time budget in seconds for each request including retries (0 for no limit)
+MATRIX_RETRY_DEADLINE: int = int(os.getenv('YOG_MATRIX_RETRY_DEADLINE', 30))
+# Seconds after which a concurrent attempt is started for idempotent requests if
+# the first one didn't finish (0 to disable)
+MATRIX_HEDGE_AFTER: float = float(os.getenv('YOG_MATRIX_HEDGE_AFTER', 2))
+# Circuit breaker for the Matrix homeserver (per worker): when the failure rate
+# of the latest account creations reaches the threshold, it opens and account
+# creations are deferred without contacting the homeserver, until it gets
+# half-open and lets a probe through
+# Failure rate (from 0 to 1) that opens the circuit breaker
+MATRIX_CIRCUIT_BREAKER_FAILURE_RATE: float = float(
+    os.getenv('YOG_MATRIX_CIRCUIT_BREAKER_FAILURE_RATE', 0.5),
+)
+# Minimum number of account creations to compute the failure rate
+MATRIX_CIRCUIT_BREAKER_MINIMUM_CALLS: int = int(
+    os.getenv('YOG_MATRIX_CIRCUIT_BREAKER_MINIMUM_CALLS', 3),
+)
+# Seconds to stay open before letting a probe through
+MATRIX_CIRCUIT_BREAKER_OPEN_TIMEOUT: int = int(
+    os.getenv('YOG_MATRIX_CIRCUIT_BREAKER_OPEN_TIMEOUT', 30),
+)
+# Maximum seconds to defer an account creation while the homeserver is
+# unavailable, after which it fails
+MATRIX_DEFER_TIMEOUT: int = int(os.getenv('YOG_MATRIX_DEFER_TIMEOUT', 300))
+# Account creations are paced per worker so as to not exceed the Matrix
+# homeserver rate limits; when exceeded anyway, they are held for as long as the
+# homeserver says (M_LIMIT_EXCEEDED)
+# Account creations per second (0 for no pacing until told to wait)
+MATRIX_RATE_LIMIT: float = float(os.getenv('YOG_MATRIX_RATE_LIMIT', 0))
+# Account creations that can be made at once
+MATRIX_RATE_LIMIT_BURST: int = int(os.getenv('YOG_MATRIX_RATE_LIMIT_BURST', 5))
 
 # Default timeout for requests done from the app
 REQUESTS_TIMEOUT: int = int(os.getenv('YOG_REQUEST_TIMEOUT', 5))
+# Connection pool for requests done from the app: idle connections are kept
+# open to be reused by following requests to the same host
+# Maximum simultaneous connections (0 for no limit)
+REQUESTS_POOL_LIMIT: int = int(os.getenv('YOG_REQUESTS_POOL_LIMIT', 100))
+# Maximum simultaneous connections to the same host (0 for no limit)
+REQUESTS_POOL_LIMIT_PER_HOST: int = int(
+    os.getenv('YOG_REQUESTS_POOL_LIMIT_PER_HOST', 10),
+)
+# Seconds to keep idle connections open
+REQUESTS_KEEPALIVE_TIMEOUT: int = int(os.getenv('YOG_REQUESTS_KEEPALIVE_TIMEOUT', 30))
 
 # Application allowed hosts: used to check the Host header and CORS. The first
 # one is considered the main one.
@@ -117,12 +317,34 @@ EMAIL_USE_TLS: bool = True if _email_tls.lower() == 'true' else False
 EMAIL_SENDER_ADDRESS: str = os.getenv('YOG_EMAIL_SENDER_ADDRESS', '')
 # Email subject prefix (used as is, you might want to leave a space at the end)
 EMAIL_SUBJECT_PREFIX: str = os.getenv('YOG_EMAIL_SUBJECT_PREFIX', '[Yog Sothtoth] ')
+# Emails are sent through a pool of connections to the email host, reused to
+# avoid negotiating TLS and logging in for every email.
+# Maximum number of connections open at the same time by each worker
+EMAIL_POOL_SIZE: int = int(os.getenv('YOG_EMAIL_POOL_SIZE', 5))
+# Maximum number of emails sent through a connection before closing it (0 for no
+# limit)
+EMAIL_POOL_MAX_MESSAGES: int = int(os.getenv('YOG_EMAIL_POOL_MAX_MESSAGES', 100))
+# Seconds to keep idle connections open
+EMAIL_POOL_MAX_IDLE: int = int(os.getenv('YOG_EMAIL_POOL_MAX_IDLE', 60))
+
+# Independent notifications are sent concurrently: maximum number of email
+# notifications sent at the same time by each worker
+NOTIFICATIONS_EMAIL_CONCURRENCY: int = int(
+    os.getenv('YOG_NOTIFICATIONS_EMAIL_CONCURRENCY', 10),
+)
 
 # Managers email addresses comma-separated
 _managers_addresses = os.getenv('YOG_MANAGERS_ADDRESSES', '')
 MANAGERS_ADDRESSES: Tuple[str] = tuple(
     email.strip() for email in _managers_addresses.split(',') if email
 )
+# Managers notifications digest: events are buffered in the registrations cache
+# and sent to managers in a single summary email
+# Seconds to buffer events for since the oldest one, 0 to disable and send an
+# email per event
+MANAGERS_DIGEST_WINDOW: int = int(os.getenv('YOG_MANAGERS_DIGEST_WINDOW', 0))
+# Maximum number of events per digest: it's sent right away when reached
+MANAGERS_DIGEST_MAX_EVENTS: int = int(os.getenv('YOG_MANAGERS_DIGEST_MAX_EVENTS', 100))
 
 # Contact email address to use in emails body to users and other parts
 # (it will be public)
@@ -158,6 +380,8 @@ RATE_LIMIT = int(os.getenv('YOG_RATE_LIMIT', 5))
 OPTIONAL_SETTINGS = {
     'REDIS_PASSWORD',
     'API_PREFIX',
+    'HEALTH_URL_PATH',
+    'METRICS_URL_PATH',
     'FRONTEND_URL',
     'EMAIL_USERNAME',
     'EMAIL_PASSWORD',
@@ -80,6 +80,7 @@ timeout = 30
 # graceful_timeout - Timeout for graceful workers restart
 # How max time worker can handle request after got restart signal.
 # If the time is up worker will be force killed.
+# Keep it above YOG_TASKS_SHUTDOWN_DRAIN_TIMEOUT, so background tasks are drained.
 graceful_timeout = 30
 
 # keep_alive - The number of seconds to wait for requests on a
@@ -1,15 +1,35 @@
 """Handle Matrix account creation."""
+import asyncio
+import functools
 import hashlib
 import hmac
+import logging
+from collections import deque
 from dataclasses import dataclass
 from dataclasses import field
+from dataclasses import replace
+from time import monotonic
+from typing import Awaitable
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
 from typing import NamedTuple
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 from yog_sothoth.conf import settings
 from yog_sothoth.objects import Registration
+from yog_sothoth.utils.circuit_breaker import CircuitBreaker
+from yog_sothoth.utils.circuit_breaker import CircuitOpenError
+from yog_sothoth.utils.connectors import FullDataResponse
 from yog_sothoth.utils.connectors import JSONConnectorAsync
+from yog_sothoth.utils.connectors import NO_RETRY
+from yog_sothoth.utils.connectors import RetryPolicy
+from yog_sothoth.utils.pacing import TokenBucket
+
+logger = logging.getLogger(__name__)
 
 
 class MatrixError(Exception):
@@ -24,6 +44,47 @@ class MatrixResponseError(MatrixError):
     """Matrix response error."""
 
 
+class MatrixRejectedError(MatrixError):
+    """Matrix homeserver rejected the request (i.e. M_USER_IN_USE).
+
+    The homeserver works: the request itself is wrong.
+    """
+
+    def __init__(self, message: str, errcode: Optional[str] = None):
+        """Matrix homeserver rejected the request.
+
+        :param message: Error message.
+        :param errcode: [optional] Matrix error code, if any.
+        """
+        super().__init__(message, errcode)
+        self.errcode: Optional[str] = errcode
+
+    def __str__(self) -> str:
+        """Get the error message."""
+        return str(self.args[0])
+
+
+class MatrixUnavailableError(MatrixError):
+    """Matrix homeserver is unavailable: the request was not made."""
+
+    def __init__(self, message: str, retry_after: float):
+        """Matrix homeserver is unavailable.
+
+        :param message: Error message.
+        :param retry_after: Seconds until the homeserver can be tried again.
+        """
+        super().__init__(message, retry_after)
+        self.retry_after: float = retry_after
+
+    def __str__(self) -> str:
+        """Get the error message."""
+        return str(self.args[0])
+
+
+class MatrixRateLimitedError(MatrixUnavailableError):
+    """Matrix homeserver rate limit was exceeded (M_LIMIT_EXCEEDED)."""
+
+
 class MatrixAccount(NamedTuple):
     """Matrix account object after being created."""
 
@@ -31,6 +92,107 @@ class MatrixAccount(NamedTuple):
     home_server: str
 
 
+class _CachedAPIVersion(NamedTuple):
+    version: str
+    expires_at: float
+
+
+# Process-wide API version cache by server URL
+_api_versions: Dict[str, _CachedAPIVersion] = {}
+_api_version_locks: Dict[str, asyncio.Lock] = {}
+
+
+class _CachedAvailability(NamedTuple):
+    available: bool
+    expires_at: float
+
+
+# Process-wide username availability cache and checks in progress by server URL
+# and username
+_username_availability: Dict[Tuple[str, str], _CachedAvailability] = {}
+_username_checks: Dict[Tuple[str, str], asyncio.Future] = {}
+USERNAME_AVAILABILITY_MAX_CACHED = 10000
+
+
+class _PrefetchedNonce(NamedTuple):
+    nonce: str
+    fetched_at: float
+
+
+class NoncePool:
+    """Bounded pool of prefetched registration nonces of a homeserver.
+
+    Nonces are single use and expire in the homeserver (after 60 seconds in
+    Synapse), so they are kept up to a maximum age. The pool is refilled in the
+    background whenever a nonce is taken.
+    """
+
+    __slots__ = ('size', 'max_age', '_fetch', '_nonces', '_refilling')
+
+    def __init__(self, fetch: Callable[[], Awaitable[str]], *, size: int,
+                 max_age: float):
+        """Pool of nonces fetched by the given callable.
+
+        :param fetch: Async callable that fetches a nonce from the homeserver.
+        :param size: Maximum number of prefetched nonces.
+        :param max_age: Maximum age of a prefetched nonce in seconds.
+        """
+        self.size: int = size
+        self.max_age: float = max_age
+        self._fetch: Callable[[], Awaitable[str]] = fetch
+        self._nonces: Deque[_PrefetchedNonce] = deque()
+        self._refilling: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Get the number of prefetched nonces, including expired ones."""
+        return len(self._nonces)
+
+    def _purge(self) -> None:
+        oldest_allowed = monotonic() - self.max_age
+        while self._nonces and self._nonces[0].fetched_at < oldest_allowed:
+            self._nonces.popleft()
+
+    async def _refill(self) -> None:
+        while len(self._nonces) < self.size:
+            try:
+                nonce = await self._fetch()
+            except MatrixError as exc:
+                logger.warning('Could not prefetch a registration nonce: %s',
+                               repr(exc))
+                self.discard()
+                return
+            self._nonces.append(_PrefetchedNonce(nonce, monotonic()))
+
+    def refill(self) -> None:
+        """Refill the pool in the background, if not already being refilled."""
+        if not self._refilling or self._refilling.done():
+            self._refilling = asyncio.ensure_future(self._refill())
+
+    def pop(self) -> Optional[str]:
+        """Take the oldest prefetched nonce, if any, and refill the pool.
+
+        :return: A nonce or None if there are no prefetched nonces.
+        """
+        self._purge()
+        nonce = self._nonces.popleft().nonce if self._nonces else None
+        self.refill()
+        return nonce
+
+    def discard(self) -> None:
+        """Discard every prefetched nonce, i.e. because they could be invalid."""
+        self._nonces.clear()
+
+    async def close(self) -> None:
+        """Stop refilling and discard every prefetched nonce."""
+        if self._refilling:
+            self._refilling.cancel()
+        self.discard()
+
+
+# Process-wide nonce pools by server URL
+_nonce_pools: Dict[str, NoncePool] = {}
+
+
 @dataclass
 class Matrix:
     """Handle Matrix account creation."""
@@ -38,14 +200,101 @@ class Matrix:
     API_VERSION_URL_PATH = '/_matrix/client/versions'
     REGISTRATION_CLIENT_URL_PATH = '/_matrix/client/{v}/register'
     REGISTRATION_ADMIN_URL_PATH = '/_matrix/client/{v}/admin/register'
-    SUPPORTED_API_VERSIONS = ('r0.5.0',)
+    USERNAME_AVAILABLE_URL_PATH = '/_matrix/client/{v}/register/available'
+    # Error codes meaning that a username can't be registered
+    USERNAME_UNAVAILABLE_ERRCODES = frozenset((
+        'M_USER_IN_USE',
+        'M_INVALID_USERNAME',
+        'M_EXCLUSIVE',
+    ))
+    SUPPORTED_API_VERSIONS = ('r0.5.0', 'r0.6.0')
+    # Account creation is not idempotent: only retry when the server certainly
+    # didn't process the request (rate limited requests are handled by pacing)
+    ACCOUNT_CREATION_RETRY_STATUSES = frozenset((503,))
+    RATE_LIMIT_STATUS = 429
+    RATE_LIMIT_ERRCODE = 'M_LIMIT_EXCEEDED'
+    RATE_LIMIT_DEFAULT_RETRY_AFTER = 1  # Seconds, if the server doesn't say
+    # Synapse error for a registration with an unknown or expired nonce
+    UNRECOGNISED_NONCE_STATUS = 400
+    UNRECOGNISED_NONCE_ERROR = 'unrecognised nonce'
+    # Attempts for an account creation that is rate limited
+    RATE_LIMITED_MAX_ATTEMPTS = 5
 
     server_url: str
     registration: Registration
     timeout: Union[int, float]
     registration_shared_secret: Optional[str] = None
+    # Retry policy for idempotent requests
+    retry_policy: RetryPolicy = NO_RETRY
+    # Circuit breaker for the homeserver, shared by every instance
+    circuit_breaker: Optional[CircuitBreaker] = None
+    # Prefetched registration nonces pool, shared by every instance
+    nonce_pool: Optional[NoncePool] = None
+    # Pacer for account creations respecting the homeserver rate limits, shared
+    # by every instance
+    pacer: Optional[TokenBucket] = None
     _api_version: str = field(default='', init=False)
 
+    @property
+    def account_creation_retry_policy(self) -> RetryPolicy:
+        """Get the retry policy for account creation requests."""
+        return replace(
+            self.retry_policy,
+            retry_statuses=self.ACCOUNT_CREATION_RETRY_STATUSES,
+            retry_errors=False,
+            hedge_after=None,
+        )
+
+    @staticmethod
+    def get_errcode(response: FullDataResponse) -> Optional[str]:
+        """Get the Matrix error code of a non-OK response, if any."""
+        if isinstance(response.error_data, dict):
+            return response.error_data.get('errcode')
+        return None
+
+    @classmethod
+    def is_rejection(cls, response: FullDataResponse) -> bool:
+        """Check whether the response is a client error other than rate limiting.
+
+        Such responses mean that the homeserver works but refused the request.
+        """
+        if response.status is None or response.status == cls.RATE_LIMIT_STATUS:
+            return False
+        return 400 <= response.status < 500
+
+    @classmethod
+    def is_unrecognised_nonce(cls, response: FullDataResponse) -> bool:
+        """Check whether the registration failed because of the nonce."""
+        if response.status != cls.UNRECOGNISED_NONCE_STATUS:
+            return False
+        if not isinstance(response.error_data, dict):
+            return False
+        error = str(response.error_data.get('error', ''))
+        return error.lower() == cls.UNRECOGNISED_NONCE_ERROR
+
+    @classmethod
+    def get_rate_limit_retry_after(cls, response: FullDataResponse) -> Optional[float]:
+        """Get the seconds to wait if the response is a rate limit error.
+
+        Synapse answers with an M_LIMIT_EXCEEDED error including the time to
+        wait in milliseconds, which is preferred over the Retry-After header.
+
+        :return: Seconds to wait or None if the response is not a rate limit error.
+        """
+        if response.status != cls.RATE_LIMIT_STATUS:
+            return None
+        error_data = response.error_data if isinstance(response.error_data,
+                                                       dict) else {}
+        if error_data.get('errcode') not in (cls.RATE_LIMIT_ERRCODE, None):
+            logger.warning('Unexpected error code for a rate limit error: %s',
+                           error_data.get('errcode'))
+        retry_after_ms = error_data.get('retry_after_ms')
+        if isinstance(retry_after_ms, (int, float)) and retry_after_ms >= 0:
+            return retry_after_ms / 1000
+        if response.retry_after is not None:
+            return response.retry_after
+        return cls.RATE_LIMIT_DEFAULT_RETRY_AFTER
+
     def _generate_mac(self, *, nonce: str, username: str, password: str,
                       admin: bool = False, user_type: Optional[str] = None):
         """Generate MAC for the Shared-Secret registration API."""
@@ -79,34 +328,86 @@ class Matrix:
 
     @property
     async def api_version(self) -> str:
-        """Get latest API version from server (will only query once and store result)."""
-        if self._api_version:
-            return self._api_version
+        """Get the API version to use with the server, such as r0.
 
-        url = await self.build_url(self.API_VERSION_URL_PATH)
-        version_data, error = await JSONConnectorAsync.get(url, timeout=self.timeout)
+        It is cached process-wide for every server (see `get_api_version`).
+        """
+        if not self._api_version:
+            version = await get_api_version(self.server_url, timeout=self.timeout,
+                                            retry=self.retry_policy)
+            self._api_version = version.split('.')[0]
+        return self._api_version
+
+    @staticmethod
+    def _parse_api_version(version: str) -> Tuple[int, ...]:
+        """Parse a version such as r0.5.0 into a comparable tuple."""
+        return tuple(int(part) for part in version.lstrip('r').split('.'))
+
+    @classmethod
+    def choose_api_version(cls, server_versions: Iterable[str]) -> str:
+        """Choose the latest API version supported both by the server and this app.
+
+        :raises MatrixError: There's no mutually supported version.
+        """
+        mutual_versions = set(server_versions).intersection(cls.SUPPORTED_API_VERSIONS)
+        if not mutual_versions:
+            raise MatrixError('Unsupported Matrix API version (this app needs an '
+                              'update)')
+        return max(mutual_versions, key=cls._parse_api_version)
+
+    @classmethod
+    async def fetch_api_version(cls, server_url: str, *, timeout: Union[int, float],
+                                retry: RetryPolicy = NO_RETRY) -> str:
+        """Fetch the supported API versions from the server and choose one.
+
+        :return: The API version, such as r0.6.0.
+        """
+        url = f'{server_url}{cls.API_VERSION_URL_PATH}'
+        version_data, error = await JSONConnectorAsync.get(
+            url,
+            timeout=timeout,
+            retry=retry,
+            route=cls.API_VERSION_URL_PATH,
+        )
         if error or not version_data:
             raise MatrixRequestError('Could not get API version from server')
 
         try:
-            version: str = version_data['versions'].pop()  # KeyError, IndexError
-            major, minor, patch = version.split('.')  # ValueError
-        except (KeyError, IndexError, ValueError):
+            server_versions = version_data['versions']
+        except (KeyError, TypeError):
+            raise MatrixResponseError(f'Malformed version data: {version_data}')
+        if not isinstance(server_versions, list):
             raise MatrixResponseError(f'Malformed version data: {version_data}')
 
-        # ToDo: maybe loop over versions?
-        if version not in self.SUPPORTED_API_VERSIONS:
-            raise MatrixError('Unsupported Matrix API version (this app needs an '
-                              'update)')
-        self._api_version = major
-        return major
+        return cls.choose_api_version(server_versions)
 
     async def create_account(self) -> MatrixAccount:
         """Create a Matrix account automatically choosing the registration API.
 
         This means that if the `registration_shared_secret` is set will use the
         administration API instead of the regular registration API.
+
+        If there's a circuit breaker, request errors are recorded as failures and
+        no request is made while it's open. Rejections are recorded as successes:
+        the homeserver works, whatever the request.
+
+        :raises MatrixUnavailableError: The circuit breaker is open.
+        :raises MatrixRejectedError: The homeserver rejected the registration.
         """
+        if not self.circuit_breaker:
+            return await self._create_account()
+
+        try:
+            with self.circuit_breaker.protect((MatrixRequestError,),
+                                              successes=(MatrixRejectedError,)):
+                return await self._create_account()
+        except CircuitOpenError as exc:
+            raise MatrixUnavailableError(
+                f'Matrix homeserver {self.server_url} is unavailable',
+                exc.retry_after,
+            ) from exc
+
+    async def _create_account(self) -> MatrixAccount:
         if self.registration_shared_secret:
             return await self.create_account_using_shared_secret()
         return await self.create_account_using_shared_secret()
@@ -114,23 +415,168 @@ class Matrix:
     async def create_account_using_shared_secret(self) -> MatrixAccount:
         """Create a Matrix account using the Shared-Secret API.
 
+        If there's a pacer, each attempt waits for it and rate limit errors pause
+        it for as long as the homeserver says.
+
         See:
         https://github.com/matrix-org/synapse/blob/master/docs/admin_api/register_api.rst
         https://github.com/matrix-org/synapse/blob/master/synapse/_scripts/register_new_matrix_user.py
 
         :return: A dict with the "user_id" being the Matrix account user and
                  "home_server" the hostname of the home server.
+        :raises MatrixRateLimitedError: The homeserver kept rate limiting us.
+        :raises MatrixRejectedError: The homeserver rejected the registration
+                                     (a 4xx response, i.e. the username is taken).
         """
         url = await self.build_url(self.REGISTRATION_ADMIN_URL_PATH)
-        nonce_data, error = await JSONConnectorAsync.get(url, timeout=self.timeout)
-        if error or not nonce_data:
+        attempt_number = 0
+        while True:
+            attempt_number += 1
+            if self.pacer:
+                await self.pacer.acquire()
+            acquired_at = monotonic()
+            try:
+                result = await self._register(url)
+            except MatrixRateLimitedError as exc:
+                retry_after = exc.retry_after
+            else:
+                retry_after = self.get_rate_limit_retry_after(result)
+                if retry_after is None:
+                    break
+
+            if self.pacer:
+                self.pacer.pause(retry_after, acquired_at=acquired_at)
+            if attempt_number >= self.RATE_LIMITED_MAX_ATTEMPTS:
+                raise MatrixRateLimitedError(
+                    f'Matrix homeserver {self.server_url} rate limit exceeded',
+                    retry_after,
+                )
+            logger.info('Matrix homeserver rate limit exceeded, retrying account '
+                        'creation in %.2f seconds (attempt %d of %d)', retry_after,
+                        attempt_number + 1, self.RATE_LIMITED_MAX_ATTEMPTS)
+            if not self.pacer:
+                await asyncio.sleep(retry_after)
+
+        if self.is_rejection(result):
+            errcode = self.get_errcode(result)
+            raise MatrixRejectedError(f'Registration rejected by server '
+                                      f'({result.status} {errcode})', errcode)
+        if result.error or not result.response_data:
+            raise MatrixRequestError('Could not post registration to server')
+
+        try:
+            account = MatrixAccount(**result.response_data)
+        except TypeError:
+            raise MatrixResponseError('Unexpected response after creating an account '
+                                      '(it is very likely that the account has been '
+                                      'created)')
+
+        return account
+
+    async def _register(self, url: str) -> FullDataResponse:
+        """Register the account, using a prefetched nonce if possible.
+
+        It's registered again with a fresh nonce only if the prefetched one was
+        not recognised: any other response is returned as is.
+        """
+        prefetched_nonce = None if self.nonce_pool is None else self.nonce_pool.pop()
+        if prefetched_nonce:
+            result = await self._register_with_nonce(url, prefetched_nonce)
+            if not self.is_unrecognised_nonce(result):
+                return result
+            # Prefetched nonces might have been invalidated (i.e. the server
+            # restarted), so discard them and try again with a fresh one
+            logger.info('Prefetched registration nonce not recognised by the '
+                        'server, retrying with a fresh one')
+            self.nonce_pool.discard()
+            if self.pacer:  # It's another registration attempt
+                await self.pacer.acquire()
+        nonce = await self.fetch_nonce(self.server_url, timeout=self.timeout,
+                                       retry=self.retry_policy)
+        return await self._register_with_nonce(url, nonce)
+
+    @classmethod
+    async def fetch_nonce(cls, server_url: str, *, timeout: Union[int, float],
+                          retry: RetryPolicy = NO_RETRY) -> str:
+        """Fetch a registration nonce for the Shared-Secret API from the server.
+
+        :raises MatrixRateLimitedError: The homeserver rate limit was exceeded.
+        """
+        api_version = await get_api_version(server_url, timeout=timeout, retry=retry)
+        path = cls.REGISTRATION_ADMIN_URL_PATH.format(v=api_version.split('.')[0])
+        url = f'{server_url}{path}'
+        # Rate limit errors are not retried but reported to wait as long as told
+        retry = replace(retry, retry_statuses=retry.retry_statuses.difference(
+            (cls.RATE_LIMIT_STATUS,)))
+        response = await JSONConnectorAsync.request_full(
+            'GET',
+            url,
+            timeout=timeout,
+            retry=retry,
+            route=cls.REGISTRATION_ADMIN_URL_PATH,
+        )
+        retry_after = cls.get_rate_limit_retry_after(response)
+        if retry_after is not None:
+            raise MatrixRateLimitedError(
+                f'Matrix homeserver {server_url} rate limit exceeded',
+                retry_after,
+            )
+        nonce_data = response.response_data
+        if response.error or not nonce_data:
             raise MatrixRequestError('Could not get registration nonce from server')
 
         try:
-            nonce: str = nonce_data['nonce']
-        except KeyError:
+            return nonce_data['nonce']
+        except (KeyError, TypeError):
             raise MatrixResponseError(f'Malformed nonce data: {nonce_data}')
 
+    @classmethod
+    async def check_username_available(cls, server_url: str, username: str, *,
+                                       timeout: Union[int, float],
+                                       retry: RetryPolicy = NO_RETRY) -> bool:
+        """Check whether a username can be registered in the server.
+
+        See:
+        https://matrix.org/docs/spec/client_server/r0.6.0#get-matrix-client-r0-register-available
+
+        :return: True if the username is available, False otherwise (i.e. it's
+                 taken or invalid).
+        :raises MatrixRateLimitedError: The homeserver rate limit was exceeded.
+        """
+        api_version = await get_api_version(server_url, timeout=timeout, retry=retry)
+        path = cls.USERNAME_AVAILABLE_URL_PATH.format(v=api_version.split('.')[0])
+        url = f'{server_url}{path}'
+        retry = replace(retry, retry_statuses=retry.retry_statuses.difference(
+            (cls.RATE_LIMIT_STATUS,)))
+        response = await JSONConnectorAsync.request_full(
+            'GET',
+            url,
+            params={'username': username},
+            timeout=timeout,
+            retry=retry,
+            route=cls.USERNAME_AVAILABLE_URL_PATH,
+        )
+        retry_after = cls.get_rate_limit_retry_after(response)
+        if retry_after is not None:
+            raise MatrixRateLimitedError(
+                f'Matrix homeserver {server_url} rate limit exceeded',
+                retry_after,
+            )
+        if isinstance(response.error_data, dict):
+            errcode = response.error_data.get('errcode')
+            if errcode in cls.USERNAME_UNAVAILABLE_ERRCODES:
+                return False
+        if not response.ok:
+            raise MatrixRequestError('Could not check username availability in '
+                                     'server')
+
+        try:
+            return response.response_data['available'] is True
+        except (KeyError, TypeError):
+            raise MatrixResponseError(f'Malformed availability data: '
+                                      f'{response.response_data}')
+
+    async def _register_with_nonce(self, url: str, nonce: str) -> FullDataResponse:
         base_payload = {
             'nonce': nonce,
             'username': self.registration.username,
@@ -151,22 +597,14 @@ class Matrix:
             'inhibit_login': True,
         }
         payload.update(base_payload)
-        result_data, error = await JSONConnectorAsync.post(
+        return await JSONConnectorAsync.request_full(
+            'POST',
             url,
-            payload,
+            json=payload,
             timeout=settings.REQUESTS_TIMEOUT,
+            retry=self.account_creation_retry_policy,
+            route=self.REGISTRATION_ADMIN_URL_PATH,
         )
-        if error or not result_data:
-            raise MatrixRequestError('Could not post registration to server')
-
-        try:
-            account = MatrixAccount(**result_data)
-        except TypeError:
-            raise MatrixResponseError('Unexpected response after creating an account '
-                                      '(it is very likely that the account has been '
-                                      'created)')
-
-        return account
 
     async def create_account_standard(self) -> MatrixAccount:
         """Create a Matrix account using the standard client API.
@@ -182,3 +620,130 @@ class Matrix:
         # of coding (or perhaps using an existing Matrix python library?) and
         # documentation and protocol reading.
         raise MatrixError('Not implemented yet')
+
+
+async def refresh_api_version(server_url: str, *, timeout: Union[int, float],
+                              retry: RetryPolicy = NO_RETRY) -> str:
+    """Fetch the API version to use with the server and cache it process-wide.
+
+    :return: The API version, such as r0.6.0.
+    """
+    version = await Matrix.fetch_api_version(server_url, timeout=timeout, retry=retry)
+    expires_at = monotonic() + settings.MATRIX_API_VERSION_TTL
+    _api_versions[server_url] = _CachedAPIVersion(version, expires_at)
+    return version
+
+
+async def get_api_version(server_url: str, *, timeout: Union[int, float],
+                          retry: RetryPolicy = NO_RETRY) -> str:
+    """Get the API version to use with the server, from cache if not expired.
+
+    Concurrent calls for the same server share a single request.
+
+    :return: The API version, such as r0.6.0.
+    """
+    if server_url not in _api_version_locks:
+        _api_version_locks[server_url] = asyncio.Lock()
+    async with _api_version_locks[server_url]:
+        cached = _api_versions.get(server_url)
+        if cached and cached.expires_at > monotonic():
+            return cached.version
+        return await refresh_api_version(server_url, timeout=timeout, retry=retry)
+
+
+async def keep_api_version_fresh(server_url: str, *, timeout: Union[int, float],
+                                 retry: RetryPolicy = NO_RETRY) -> None:
+    """Keep the cached API version of the server fresh, refreshing it periodically.
+
+    It is refreshed before it expires so that account creations don't have to
+    wait for it. It runs forever: cancel it to stop it.
+    """
+    refresh_interval = settings.MATRIX_API_VERSION_TTL / 2
+    while True:
+        try:
+            version = await refresh_api_version(server_url, timeout=timeout,
+                                                retry=retry)
+        except MatrixError as exc:
+            logger.warning('Could not refresh the Matrix API version of %s: %s',
+                           server_url, repr(exc))
+            delay = min(refresh_interval, 30)
+        else:
+            logger.debug('Matrix API version of %s is %s', server_url, version)
+            delay = refresh_interval
+        await asyncio.sleep(delay)
+
+
+def _cache_username_availability(key: Tuple[str, str],
+                                 check: asyncio.Future) -> None:
+    """Cache the result of a finished username availability check."""
+    _username_checks.pop(key, None)
+    if check.cancelled() or check.exception():
+        return
+    available = check.result()
+    if available:
+        ttl = settings.MATRIX_USERNAME_AVAILABLE_TTL
+    else:
+        ttl = settings.MATRIX_USERNAME_UNAVAILABLE_TTL
+    if not ttl:
+        return
+    if len(_username_availability) >= USERNAME_AVAILABILITY_MAX_CACHED:
+        # Purge expired entries or, if none, the oldest one
+        now = monotonic()
+        expired = [cached_key for cached_key, cached in _username_availability.items()
+                   if cached.expires_at <= now]
+        for cached_key in expired or [next(iter(_username_availability))]:
+            del _username_availability[cached_key]
+    _username_availability[key] = _CachedAvailability(available, monotonic() + ttl)
+
+
+async def is_username_available(server_url: str, username: str, *,
+                                timeout: Union[int, float],
+                                retry: RetryPolicy = NO_RETRY) -> bool:
+    """Check whether a username can be registered in the server, using a cache.
+
+    Results are cached process-wide: available usernames for a short time, as
+    they can be taken at any moment, and unavailable ones for longer. Concurrent
+    checks for the same username share a single request.
+
+    :return: True if the username is available, False otherwise.
+    :raises MatrixError: The availability could not be checked.
+    """
+    key = (server_url, username)
+    cached = _username_availability.get(key)
+    if cached and cached.expires_at > monotonic():
+        return cached.available
+
+    if key not in _username_checks:
+        check = asyncio.ensure_future(Matrix.check_username_available(
+            server_url,
+            username,
+            timeout=timeout,
+            retry=retry,
+        ))
+        check.add_done_callback(functools.partial(_cache_username_availability, key))
+        _username_checks[key] = check
+    # Shielded so that a cancelled caller doesn't cancel the check for the others
+    return await asyncio.shield(_username_checks[key])
+
+
+def get_nonce_pool(server_url: str, *, timeout: Union[int, float],
+                   retry: RetryPolicy = NO_RETRY) -> NoncePool:
+    """Get the process-wide prefetched registration nonces pool of the server.
+
+    The pool size and nonces maximum age are defined by the settings.
+    """
+    if server_url not in _nonce_pools:
+        _nonce_pools[server_url] = NoncePool(
+            functools.partial(Matrix.fetch_nonce, server_url, timeout=timeout,
+                              retry=retry),
+            size=settings.MATRIX_NONCE_POOL_SIZE,
+            max_age=settings.MATRIX_NONCE_MAX_AGE,
+        )
+    return _nonce_pools[server_url]
+
+
+async def close_nonce_pools() -> None:
+    """Close every process-wide prefetched registration nonces pool."""
+    pools = list(_nonce_pools.values())
+    _nonce_pools.clear()
+    await asyncio.gather(*(pool.close() for pool in pools))
@@ -1,6 +1,20 @@
 """Expose email actions."""
+from .actions import close_smtp_pool
+from .actions import get_spool_job_handlers
+from .actions import open_smtp_pool
 from .actions import send
+from .pool import SMTPPool
+from .spool import OUTBOX_QUEUE
+from .spool import close_spool
+from .spool import open_spool
 
 __all__ = (
+    'OUTBOX_QUEUE',
+    'SMTPPool',
+    'close_smtp_pool',
+    'close_spool',
+    'get_spool_job_handlers',
+    'open_smtp_pool',
+    'open_spool',
     'send',
 )
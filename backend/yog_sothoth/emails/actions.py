@@ -1,21 +1,43 @@
-"""Email actions."""
+"""Email actions.
+
+Emails are sent through a shared pool of SMTP connections: open it on startup
+with `open_smtp_pool` and close it on shutdown with `close_smtp_pool`. Otherwise
+it's created on first use.
+
+If the spool is open (see `spool`), emails are appended to it and delivered by
+its consumers, with `get_spool_job_handlers`, instead of sent right away. Emails
+carrying secrets are not spooled: they are sent right away with `sensitive`.
+"""
 import logging
 from email.message import Message
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import Dict
 from typing import Optional
 from typing import Sequence
 
 import aiosmtplib
 
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
 from yog_sothoth.conf import settings
+from yog_sothoth.queue import JobRejectedError
+from yog_sothoth.queue import THandler
+from yog_sothoth.utils.metrics import registry
+from . import spool
+from .pool import SMTPPool
 
 logger = logging.getLogger(__name__)
 
+emails_counter = registry.counter(
+    'yog_emails_total',
+    'Emails by outcome: spooled, sent or failed',
+)
 
-async def _send(message: Message, to: Sequence[str]) -> None:
-    """Send an email message to a list of recipients asynchronously."""
-    logger.info('Sending email to %s...', ', '.join(to))
+_pool: Optional[SMTPPool] = None
+
+
+def _get_connection_options() -> Dict[str, any]:
     if settings.DEVELOPMENT_MODE:
         # Hardcode and bypass settings, this is done on purpose for dev mode.
         use_tls = start_tls = False
@@ -26,33 +48,153 @@ async def _send(message: Message, to: Sequence[str]) -> None:
         host = settings.EMAIL_HOST
         use_tls = settings.EMAIL_USE_TLS
         start_tls = not use_tls
-    logger.debug(
-        'Email:\nmessage=%s\nhostname=%s\nport=%d\nusername=%s\npassword=%s\n'
-        'recipients=%s\nuse_tls=%s\nstart_tls=%s\ntimeout=%d',
-        message.get_payload(decode=True).decode(),
-        host,
-        port,
-        settings.EMAIL_USERNAME,
-        '[REDACTED]',
-        str(to),
-        use_tls,
-        start_tls,
-        settings.EMAIL_TIMEOUT,
+    return {
+        'hostname': host,
+        'port': port,
+        'username': settings.EMAIL_USERNAME,
+        'password': settings.EMAIL_PASSWORD,
+        'use_tls': use_tls,
+        'start_tls': start_tls,
+        'timeout': settings.EMAIL_TIMEOUT,
+    }
+
+
+def _create_pool() -> SMTPPool:
+    return SMTPPool(
+        size=settings.EMAIL_POOL_SIZE,
+        max_messages=settings.EMAIL_POOL_MAX_MESSAGES,
+        max_idle=settings.EMAIL_POOL_MAX_IDLE,
+        **_get_connection_options(),
     )
+
+
+async def open_smtp_pool(pool: Optional[SMTPPool] = None) -> SMTPPool:
+    """Open the shared SMTP connections pool used to send emails.
+
+    If there was a previous pool, it is closed. Connections are opened on demand.
+
+    :param pool: [optional] Pool to share instead of one created from settings,
+                 i.e. to send emails to a local SMTP stand-in.
+    :return: The shared SMTP connections pool.
+    """
+    global _pool
+
+    await close_smtp_pool()
+    _pool = pool if pool is not None else _create_pool()
+    return _pool
+
+
+async def close_smtp_pool() -> None:
+    """Close the shared SMTP connections pool, if any, and all of its connections."""
+    global _pool
+
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+def get_smtp_pool() -> SMTPPool:
+    """Get the shared SMTP connections pool, creating it if necessary."""
+    global _pool
+
+    if _pool is None:
+        _pool = _create_pool()
+    return _pool
+
+
+def _get_message_text(message: Message) -> str:
+    """Get the text of the message, preferring the plain text alternative."""
+    parts = [part for part in message.walk() if not part.is_multipart()]
+    part = next((part for part in parts if part.get_content_type() == 'text/plain'),
+                parts[0] if parts else None)
+    if part is None:
+        return ''
+    payload = part.get_payload(decode=True) or b''
+    return payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+
+
+class _EmailLogRecord:
+    """Email details for debug logs, formatted only if the log is emitted.
+
+    Secrets are redacted, and the message body is decoded on formatting.
+    """
+
+    __slots__ = ('message', 'to', 'options')
+
+    def __init__(self, message: Message, to: Sequence[str], options: Dict[str, any]):
+        self.message = message
+        self.to = to
+        self.options = options
+
+    def as_dict(self) -> Dict[str, any]:
+        """Get the redacted email details as a structured record."""
+        return {
+            'message': _get_message_text(self.message),
+            'hostname': self.options.get('hostname'),
+            'port': self.options.get('port'),
+            'username': self.options.get('username'),
+            'password': '[REDACTED]',  # noqa: S105  # nosec
+            'recipients': list(self.to),
+            'use_tls': self.options.get('use_tls'),
+            'start_tls': self.options.get('start_tls'),
+            'timeout': self.options.get('timeout'),
+        }
+
+    def __str__(self) -> str:
+        """Get the redacted email details as text."""
+        fields = (f'{key}={value}' for key, value in self.as_dict().items())
+        return '\n'.join(('Email:', *fields))
+
+
+async def _deliver(message: Message, to: Sequence[str]) -> None:
+    """Deliver an email message to a list of recipients through the SMTP pool.
+
+    :raise aiosmtplib.SMTPException: The message could not be delivered.
+    """
+    logger.info('Sending email to %s...', ', '.join(to))
+    pool = get_smtp_pool()
+    if logger.isEnabledFor(logging.DEBUG):
+        record = _EmailLogRecord(message, to, pool.options)
+        logger.debug('%s', record, extra={'email': record})
+    response = await pool.send(message, to)
+    logger.debug('Email server response: %s', response)
+
+
+async def _send(message: Message, to: Sequence[str]) -> bool:
+    """Send an email message to a list of recipients asynchronously.
+
+    :return: True if the message is sent, False otherwise.
+    """
     try:
-        response = await aiosmtplib.send(message,
-                                         hostname=host,
-                                         port=port,
-                                         username=settings.EMAIL_USERNAME,
-                                         password=settings.EMAIL_PASSWORD,
-                                         recipients=to,
-                                         use_tls=use_tls,
-                                         start_tls=start_tls,
-                                         timeout=settings.EMAIL_TIMEOUT)
+        await _deliver(message, to)
     except aiosmtplib.errors.SMTPException:
         logger.exception('Email not sent because an error occurred')
-    else:
-        logger.debug('Email server response: %s', str(response))
+        emails_counter.inc(outcome='failed')
+        return False
+    emails_counter.inc(outcome='sent')
+    return True
+
+
+async def _deliver_spooled(payload: Dict[str, any]) -> None:
+    spooled = spool.parse(payload)
+    try:
+        await _deliver(spooled.message, spooled.to)
+    except aiosmtplib.errors.SMTPRecipientsRefused as exc:
+        # Every recipient was refused, otherwise it's delivered to the rest
+        raise JobRejectedError(f'Recipients refused: {exc.recipients}') from exc
+    except aiosmtplib.errors.SMTPResponseException as exc:
+        if exc.code >= 500:  # Permanent error, retrying won't help
+            raise JobRejectedError(f'{exc.code} {exc.message}') from exc
+        raise
+    emails_counter.inc(outcome='sent')
+
+
+def get_spool_job_handlers() -> Dict[str, THandler]:
+    """Get the task queue job handlers that deliver the spooled emails.
+
+    :return: Job handlers by job name.
+    """
+    return {spool.DELIVER_EMAIL_JOB: _deliver_spooled}
 
 
 def _get_message_body(body_plain: Optional[MIMEText],
@@ -76,8 +218,9 @@ async def send(*,
                to: Sequence[str],
                subject: str,
                body_plain: Optional[MIMEText] = None,
-               body_html: Optional[MIMEText] = None) -> None:
-    """Send an email.
+               body_html: Optional[MIMEText] = None,
+               sensitive: bool = False) -> bool:
+    """Send an email, or append it to the spool if open.
 
     Note that either `body_plain` or `body_html` must be specified, or both.
 
@@ -85,8 +228,20 @@ async def send(*,
     :param subject: Email subject (will be appended to app's subject).
     :param body_plain: [optional] Plain text email body.
     :param body_html: [optional] HTML email body.
+    :param sensitive: [optional] True if it carries secrets, so that it's sent
+                      right away instead of spooled (defaults to False).
+    :return: True if the email is spooled or sent, False otherwise.
     """
     message = _get_message_body(body_plain, body_html)
     message['From'] = settings.EMAIL_SENDER_ADDRESS
     message['Subject'] = f'{settings.EMAIL_SUBJECT_PREFIX}{subject}'
-    await _send(message, to)
+    if not sensitive and spool.is_spool_open():
+        try:
+            await spool.append(message, to)
+        except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+            logger.warning('Could not spool email to %s, sending it right away: %s',
+                           ', '.join(to), repr(exc))
+        else:
+            emails_counter.inc(outcome='spooled')
+            return True
+    return await _send(message, to)
@@ -0,0 +1,168 @@
+"""Benchmark of the overhead of sending emails.
+
+Emails are sent with `emails.send` to a local SMTP stand-in, an aiosmtpd server
+accepting and discarding every message in its own thread, so that the time
+measured is spent by this app: building, logging and delivering the messages
+through the SMTP connections pool. The spool is not used.
+
+Each round is run with the given log levels, logging to a null stream instead of
+the configured handlers, to compare the overhead of the email debug logs:
+
+    python -m yog_sothoth.emails.benchmark --count 1000 --concurrency 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+from email.mime.text import MIMEText
+from time import perf_counter
+from typing import List
+from typing import NamedTuple
+
+from aiosmtpd.controller import Controller
+
+from .actions import close_smtp_pool
+from .actions import open_smtp_pool
+from .actions import send
+from .pool import SMTPPool
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8026  # Not to clash with the development SMTP server
+
+
+class _SinkHandler:
+    """SMTP stand-in handler that accepts and discards every message."""
+
+    async def handle_DATA(self, server, session, envelope) -> str:  # noqa: N802
+        """Accept the message."""
+        return '250 Message accepted for delivery'
+
+
+class BenchmarkResult(NamedTuple):
+    """Timings of a benchmark round, in seconds."""
+
+    level: str
+    count: int
+    elapsed: float
+    timings: List[float]
+
+    def __str__(self) -> str:
+        """Get the round summary."""
+        timings = sorted(self.timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        return (f'{self.level:>7}: {self.count} emails in {self.elapsed:.3f}s '
+                f'({self.count / self.elapsed:.1f}/s), per email: '
+                f'mean={statistics.mean(timings) * 1000:.3f}ms '
+                f'p50={statistics.median(timings) * 1000:.3f}ms '
+                f'p99={p99 * 1000:.3f}ms')
+
+
+async def _send_timed(timings: List[float], index: int) -> None:
+    body_plain = MIMEText(f'Benchmark email {index}\n' * 20, 'plain')
+    body_html = MIMEText(f'<p>Benchmark email {index}</p>\n' * 20, 'html')
+    start = perf_counter()
+    await send(to=[f'benchmark{index}@localhost'], subject=f'Benchmark {index}',
+               body_plain=body_plain, body_html=body_html)
+    timings.append(perf_counter() - start)
+
+
+async def run_round(level: str, *, count: int, concurrency: int) -> BenchmarkResult:
+    """Send emails to the SMTP stand-in with the given log level.
+
+    The shared SMTP connections pool must be opened beforehand.
+
+    :param level: Log level name.
+    :param count: Number of emails to send.
+    :param concurrency: Emails being sent at the same time.
+    :return: The round timings.
+    """
+    logging.getLogger('yog_sothoth').setLevel(level)
+    timings: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_bounded(index: int) -> None:
+        async with semaphore:
+            await _send_timed(timings, index)
+
+    start = perf_counter()
+    await asyncio.gather(*(send_bounded(index) for index in range(count)))
+    return BenchmarkResult(level, count, perf_counter() - start, timings)
+
+
+async def run(levels: List[str], *, count: int, concurrency: int,
+              host: str = DEFAULT_HOST,
+              port: int = DEFAULT_PORT) -> List[BenchmarkResult]:
+    """Run a benchmark round per log level against an in-process SMTP stand-in.
+
+    :param levels: Log level names.
+    :param count: Number of emails to send per round.
+    :param concurrency: Emails being sent at the same time.
+    :param host: [optional] Host for the SMTP stand-in to listen on.
+    :param port: [optional] Port for the SMTP stand-in to listen on.
+    :return: The timings of each round.
+    """
+    controller = Controller(_SinkHandler(), hostname=host, port=port)
+    controller.start()
+    logger = logging.getLogger('yog_sothoth')
+    handlers, level = logger.handlers, logger.level
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(logging.Formatter('{levelname} {asctime} {message}',
+                                           style='{'))
+    logger.handlers = [handler]
+    try:
+        await open_smtp_pool(SMTPPool(
+            size=concurrency,
+            max_messages=0,
+            max_idle=60,
+            hostname=host,
+            port=port,
+            use_tls=False,
+            start_tls=False,
+            timeout=10,
+        ))
+        await run_round(levels[0], count=concurrency, concurrency=concurrency)  # Warm
+        return [await run_round(level, count=count, concurrency=concurrency)
+                for level in levels]
+    finally:
+        await close_smtp_pool()
+        logger.handlers, logger.level = handlers, level
+        handler.close()
+        controller.stop()
+
+
+def main() -> None:
+    """Run the emails benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the overhead of sending emails to a local SMTP '
+                    'stand-in.',
+    )
+    parser.add_argument('--count', type=int, default=1000,
+                        help='emails to send per round (defaults to %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=5,
+                        help='emails being sent at the same time (defaults to '
+                             '%(default)s)')
+    parser.add_argument('--levels', default='INFO,DEBUG',
+                        help='comma separated log levels, a round each (defaults '
+                             'to %(default)s)')
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='host for the SMTP stand-in to listen on (defaults to '
+                             '%(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port for the SMTP stand-in to listen on (defaults to '
+                             '%(default)s)')
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(run(
+        [level.strip().upper() for level in args.levels.split(',')],
+        count=args.count,
+        concurrency=args.concurrency,
+        host=args.host,
+        port=args.port,
+    ))
+    for result in results:
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
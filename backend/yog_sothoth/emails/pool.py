@@ -0,0 +1,186 @@
+"""SMTP connections pool.
+
+Connecting to the mail relay costs a TCP connection, the TLS or STARTTLS
+negotiation and the authentication: instead of paying it for every email, a
+bounded number of authenticated connections are kept open and reused.
+
+A connection that has been idle for a while is checked with NOOP before being
+reused, and it's closed when idle for too long (mail relays drop idle sessions
+anyway) or after sending a maximum number of messages. If a reused connection
+turns out to be broken, the message is sent through a new one.
+"""
+import asyncio
+import logging
+from email.message import Message
+from time import monotonic
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import aiosmtplib
+from aiosmtplib import SMTPResponse
+
+from yog_sothoth.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TSendResponse = Tuple[Dict[str, SMTPResponse], str]
+
+connections_counter = registry.counter(
+    'yog_email_smtp_connections_total',
+    'SMTP connections opened to the mail relay',
+)
+
+
+class _PooledConnection:
+
+    __slots__ = ('client', 'messages', 'last_used')
+
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client: aiosmtplib.SMTP = client
+        self.messages: int = 0
+        self.last_used: float = monotonic()
+
+    @property
+    def idle(self) -> float:
+        """Get the seconds since the connection was last used."""
+        return monotonic() - self.last_used
+
+
+class SMTPPool:
+    """Bounded pool of authenticated SMTP connections to a mail relay."""
+
+    CHECK_AFTER_IDLE = 5  # Seconds idle before checking a connection with NOOP
+
+    __slots__ = ('size', 'max_messages', 'max_idle', '_options', '_idle', '_slots',
+                 '_closed')
+
+    def __init__(self,
+                 *,
+                 size: int,
+                 max_messages: int,
+                 max_idle: float,
+                 **options):
+        """Pool of SMTP connections created with the given options.
+
+        :param size: Maximum number of open connections.
+        :param max_messages: Maximum number of messages sent through a connection
+                             before it is closed (0 for no limit).
+        :param max_idle: Maximum seconds a connection is kept open while idle.
+        :param options: Connection options passed to `aiosmtplib.SMTP` (hostname,
+                        port, username, password, use_tls, start_tls, timeout).
+        """
+        self.size: int = max(size, 1)
+        self.max_messages: int = max_messages
+        self.max_idle: float = max_idle
+        self._options: Dict[str, any] = options
+        self._idle: List[_PooledConnection] = []  # Last used at the end
+        self._slots: Optional[asyncio.Semaphore] = None  # Created within the loop
+        self._closed: bool = False
+
+    def __len__(self) -> int:
+        """Get the number of idle connections."""
+        return len(self._idle)
+
+    @property
+    def options(self) -> Dict[str, any]:
+        """Get the connection options, secrets included: redact them for logs."""
+        return self._options
+
+    async def _connect(self) -> _PooledConnection:
+        client = aiosmtplib.SMTP(**self._options)
+        await client.connect()  # Negotiates STARTTLS and logs in as well
+        connections_counter.inc()
+        return _PooledConnection(client)
+
+    @staticmethod
+    async def _disconnect(connection: _PooledConnection) -> None:
+        try:
+            await connection.client.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            connection.client.close()
+
+    async def _is_healthy(self, connection: _PooledConnection) -> bool:
+        if not connection.client.is_connected:
+            return False
+        if connection.idle < self.CHECK_AFTER_IDLE:
+            return True
+        try:
+            await connection.client.noop()
+        except (aiosmtplib.SMTPException, OSError) as exc:
+            logger.debug('Discarding broken SMTP connection: %s', repr(exc))
+            connection.client.close()
+            return False
+        return True
+
+    async def _take(self) -> Tuple[_PooledConnection, bool]:
+        """Take the most recently used healthy connection, or open a new one.
+
+        :return: The connection and whether it's a reused one.
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            if connection.idle > self.max_idle:
+                await self._disconnect(connection)
+            elif await self._is_healthy(connection):
+                return connection, True
+        return await self._connect(), False
+
+    async def _release(self, connection: _PooledConnection) -> None:
+        connection.messages += 1
+        connection.last_used = monotonic()
+        if self._closed or 0 < self.max_messages <= connection.messages:
+            await self._disconnect(connection)
+        else:
+            self._idle.append(connection)
+
+    @staticmethod
+    async def _send_through(connection: _PooledConnection,
+                            message: Message,
+                            recipients: Sequence[str]) -> TSendResponse:
+        sent = False
+        try:
+            response = await connection.client.send_message(message,
+                                                            recipients=recipients)
+            sent = True
+        finally:
+            if not sent:
+                # The connection state is unknown, i.e. in the middle of a command
+                connection.client.close()
+        return response
+
+    async def send(self, message: Message, recipients: Sequence[str]) -> TSendResponse:
+        """Send an email message through a pooled connection.
+
+        Waits for a connection if every one is in use.
+
+        :param message: Email message.
+        :param recipients: Email recipients.
+        :return: The server response for each recipient and the message response.
+        :raise aiosmtplib.SMTPException: The message could not be sent.
+        """
+        if self._closed:
+            raise RuntimeError('The SMTP pool is closed')
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        async with self._slots:
+            connection, reused = await self._take()
+            try:
+                response = await self._send_through(connection, message, recipients)
+            except aiosmtplib.SMTPServerDisconnected:
+                if not reused:
+                    raise
+                # The relay most likely dropped the idle connection meanwhile
+                connection = await self._connect()
+                response = await self._send_through(connection, message, recipients)
+            await self._release(connection)
+        return response
+
+    async def close(self) -> None:
+        """Close every idle connection: connections in use are closed once released."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(self._disconnect(connection) for connection in idle))
@@ -0,0 +1,84 @@
+"""Outbound email spool.
+
+Instead of waiting for the mail relay, emails are appended to the spool: a
+durable task queue in the tasks cache, whose consumers read them in batches and
+deliver them through the pooled SMTP connections. Deliveries failing temporarily
+are retried, and emails that can't be delivered are moved to the dead letter
+stream (`yog:task:v1:outbox:dead`).
+
+Spooled emails are stored rendered, both in the queue and in its dead letter
+stream, so emails carrying secrets (such as tokens) must not be spooled. They
+are sent right away instead (see `send`), and retried by whatever keeps a
+reference to render them again: the registration job, scoped to the secret its
+task needs, or the managers digest buffer.
+
+Open the spool on startup with `open_spool` and close it on shutdown with
+`close_spool`. Otherwise, emails are not spooled.
+"""
+import email
+from email.message import Message
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+
+from yog_sothoth.cache import LazyCache
+from yog_sothoth.queue import get_task_queue
+
+OUTBOX_QUEUE = 'outbox'
+DELIVER_EMAIL_JOB = 'deliver_email'  # Must be kept stable, as job names
+
+_cache: Optional[LazyCache] = None
+
+
+class SpooledEmail(NamedTuple):
+    """Email read from the spool."""
+
+    message: Message
+    to: List[str]
+
+
+def open_spool(cache: LazyCache) -> None:
+    """Open the spool, so that emails are appended to it instead of sent.
+
+    :param cache: Tasks cache.
+    """
+    global _cache
+
+    _cache = cache
+
+
+def close_spool() -> None:
+    """Close the spool: emails are sent right away from now on."""
+    global _cache
+
+    _cache = None
+
+
+def is_spool_open() -> bool:
+    """Get whether emails are appended to the spool."""
+    return _cache is not None
+
+
+async def append(message: Message, to: Sequence[str]) -> None:
+    """Append an email to the spool, to be delivered by any of its consumers.
+
+    :param message: Email message.
+    :param to: Email recipients.
+    :raise CacheUnavailableError: The tasks cache is not available.
+    :raise RuntimeError: The spool is not open.
+    """
+    if _cache is None:
+        raise RuntimeError('The email spool is not open')
+    queue = get_task_queue(await _cache.get(), OUTBOX_QUEUE)
+    await queue.enqueue(DELIVER_EMAIL_JOB, {
+        'message': message.as_string(),
+        'to': list(to),
+    })
+
+
+def parse(payload: Dict[str, any]) -> SpooledEmail:
+    """Parse an email from the payload of a spool job."""
+    return SpooledEmail(email.message_from_string(payload['message']),
+                        payload['to'])
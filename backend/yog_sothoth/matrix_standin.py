@@ -0,0 +1,353 @@
+"""Local Matrix homeserver stand-in for development and load testing.
+
+It implements the parts of the Matrix client API used by this app, the same
+way Synapse does: API versions, username availability and the Shared-Secret
+registration API, with single use nonces that expire, MAC verification and
+usernames that can only be registered once.
+
+Latency, errors and rate limiting (M_LIMIT_EXCEEDED) can be injected to
+measure provisioning throughput and resilience without a real homeserver.
+Request counts are exposed in `/_standin/stats`.
+
+Run it as a separate local server:
+
+    python -m yog_sothoth.matrix_standin --latency uniform:0.05:0.2
+
+Or in-process, i.e. from a load test, with `start_standin`.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import logging
+import math
+import random
+import re
+import secrets
+from collections import Counter
+from dataclasses import dataclass
+from dataclasses import field
+from time import monotonic
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8008
+DEFAULT_SHARED_SECRET = 'fakesecret'  # noqa: S105  # nosec
+
+USERNAME_REGEX = re.compile(r'^[a-z0-9._=/-]+$')
+
+
+class LatencyDistribution(NamedTuple):
+    """Response latency distribution in seconds."""
+
+    kind: str = 'constant'
+    params: Tuple[float, ...] = (0.0,)
+
+    KINDS = {
+        # Parameters by kind
+        'constant': ('seconds',),
+        'uniform': ('low', 'high'),
+        'exponential': ('mean',),
+        'lognormal': ('median', 'sigma'),
+    }
+
+    @classmethod
+    def parse(cls, value: str) -> 'LatencyDistribution':
+        """Parse a latency distribution such as uniform:0.05:0.2.
+
+        :raises ValueError: The distribution is not valid.
+        """
+        kind, *params = value.split(':')
+        if kind not in cls.KINDS:
+            raise ValueError(f'Unknown latency distribution: {kind} (choose from '
+                             f'{", ".join(cls.KINDS)})')
+        if len(params) != len(cls.KINDS[kind]):
+            raise ValueError(f'The {kind} latency distribution requires: '
+                             f'{", ".join(cls.KINDS[kind])}')
+        return cls(kind, tuple(float(param) for param in params))
+
+    def sample(self) -> float:
+        """Get a random latency from the distribution."""
+        if self.kind == 'uniform':
+            latency = random.uniform(*self.params)  # noqa: S311  # nosec
+        elif self.kind == 'exponential':
+            mean = self.params[0]
+            latency = random.expovariate(1 / mean) if mean else 0  # noqa: S311  # nosec
+        elif self.kind == 'lognormal':
+            median, sigma = self.params
+            latency = random.lognormvariate(math.log(median),  # noqa: S311  # nosec
+                                            sigma) if median else 0
+        else:
+            latency = self.params[0]
+        return max(0.0, latency)
+
+
+@dataclass
+class StandinConfig:
+    """Matrix homeserver stand-in behaviour."""
+
+    server_name: str = 'localhost'
+    registration_shared_secret: str = DEFAULT_SHARED_SECRET
+    versions: Tuple[str, ...] = ('r0.5.0', 'r0.6.0')
+    latency: LatencyDistribution = LatencyDistribution()
+    # Fraction (from 0 to 1) of requests answered with an error
+    error_rate: float = 0.0
+    error_status: int = 500
+    # Registrations per second, answering M_LIMIT_EXCEEDED when exceeded (0 for
+    # no limit)
+    rate_limit: float = 0.0
+    rate_limit_burst: int = 1
+    # Seconds until a nonce expires
+    nonce_timeout: float = 60
+    # Usernames that are already registered
+    taken_usernames: Set[str] = field(default_factory=set)
+
+
+class _RateLimiter:
+    """Token bucket that rejects instead of waiting."""
+
+    __slots__ = ('rate', 'burst', '_tokens', '_updated_at')
+
+    def __init__(self, rate: float, burst: int):
+        self.rate: float = rate
+        self.burst: int = max(burst, 1)
+        self._tokens: float = self.burst
+        self._updated_at: float = monotonic()
+
+    def take(self) -> Optional[int]:
+        """Take a token, or get the milliseconds to wait for one."""
+        if not self.rate:
+            return None
+        now = monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return math.ceil((1 - self._tokens) / self.rate * 1000)
+
+
+def _error(status: int, errcode: str, error: str, **extra) -> web.Response:
+    return web.json_response({'errcode': errcode, 'error': error, **extra},
+                             status=status)
+
+
+class MatrixStandin:
+    """Matrix homeserver stand-in state and handlers."""
+
+    def __init__(self, config: StandinConfig):
+        """Matrix homeserver stand-in with the given behaviour."""
+        self.config: StandinConfig = config
+        self.users: Set[str] = set(config.taken_usernames)
+        self.stats: Counter = Counter()
+        self._nonces: Dict[str, float] = {}  # Expiration by nonce
+        self._rate_limiter = _RateLimiter(config.rate_limit, config.rate_limit_burst)
+
+    @web.middleware
+    async def inject_faults(self, request: web.Request, handler) -> web.StreamResponse:
+        """Delay responses and answer with errors as configured."""
+        if request.path.startswith('/_standin/'):
+            return await handler(request)
+        self.stats['requests'] += 1
+        await asyncio.sleep(self.config.latency.sample())
+        if random.random() < self.config.error_rate:  # noqa: S311  # nosec
+            self.stats['errors'] += 1
+            return _error(self.config.error_status, 'M_UNKNOWN', 'Injected error')
+        return await handler(request)
+
+    async def versions(self, _request: web.Request) -> web.Response:
+        """Get the supported API versions."""
+        return web.json_response({'versions': list(self.config.versions)})
+
+    async def username_available(self, request: web.Request) -> web.Response:
+        """Check whether a username can be registered."""
+        self.stats['availability_checks'] += 1
+        username = request.query.get('username', '')
+        if not USERNAME_REGEX.match(username):
+            return _error(400, 'M_INVALID_USERNAME', 'User ID can only contain '
+                                                     'characters a-z, 0-9, or "=_-./"')
+        if username in self.users:
+            return _error(400, 'M_USER_IN_USE', 'User ID already taken.')
+        return web.json_response({'available': True})
+
+    async def registration_nonce(self, _request: web.Request) -> web.Response:
+        """Get a single use registration nonce."""
+        self.stats['nonces'] += 1
+        now = monotonic()
+        # Nonces are kept in expiration order
+        while self._nonces and next(iter(self._nonces.values())) <= now:
+            del self._nonces[next(iter(self._nonces))]
+        nonce = secrets.token_hex(32)
+        self._nonces[nonce] = now + self.config.nonce_timeout
+        return web.json_response({'nonce': nonce})
+
+    def _generate_mac(self, body: dict) -> str:
+        mac = hmac.new(
+            key=self.config.registration_shared_secret.encode('utf8'),
+            digestmod=hashlib.sha1,
+        )
+        mac.update(str(body.get('nonce')).encode('utf8'))
+        mac.update(b'\x00')
+        mac.update(str(body.get('username')).encode('utf8'))
+        mac.update(b'\x00')
+        mac.update(str(body.get('password')).encode('utf8'))
+        mac.update(b'\x00')
+        mac.update(b'admin' if body.get('admin') else b'notadmin')
+        if body.get('user_type'):
+            mac.update(b'\x00')
+            mac.update(str(body['user_type']).encode('utf8'))
+        return mac.hexdigest()
+
+    async def register(self, request: web.Request) -> web.Response:
+        """Register an account using the Shared-Secret API."""
+        retry_after_ms = self._rate_limiter.take()
+        if retry_after_ms is not None:
+            self.stats['rate_limited'] += 1
+            return _error(429, 'M_LIMIT_EXCEEDED', 'Too Many Requests',
+                          retry_after_ms=retry_after_ms)
+
+        try:
+            body = await request.json()
+        except ValueError:
+            return _error(400, 'M_NOT_JSON', 'Content not JSON.')
+        if not isinstance(body, dict):
+            return _error(400, 'M_BAD_JSON', 'Content must be a JSON object.')
+
+        expires_at = self._nonces.pop(body.get('nonce'), 0)
+        if expires_at <= monotonic():
+            return _error(400, 'M_UNKNOWN', 'unrecognised nonce')
+        if not hmac.compare_digest(str(body.get('mac')), self._generate_mac(body)):
+            return _error(403, 'M_FORBIDDEN', 'HMAC incorrect')
+
+        username = body.get('username')
+        if not isinstance(username, str) or not USERNAME_REGEX.match(username):
+            return _error(400, 'M_INVALID_USERNAME', 'Invalid username')
+        if username in self.users:
+            return _error(400, 'M_USER_IN_USE', 'User ID already taken.')
+
+        self.users.add(username)
+        self.stats['registrations'] += 1
+        user_id = f'@{username}:{self.config.server_name}'
+        response = {'user_id': user_id, 'home_server': self.config.server_name}
+        if not body.get('inhibit_login'):
+            response.update({'access_token': secrets.token_urlsafe(),
+                             'device_id': secrets.token_hex(5).upper()})
+        return web.json_response(response)
+
+    async def read_stats(self, _request: web.Request) -> web.Response:
+        """Get the request counts."""
+        return web.json_response({**self.stats, 'users': len(self.users)})
+
+    def create_app(self) -> web.Application:
+        """Create the stand-in web application."""
+        app = web.Application(middlewares=[self.inject_faults])
+        app.router.add_get('/_matrix/client/versions', self.versions)
+        for prefix_version in {version.split('.')[0]
+                               for version in self.config.versions}:
+            prefix = f'/_matrix/client/{prefix_version}'
+            app.router.add_get(f'{prefix}/register/available',
+                               self.username_available)
+            app.router.add_get(f'{prefix}/admin/register', self.registration_nonce)
+            app.router.add_post(f'{prefix}/admin/register', self.register)
+        app.router.add_get('/_standin/stats', self.read_stats)
+        return app
+
+
+class StandinServer(NamedTuple):
+    """Matrix homeserver stand-in running in-process."""
+
+    standin: MatrixStandin
+    runner: web.AppRunner
+    url: str
+
+    async def stop(self) -> None:
+        """Stop the stand-in server."""
+        await self.runner.cleanup()
+
+
+async def start_standin(config: Optional[StandinConfig] = None, *,
+                        host: str = DEFAULT_HOST, port: int = 0) -> StandinServer:
+    """Start a Matrix homeserver stand-in in the running event loop.
+
+    :param config: [optional] Stand-in behaviour.
+    :param host: [optional] Host to listen on.
+    :param port: [optional] Port to listen on (defaults to a free one).
+    :return: The running server, with its URL.
+    """
+    standin = MatrixStandin(config or StandinConfig())
+    runner = web.AppRunner(standin.create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_host, bound_port = runner.addresses[0][:2]
+    return StandinServer(standin, runner, f'http://{bound_host}:{bound_port}')
+
+
+def _parse_latency(value: str) -> LatencyDistribution:
+    try:
+        return LatencyDistribution.parse(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def main() -> None:
+    """Run a Matrix homeserver stand-in from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Run a local Matrix homeserver stand-in.',
+    )
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='host to listen on (defaults to %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on (defaults to %(default)s)')
+    parser.add_argument('--shared-secret', default=DEFAULT_SHARED_SECRET,
+                        help='registration shared secret (defaults to %(default)s)')
+    parser.add_argument('--latency', type=_parse_latency,
+                        default=LatencyDistribution(),
+                        help='response latency distribution in seconds: '
+                             'constant:<seconds>, uniform:<low>:<high>, '
+                             'exponential:<mean> or lognormal:<median>:<sigma> '
+                             '(defaults to none)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests answered with an error (defaults '
+                             'to %(default)s)')
+    parser.add_argument('--error-status', type=int, default=500,
+                        help='status of injected errors (defaults to %(default)s)')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='registrations per second, answering M_LIMIT_EXCEEDED '
+                             'when exceeded (defaults to no limit)')
+    parser.add_argument('--rate-limit-burst', type=int, default=1,
+                        help='registrations that can be made at once (defaults to '
+                             '%(default)s)')
+    parser.add_argument('--nonce-timeout', type=float, default=60,
+                        help='seconds until a nonce expires (defaults to '
+                             '%(default)s)')
+    parser.add_argument('--taken', nargs='*', default=(),
+                        help='usernames that are already registered')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = StandinConfig(
+        registration_shared_secret=args.shared_secret,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        rate_limit=args.rate_limit,
+        rate_limit_burst=args.rate_limit_burst,
+        nonce_timeout=args.nonce_timeout,
+        taken_usernames=set(args.taken),
+    )
+    web.run_app(MatrixStandin(config).create_app(), host=args.host, port=args.port,
+                access_log=None)
+
+
+if __name__ == '__main__':
+    main()
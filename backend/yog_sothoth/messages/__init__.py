@@ -1,10 +1,12 @@
 """Expose messages modules."""
 from . import generic
 from . import manager
+from . import templates
 from . import user
 
 __all__ = (
     'generic',
     'manager',
+    'templates',
     'user',
 )
@@ -1,11 +1,15 @@
 """Generic messages collection."""
+from html import escape
 from typing import List
 
 
 def action_new_registration(matrix_url: str, *, html: bool = False) -> List[str]:
     """Get the new registration message parts."""
     if html:
-        return []
+        return [
+            f'<p>We have received a Matrix account registration request at',
+            f'<a href="{escape(matrix_url)}">{escape(matrix_url)}</a></p>',
+        ]
     return [
         f'  We have received a Matrix account registration request at',
         f'  {matrix_url}',
@@ -16,7 +20,10 @@ def action_new_registration(matrix_url: str, *, html: bool = False) -> List[str]
 def status_changes_repetition(*, html: bool = False) -> List[str]:
     """Get the status changes repetition message parts."""
     if html:
-        return []
+        return [
+            f'<p>You will receive an email like this whenever the status of this',
+            f'registration request changes.</p>',
+        ]
     return [
         f'  You will receive an email like this whenever the status of this',
         f'  registration request changes.',
@@ -35,7 +42,11 @@ def status_changed(status: str,
     else:
         matrix_text = ''
     if html:
-        return []
+        return [
+            f'<p>The {matrix_text}<strong>status</strong> of the '  # no comma
+            f'registration request <strong>{escape(rid)}</strong> '  # no comma
+            f'changed to: <strong>{escape(status)}</strong>.</p>',
+        ]
     return [
         f'  The {matrix_text}**status** of the registration request '  # no comma
         f'**{rid}** changed to: **{status}**.',
@@ -47,7 +58,13 @@ def registration_information(rid: str, token: str,
                              *, html: bool = False) -> List[str]:
     """Get the registration information message parts."""
     if html:
-        return []
+        return [
+            f'<p>Here is the information you need to know:</p>',
+            f'<ul>',
+            f'<li><strong>registration id</strong>: <code>{escape(rid)}</code></li>',
+            f'<li><strong>token</strong>: <code>{escape(token)}</code></li>',
+            f'</ul>',
+        ]
     return [
         f'  Here is the information you need to know:',
         f'      * **registration id**:  {rid}',
@@ -59,7 +76,10 @@ def registration_information(rid: str, token: str,
 def frontend_propaganda(frontend_url: str, *, html: bool = False) -> List[str]:
     """Get the frontend propaganda message parts."""
     if html:
-        return []
+        return [
+            f'<p>You can do this and more in our web frontend:',
+            f'<a href="{escape(frontend_url)}">{escape(frontend_url)}</a></p>',
+        ]
     return [
         f'  You can do this and more in our web frontend:',
         f'  {frontend_url}',
@@ -70,7 +90,9 @@ def frontend_propaganda(frontend_url: str, *, html: bool = False) -> List[str]:
 def contact_address(contact: str, *, html: bool = False) -> List[str]:
     """Get the contact address message parts."""
     if html:
-        return []
+        return [
+            f'<p>For any questions address yourself to {escape(contact)}</p>',
+        ]
     return [
         f'  For any questions address yourself to {contact}',
         f'',
@@ -80,7 +102,11 @@ def contact_address(contact: str, *, html: bool = False) -> List[str]:
 def signature(*, html: bool = False) -> List[str]:
     """Get the signature message parts."""
     if html:
-        return []
+        return [
+            f'<p>Please DO NOT reply to this email.</p>',
+            f'<p>Regards,<br>',
+            f'Yog-Sothoth, the key and guardian of the gate.</p>',
+        ]
     return [
         f'  Please DO NOT reply to this email.',
         f'',
@@ -88,3 +114,19 @@ def signature(*, html: bool = False) -> List[str]:
         f'Yog-Sothoth, the key and guardian of the gate.',
         f'',
     ]
+
+
+def curl_command(command: List[str], *, html: bool = False) -> List[str]:
+    """Get the message parts to run a curl command in the terminal."""
+    if html:
+        return [
+            f'<p>Open your terminal and type:</p>',
+            f'<pre>',
+            *(escape(line) for line in command),
+            f'</pre>',
+        ]
+    return [
+        f'      * Open your terminal and type:',
+        *(f'          {line}' for line in command),
+        f'',
+    ]
@@ -1,14 +1,19 @@
 """Manager messages collection."""
+from html import escape
 from typing import List
 
 from yog_sothoth import schemas
 from yog_sothoth.utils.project import get_app_base_url
+from .generic import curl_command
+from .templates import static
 
 
 def salutation(*, html: bool = False) -> List[str]:
     """Get the salutation message parts for the managers."""
     if html:
-        return []
+        return [
+            f'<p>Dear Gate Keepers:</p>',
+        ]
     return [
         f'Dear Gate Keepers:',
         f'',
@@ -19,17 +24,21 @@ def curl_registration_status(rid: str, manager_token: str,
                              *, html: bool = False) -> List[str]:
     """Get the registration status instructions message parts for the managers."""
     # ToDo: get API URL programmatically
+    command = [
+        f'curl \\',
+        f'    -X GET \\',
+        f'    -u {rid}:{manager_token} \\',
+        f'    -H "Accept: application/json" \\',
+        f'    "{static(get_app_base_url())}/v1/registrations/{rid}/"',
+    ]
     if html:
-        return []
+        return [
+            f'<p>To check this registration request information:</p>',
+            *curl_command(command, html=True),
+        ]
     return [
         f'  To check this registration request information:',
-        f'      * Open your terminal and type:',
-        f'          curl \\',
-        f'              -X GET \\',
-        f'              -u {rid}:{manager_token} \\',
-        f'              -H "Accept: application/json" \\',
-        f'              "{get_app_base_url()}/v1/registrations/{rid}/"',
-        f'',
+        *curl_command(command),
     ]
 
 
@@ -37,20 +46,55 @@ def curl_change_registration_status(rid: str, manager_token: str,
                                     *, html: bool = False) -> List[str]:
     """Get instructions to change registration status message parts for the managers."""
     # ToDo: get API URL programmatically
+    command = [
+        f'curl \\',
+        f'    -X PUT \\',
+        f'    -u {rid}:{manager_token} \\',
+        f'    -H "Accept: application/json" \\',
+        f'    -H "Content-Type: application/json" \\',
+        f'    -d "{{\\"status\\": \\"<options>\\"}}" \\',
+        f'    "{static(get_app_base_url())}/v1/registrations/{rid}/"',
+    ]
+    options = (f'{schemas.RegistrationStatusUpdateEnum.approved} | '  # no comma
+               f'{schemas.RegistrationStatusUpdateEnum.rejected}')
     if html:
-        return []
+        return [
+            f'<p>To change this registration status (approve or reject):</p>',
+            *curl_command(command, html=True),
+            f'<p>Options: <code>{escape(options)}</code></p>',
+        ]
     return [
         f'  To change this registration status (approve or reject):',
-        f'      * Open your terminal and type:',
-        f'          curl \\',
-        f'              -X PUT \\',
-        f'              -u {rid}:{manager_token} \\',
-        f'              -H "Accept: application/json" \\',
-        f'              -H "Content-Type: application/json" \\',
-        f'              -d "{{\\"status\\": \\"<options>\\"}}" \\',
-        f'              "{get_app_base_url()}/v1/registrations/{rid}/"',
+        *curl_command(command),
+        f'          Options: {options}',
+        f'',
+    ]
+
+
+def digest_introduction(events: str, registrations: str,
+                        *, html: bool = False) -> List[str]:
+    """Get the digest introduction message parts for the managers."""
+    if html:
+        return [
+            f'<p>There were {escape(events)} events for '  # no comma
+            f'{escape(registrations)} registration requests lately.</p>',
+        ]
+    return [
+        f'  There were {events} events for {registrations} registration requests '
+        f'lately.',
         f'',
-        f'          Options: {schemas.RegistrationStatusUpdateEnum.approved}'  # no comma
-        f' | {schemas.RegistrationStatusUpdateEnum.rejected}',
+    ]
+
+
+def digest_registration(rid: str, *, html: bool = False) -> List[str]:
+    """Get the digest registration header message parts for the managers."""
+    if html:
+        return [
+            f'<hr>',
+            f'<h3>Registration request <strong>{escape(rid)}</strong>:</h3>',
+        ]
+    return [
+        f'  ----------------------------------------------------------------------',
+        f'  Registration request **{rid}**:',
         f'',
     ]
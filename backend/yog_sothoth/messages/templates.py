@@ -0,0 +1,115 @@
+"""Message templates.
+
+Messages are compiled once from their parts into templates, with both a plain
+text and an HTML alternative. Static sections (such as the signature) are
+rendered when compiling, so that only the per-registration fields, given as
+placeholders to the message parts, are substituted when sending.
+
+Compilers are registered with the `compiled` decorator, so that every template
+can be compiled on startup with `compile_templates`.
+"""
+import functools
+import html
+from string import Template
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Sequence
+
+TCompiler = Callable[[], 'MessageTemplate']
+
+_compilers: List[TCompiler] = []
+
+HTML_DOCUMENT_START = (
+    '<!DOCTYPE html>',
+    '<html>',
+    '<head><meta charset="utf-8"></head>',
+    '<body>',
+)
+HTML_DOCUMENT_END = (
+    '</body>',
+    '</html>',
+)
+
+
+class RenderedMessage(NamedTuple):
+    """Message rendered as plain text and HTML."""
+
+    plain: str
+    html: str
+
+
+class MessageTemplate(NamedTuple):
+    """Message template with a plain text and an HTML alternative."""
+
+    plain: Template
+    html: Template
+
+    def render(self, **fields: any) -> RenderedMessage:
+        """Render the message substituting the given fields.
+
+        Fields are formatted as in f-strings, and escaped for the HTML alternative.
+
+        :raise KeyError: A field is missing.
+        """
+        values = {name: f'{value}' for name, value in fields.items()}
+        return RenderedMessage(
+            plain=self.plain.substitute(values),
+            html=self.html.substitute({name: html.escape(value)
+                                       for name, value in values.items()}),
+        )
+
+
+def field(name: str) -> str:
+    """Get the placeholder of a field, to be given to message parts."""
+    return f'${{{name}}}'
+
+
+def static(value: str) -> str:
+    """Escape a static value, such as a setting, to be given to message parts."""
+    return value.replace('$', '$$')
+
+
+def compile_template(parts_plain: Sequence[str],
+                     parts_html: Sequence[str],
+                     *,
+                     fragment: bool = False) -> MessageTemplate:
+    """Compile a message template from its plain text and HTML parts.
+
+    :param parts_plain: Plain text message parts.
+    :param parts_html: HTML message parts, for the body of the document.
+    :param fragment: [optional] True to compile a fragment of a message, whose
+                     HTML alternative is not a whole document, to be joined with
+                     `join_fragments`.
+    :return: The message template.
+    """
+    if not fragment:
+        parts_html = [*HTML_DOCUMENT_START, *parts_html, *HTML_DOCUMENT_END]
+    return MessageTemplate(plain=Template('\n'.join(parts_plain)),
+                           html=Template('\n'.join(parts_html)))
+
+
+def join_fragments(fragments: Sequence[RenderedMessage]) -> RenderedMessage:
+    """Join rendered message fragments into a message."""
+    return RenderedMessage(
+        plain='\n'.join(fragment.plain for fragment in fragments),
+        html='\n'.join([*HTML_DOCUMENT_START,
+                        *(fragment.html for fragment in fragments),
+                        *HTML_DOCUMENT_END]),
+    )
+
+
+def compiled(compiler: TCompiler) -> TCompiler:
+    """Compile the template once, when first needed or on `compile_templates`."""
+    cached = functools.lru_cache(maxsize=None)(compiler)
+    _compilers.append(cached)
+    return cached
+
+
+def compile_templates() -> Dict[str, MessageTemplate]:
+    """Compile every registered message template that is not compiled yet.
+
+    :return: Message templates by compiler name.
+    """
+    return {compiler.__name__: compiler() for compiler in _compilers}
@@ -1,14 +1,19 @@
 """User messages collection."""
+from html import escape
 from typing import List
 
 from yog_sothoth import schemas
 from yog_sothoth.utils.project import get_app_base_url
+from .generic import curl_command
+from .templates import static
 
 
 def salutation(username: str, *, html: bool = False) -> List[str]:
     """Get the salutation message parts for a user."""
     if html:
-        return []
+        return [
+            f'<p>Dear {escape(username)}:</p>',
+        ]
     return [
         f'Dear {username}:',
         f'',
@@ -19,7 +24,15 @@ def registration_information(rid: str, token: str,
                              *, html: bool = False) -> List[str]:
     """Get the registration information message parts."""
     if html:
-        return []
+        return [
+            f'<p>Here is the information you need to know:</p>',
+            f'<ul>',
+            f'<li><strong>registration id</strong>: <code>{escape(rid)}</code></li>',
+            f'<li><strong>token</strong>: <code>{escape(token)}</code></li>',
+            f'</ul>',
+            f'<p>If you did not apply for this registration, please '  # no comma
+            f'<strong>delete it now</strong>.</p>',
+        ]
     return [
         f'  Here is the information you need to know:',
         f'      * **registration id**:  {rid}',
@@ -33,55 +46,70 @@ def registration_information(rid: str, token: str,
 def curl_registration_status(rid: str, token: str, *, html: bool = False) -> List[str]:
     """Get the registration status instructions message parts for a user."""
     # ToDo: get API URL programmatically
+    command = [
+        f'curl \\',
+        f'    -X GET \\',
+        f'    -u {rid}:{token} \\',
+        f'    -H "Accept: application/json" \\',
+        f'    "{static(get_app_base_url())}/v1/registrations/{rid}/"',
+    ]
     if html:
-        return []
+        return [
+            f'<p>To check your registration request information:</p>',
+            *curl_command(command, html=True),
+        ]
     return [
         f'  To check your registration request information:',
-        f'      * Open your terminal and type:',
-        f'          curl \\',
-        f'              -X GET \\',
-        f'              -u {rid}:{token} \\',
-        f'              -H "Accept: application/json" \\',
-        f'              "{get_app_base_url()}/v1/registrations/{rid}/"',
-        f'',
+        *curl_command(command),
     ]
 
 
 def curl_delete_registration(rid: str, token: str, *, html: bool = False) -> List[str]:
     """Get the registration deletion message parts for the user."""
+    command = [
+        f'curl \\',
+        f'    -X DELETE \\',
+        f'    -u {rid}:{token} \\',
+        f'    -H "Accept: application/json" \\',
+        f'    "{static(get_app_base_url())}/v1/registrations/{rid}/"',
+    ]
     if html:
-        return []
+        return [
+            f'<p>To delete your registration request:</p>',
+            *curl_command(command, html=True),
+        ]
     return [
         f'  To delete your registration request:',
-        f'      * Open your terminal and type:',
-        f'          curl \\',
-        f'              -X DELETE \\',
-        f'              -u {rid}:{token} \\',
-        f'              -H "Accept: application/json" \\',
-        f'              "{get_app_base_url()}/v1/registrations/{rid}/"',
-        f'',
+        *curl_command(command),
     ]
 
 
 def status_approved(rid: str, token: str, *, html: bool = False) -> List[str]:
     """Get the status approved message parts for the user."""
+    command = [
+        f'curl \\',
+        f'    -X PATCH \\',
+        f'    -u {rid}:{token} \\',
+        f'    -H "Accept: application/json" \\',
+        f'    -H "Content-Type: application/json" \\',
+        f'    -d "{{\\"matrix_status\\": '  # no comma
+        f'\\"{schemas.MatrixRegStatusUpdateEnum.processing}\\", '  # no comma
+        f'\\"username\\": \\"<username>\\"}}" \\',
+        f'    "{static(get_app_base_url())}/v1/registrations/{rid}/"',
+    ]
     if html:
-        return []
+        return [
+            f'<p><strong>IMPORTANT</strong>:<br>',
+            f'To finish your registration request and '  # no comma
+            f'<strong>create your Matrix account</strong>, send the '  # no comma
+            f'<strong>username</strong> you want to have:</p>',
+            *curl_command(command, html=True),
+        ]
     return [
         f'  **IMPORTANT**:',
         f'  To finish your registration request and **create your Matrix '  # no comma
         f'account**, send the **username** you want to have:',
-        f'      * Open your terminal and type:',
-        f'          curl \\',
-        f'              -X PATCH \\',
-        f'              -u {rid}:{token} \\',
-        f'              -H "Accept: application/json" \\',
-        f'              -H "Content-Type: application/json" \\',
-        f'              -d "{{\\"matrix_status\\": '  # no comma
-        f'\\"{schemas.MatrixRegStatusUpdateEnum.processing}\\", '  # no comma
-        f'\\"username\\": \\"<username>\\"}}" \\',
-        f'              "{get_app_base_url()}/v1/registrations/{rid}/"',
-        f'',
+        *curl_command(command),
     ]
 
 
@@ -89,7 +117,11 @@ def matrix_account_created(user_id: str, home_server: str,
                            *, html: bool = False) -> List[str]:
     """Get the matrix account created message parts for the user."""
     if html:
-        return []
+        return [
+            f'<p>Here is your Matrix account user identifier for '  # no comma
+            f'{escape(home_server)}:<br>',
+            f'<code>{escape(user_id)}</code></p>',
+        ]
     return [
         f'  Here is your Matrix account user identifier for {home_server}:',
         f'  {user_id}',
@@ -5,6 +5,8 @@ from typing import Optional
 
 from aioredis import Redis
 
+from yog_sothoth.cache import RATE_LIMIT_KEYS
+
 
 class RateLimit:
     """Implement rate limit mechanism."""
@@ -16,11 +18,11 @@ class RateLimit:
         self._cache: Redis = cache
         self.limit: int = limit if limit else 0
 
-    @classmethod
-    def _derive_key(cls, identifier: str) -> str:
+    @staticmethod
+    def _derive_key(identifier: str) -> str:
         """Get a hashed key from an identifier."""
         hashed_identifier = blake2b(identifier.encode(), digest_size=16).hexdigest()
-        return f'{cls.__name__}:{hashed_identifier}'
+        return RATE_LIMIT_KEYS.key(hashed_identifier)
 
     @staticmethod
     def compute_expiration_time(count: int) -> int:
@@ -30,10 +32,14 @@ class RateLimit:
         """
         return ceil(1 / 2 * (2 ** count - 1) + 1)
 
-    async def verify_below(self, identifier: str) -> bool:
-        """Verify if a key is below given limit."""
+    async def verify_below(self, identifier: str, cost: int = 1) -> bool:
+        """Verify if a key is below given limit.
+
+        :param identifier: Client identifier.
+        :param cost: [optional] Number of requests to count.
+        """
         key = self._derive_key(identifier)
-        count = await self._cache.incr(key)
+        count = await self._cache.incrby(key, cost)
         ttl = self.compute_expiration_time(count)
         await self._cache.expire(key, ttl)
         return count < self.limit
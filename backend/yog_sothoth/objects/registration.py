@@ -12,11 +12,13 @@ from typing import Dict
 from typing import Optional
 from typing import Sequence
 from typing import Set
+from typing import Tuple
 from typing import Union
 
 from aioredis import Redis
 
 from yog_sothoth import schemas
+from yog_sothoth.cache import REGISTRATION_KEYS
 from yog_sothoth.conf import settings
 from yog_sothoth.utils.crypto import Hasher
 from yog_sothoth.utils.json import JSONEncoder
@@ -25,6 +27,16 @@ logger = logging.getLogger(__name__)
 
 TUnorderedSeqStr = Union[Sequence[str], Set[str]]
 
+# Set a key keeping its current expiry if any or setting the given one otherwise
+# (Redis < 6 lacks the KEEPTTL option)
+SET_KEEPING_EXPIRY_SCRIPT = """
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    return redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+end
+return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+"""
+
 
 @dataclass
 class Registration:
@@ -58,6 +70,16 @@ class Registration:
             return datetime.fromisoformat(value)
         raise TypeError('Unsupported type for datetime conversion')
 
+    @property
+    def key(self) -> str:
+        """Get the cache key for this registration."""
+        return REGISTRATION_KEYS.key(self.rid)
+
+    @property
+    def legacy_key(self) -> str:
+        """Get the cache key used for this registration before the keys schema."""
+        return self.rid
+
     @property
     def creation(self) -> datetime:
         """Get creation timestamp."""
@@ -202,14 +224,29 @@ class Registration:
         ))
         return can_create
 
+    def get_ttl_policy(self) -> Tuple[int, bool]:
+        """Get the time to live policy for the current status.
+
+        :return: A tuple of the time to live in seconds and whether the current
+                 expiry of the stored registration should be kept.
+        """
+        state = (schemas.RegistrationStatusEnum(self.status).value,
+                 schemas.MatrixRegStatusEnum(self.matrix_status).value)
+        return settings.CACHE_TTL_POLICY.get(state, (settings.CACHE_TTL, False))
+
     async def save(self) -> bool:
-        """Store itself in the cache.
+        """Store itself in the cache, setting its expiry according to the TTL policy.
 
         :return: True if storing is successful, False otherwise.
         """
         self.modification = datetime.now()
         json_data = await self.as_json(hashed=True)
-        result = await self.cache.set(self.rid, json_data, expire=settings.CACHE_TTL)
+        ttl, keep_expiry = self.get_ttl_policy()
+        if keep_expiry:
+            result = await self.cache.eval(SET_KEEPING_EXPIRY_SCRIPT, keys=[self.key],
+                                           args=[json_data, ttl]) == b'OK'
+        else:
+            result = await self.cache.set(self.key, json_data, expire=ttl)
         if not result:
             # There's no reason why saving would fail, so log it
             logger.warning('Saving registration data in the cache failed for data: %s',
@@ -219,12 +256,17 @@ class Registration:
     async def retrieve(self) -> bool:
         """Retrieve itself from the cache.
 
+        During the keys schema transition window, the legacy key is read if
+        the registration is not found.
+
         :return True for cache hit, False otherwise.
         """
-        if not await self.cache.exists(self.rid):
+        json_data = await self.cache.get(self.key)
+        if json_data is None and settings.CACHE_LEGACY_KEYS_FALLBACK:
+            json_data = await self.cache.get(self.legacy_key)
+        if json_data is None:
             return False
 
-        json_data = await self.cache.get(self.rid)
         self.from_json(json_data)
         return True
 
@@ -233,12 +275,8 @@ class Registration:
 
         :return: True if deletion is successful, False otherwise.
         """
-        if not await self.cache.exists(self.rid):
-            return False
-
-        result = bool(await self.cache.delete(self.rid))
-        if not result:
-            # There's no reason why deleting would fail, so log it
-            logger.warning('Deleting registration data in the cache failed for key: %s',
-                           self.rid)
-        return result
+        keys = [self.key]
+        if settings.CACHE_LEGACY_KEYS_FALLBACK:
+            keys.append(self.legacy_key)
+        # Deleting a non-existing key is a no-op so there's no need to check first
+        return bool(await self.cache.delete(*keys))
@@ -0,0 +1,82 @@
+"""Create Matrix accounts in bulk from the command line.
+
+Run it with a file with one JSON item per line, such as:
+
+    {"rid": "...", "manager_token": "...", "username": "..."}
+
+Each item result is printed as a JSON line as soon as it's done.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import Iterable
+from typing import List
+from typing import TextIO
+
+from pydantic import ValidationError
+
+from yog_sothoth import schemas
+from yog_sothoth.cache import REGISTRATIONS_CACHE_ALIAS
+from yog_sothoth.cache import close_cache
+from yog_sothoth.cache import get_cache_pool
+from yog_sothoth.conf import settings
+from yog_sothoth.connectors.matrix import close_nonce_pools
+from yog_sothoth.tasks import task_create_matrix_accounts
+from yog_sothoth.utils.connectors import close_session
+from yog_sothoth.utils.connectors import open_session
+
+TItem = schemas.RegistrationBulkCreateAccountItem
+
+
+def _read_items(file: TextIO) -> Iterable[TItem]:
+    for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield TItem(**json.loads(line))
+        except (ValueError, TypeError, ValidationError) as exc:
+            raise ValueError(f'Invalid item in line {line_number}: {exc}')
+
+
+async def _main(items: List[TItem], *, concurrency: int) -> None:
+    cache = await get_cache_pool(REGISTRATIONS_CACHE_ALIAS)
+    await open_session(
+        limit=settings.REQUESTS_POOL_LIMIT,
+        limit_per_host=settings.REQUESTS_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=settings.REQUESTS_KEEPALIVE_TIMEOUT,
+    )
+    try:
+        async for result in task_create_matrix_accounts(cache, items,
+                                                        concurrency=concurrency):
+            print(result.json(), flush=True)
+    finally:
+        await close_nonce_pools()
+        await close_session()
+        await close_cache(cache)
+
+
+def main() -> None:
+    """Create Matrix accounts in bulk from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Create Matrix accounts for many approved registration requests, '
+                    'printing each result as a JSON line.',
+    )
+    parser.add_argument('items', type=argparse.FileType('r'),
+                        help='file with one JSON item per line with the rid, '
+                             'manager_token and username (- for stdin)')
+    parser.add_argument('--concurrency', type=int,
+                        default=settings.MATRIX_BULK_CONCURRENCY,
+                        help='maximum accounts being created at the same time '
+                             '(defaults to %(default)s)')
+    args = parser.parse_args()
+    try:
+        items = list(_read_items(args.items))
+    except ValueError as exc:
+        sys.exit(str(exc))
+    asyncio.run(_main(items, concurrency=args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
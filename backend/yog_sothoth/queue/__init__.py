@@ -0,0 +1,20 @@
+"""Expose the durable task queue."""
+from .consumer import Consumer
+from .consumer import JobRejectedError
+from .consumer import THandler
+from .consumer import get_consumer_name
+from .scheduler import Scheduler
+from .streams import Job
+from .streams import TaskQueue
+from .streams import get_task_queue
+
+__all__ = (
+    'Consumer',
+    'Job',
+    'JobRejectedError',
+    'Scheduler',
+    'TaskQueue',
+    'THandler',
+    'get_consumer_name',
+    'get_task_queue',
+)
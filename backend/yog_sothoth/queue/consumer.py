@@ -0,0 +1,278 @@
+"""Task queue consumer.
+
+A consumer reads jobs from a queue and runs their handlers concurrently, up to a
+limit. A job is acknowledged when its handler finishes; if it fails, it's left
+pending to be retried once its visibility timeout elapses. In the meantime, the
+consumer sends heartbeats for its running jobs and reclaims the stuck jobs of
+other consumers.
+
+When stopped, a consumer stops reading jobs and waits for the running ones to
+finish, up to a timeout: the unfinished ones are retried by any consumer once
+their visibility timeout elapses.
+"""
+import asyncio
+import logging
+import os
+import socket
+from time import monotonic
+from time import time
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from aioredis import Redis
+
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import LazyCache
+from yog_sothoth.cache import close_connection
+from yog_sothoth.cache import get_redis_connection
+from yog_sothoth.conf import settings
+from yog_sothoth.utils.metrics import registry
+from .streams import Job
+from .streams import TaskQueue
+from .streams import get_task_queue
+from .streams import jobs_counter
+
+logger = logging.getLogger(__name__)
+
+THandler = Callable[[Dict[str, any]], Awaitable[any]]
+
+jobs_running_gauge = registry.gauge(
+    'yog_task_jobs_running',
+    'Jobs being run by this process',
+)
+job_duration_histogram = registry.histogram(
+    'yog_task_job_duration_seconds',
+    'Time taken to run a job, successfully or not',
+)
+job_wait_histogram = registry.histogram(
+    'yog_task_job_wait_seconds',
+    'Time since a job was enqueued until it was started',
+)
+queue_jobs_gauge = registry.gauge(
+    'yog_task_queue_jobs',
+    'Jobs in the queue, waiting or running',
+)
+dead_letter_jobs_gauge = registry.gauge(
+    'yog_task_dead_letter_jobs',
+    'Jobs in the dead letter stream',
+)
+
+
+class JobRejectedError(Exception):
+    """Raised by a handler when a job can never succeed, i.e. on permanent errors.
+
+    The job is moved to the dead letter stream right away instead of retried.
+    """
+
+
+def get_consumer_name() -> str:
+    """Get a consumer name that is unique to this process."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class Consumer:
+    """Task queue consumer, running jobs concurrently."""
+
+    READ_TIMEOUT = 5  # Seconds to wait for new jobs on each read
+    RETRY_DELAY = 5  # Seconds to wait before retrying when the cache is unavailable
+    MAX_IDLE_CONSUMER = 24 * 3600  # Seconds before removing another idle consumer
+
+    __slots__ = ('cache', 'queue', 'handlers', 'name', 'concurrency', 'drain_timeout',
+                 '_running', '_stopping')
+
+    def __init__(self,
+                 cache: LazyCache,
+                 queue: str,
+                 handlers: Dict[str, THandler],
+                 *,
+                 name: Optional[str] = None,
+                 concurrency: int = 10,
+                 drain_timeout: float = 0):
+        """Task queue consumer.
+
+        :param cache: Tasks cache.
+        :param queue: Queue name.
+        :param handlers: Job handlers by job name, receiving the job payload.
+        :param name: [optional] Consumer name, unique among every consumer
+                     (defaults to one unique to this process).
+        :param concurrency: [optional] Maximum number of jobs running at the same
+                            time.
+        :param drain_timeout: [optional] Seconds to wait for running jobs to
+                              finish when stopped.
+        """
+        self.cache: LazyCache = cache
+        self.queue: str = queue
+        self.handlers: Dict[str, THandler] = handlers
+        self.name: str = name or get_consumer_name()
+        self.concurrency: int = max(concurrency, 1)
+        self.drain_timeout: float = drain_timeout
+        self._running: Dict[asyncio.Task, Job] = {}
+        self._stopping: Optional[asyncio.Event] = None  # Created within the loop
+
+    @property
+    def running(self) -> List[Job]:
+        """Get the jobs being run."""
+        return list(self._running.values())
+
+    @property
+    def stopping(self) -> bool:
+        """Get whether the consumer was stopped."""
+        return self._stopping is not None and self._stopping.is_set()
+
+    def stop(self) -> None:
+        """Stop reading jobs: `run` returns once the running jobs finish."""
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        self._stopping.set()
+
+    async def _sleep(self, seconds: float) -> None:
+        """Sleep for the given seconds, or until stopped."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _get_queue(self) -> TaskQueue:
+        return get_task_queue(await self.cache.get(), self.queue)
+
+    async def _run_job(self, queue: TaskQueue, job: Job) -> None:
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            logger.error('No handler for job %s (%s), moving it to the dead letter '
+                         'stream', job.id, job.name)
+            await queue.bury(job, 'No handler')
+            return
+
+        # Job ids are the time they were enqueued in milliseconds
+        job_wait_histogram.observe(max(0.0, time() - int(job.id.split('-')[0]) / 1000),
+                                   queue=self.queue)
+        started_at = monotonic()
+        try:
+            await handler(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except JobRejectedError as exc:
+            logger.error('Job %s (%s) rejected, moving it to the dead letter stream: '
+                         '%s', job.id, job.name, repr(exc))
+            await queue.bury(job, str(exc))
+            return
+        except Exception:  # noqa: B902
+            # Leave it pending, it's retried once the visibility timeout elapses
+            logger.exception('Job %s (%s) failed, retrying in %.0f seconds', job.id,
+                             job.name, queue.visibility_timeout)
+            jobs_counter.inc(queue=self.queue, job=job.name, outcome='failed')
+            return
+        finally:
+            job_duration_histogram.observe(monotonic() - started_at, queue=self.queue,
+                                           job=job.name)
+        await queue.ack(job)
+
+    async def _run_job_isolated(self, queue: TaskQueue, job: Job) -> None:
+        jobs_running_gauge.inc(queue=self.queue)
+        try:
+            await self._run_job(queue, job)
+        except CACHE_ERRORS as exc:
+            # The job is retried once the visibility timeout elapses
+            logger.warning('Error updating job %s (%s) in the queue: %s', job.id,
+                           job.name, repr(exc))
+        finally:
+            jobs_running_gauge.dec(queue=self.queue)
+
+    def _start(self, queue: TaskQueue, job: Job) -> None:
+        task = asyncio.ensure_future(self._run_job_isolated(queue, job))
+        self._running[task] = job
+        task.add_done_callback(self._running.pop)
+
+    async def _wait_for_capacity(self) -> int:
+        """Wait until jobs can be started and get how many."""
+        while len(self._running) >= self.concurrency:
+            await asyncio.wait(list(self._running),
+                               return_when=asyncio.FIRST_COMPLETED)
+        return self.concurrency - len(self._running)
+
+    async def _consume(self, connection: Redis) -> None:
+        queue = await self._get_queue()
+        await queue.ensure_group()
+        while not self.stopping:
+            capacity = await self._wait_for_capacity()
+            queue = await self._get_queue()
+            jobs = await queue.read(connection, self.name, count=capacity,
+                                    timeout=self.READ_TIMEOUT)
+            # Jobs read are run even if stopped meanwhile, they are delivered already
+            for job in jobs:
+                self._start(queue, job)
+
+    async def _maintain(self) -> None:
+        """Send heartbeats for running jobs and reclaim stuck jobs, periodically.
+
+        The queue depth is measured as well.
+        """
+        while True:
+            await asyncio.sleep(settings.TASKS_VISIBILITY_TIMEOUT / 3)
+            try:
+                queue = await self._get_queue()
+                await queue.touch(self.name, self.running)
+                jobs, dead_jobs = await queue.get_depth()
+                queue_jobs_gauge.set(jobs, queue=self.queue)
+                dead_letter_jobs_gauge.set(dead_jobs, queue=self.queue)
+                capacity = self.concurrency - len(self._running)
+                if capacity > 0 and not self.stopping:
+                    for job in await queue.reclaim(self.name, count=capacity):
+                        self._start(queue, job)
+                for name in await queue.prune_consumers(self.MAX_IDLE_CONSUMER):
+                    logger.info('Removed idle task queue consumer %s', name)
+            except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+                logger.warning('Error maintaining the %s task queue: %s', self.queue,
+                               repr(exc))
+
+    async def _drain(self) -> None:
+        if not self._running:
+            return
+        logger.info('Waiting up to %.0f seconds for %d running jobs of the %s task '
+                    'queue to finish', self.drain_timeout, len(self._running),
+                    self.queue)
+        _, pending = await asyncio.wait(list(self._running),
+                                        timeout=self.drain_timeout)
+        if pending:
+            logger.warning('%d jobs of the %s task queue did not finish in time, they '
+                           'will be retried', len(pending), self.queue)
+
+    async def run(self) -> None:
+        """Consume jobs until stopped or cancelled.
+
+        Jobs running when cancelled are cancelled as well, and are retried by any
+        consumer once their visibility timeout elapses.
+        """
+        if self._stopping is None:
+            self._stopping = asyncio.Event()
+        logger.info('Task queue consumer %s started for the %s queue', self.name,
+                    self.queue)
+        maintenance = asyncio.ensure_future(self._maintain())
+        try:
+            while not self.stopping:
+                connection = None
+                try:
+                    # Reading blocks the connection, so it can't be a pooled one
+                    connection = await get_redis_connection(self.cache.alias)
+                    await self._consume(connection)
+                except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+                    logger.warning('Error reading from the %s task queue, retrying '
+                                   'in %d seconds: %s', self.queue, self.RETRY_DELAY,
+                                   repr(exc))
+                    await self._sleep(self.RETRY_DELAY)
+                finally:
+                    if connection is not None:
+                        await close_connection(connection)
+            await self._drain()
+        finally:
+            maintenance.cancel()
+            running = [maintenance, *self._running]
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            logger.info('Task queue consumer %s stopped for the %s queue', self.name,
+                        self.queue)
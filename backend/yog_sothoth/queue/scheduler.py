@@ -0,0 +1,80 @@
+"""Delayed jobs scheduler.
+
+The scheduler moves delayed jobs to their queue once due. Instead of polling,
+it sleeps until the next job is due, blocked on a wakeup list so that it's woken
+up right away when a job that is due sooner is delayed. Any number of schedulers
+can run at the same time.
+"""
+import asyncio
+import logging
+import math
+from time import time
+
+from aioredis import Redis
+
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import LazyCache
+from yog_sothoth.cache import close_connection
+from yog_sothoth.cache import get_redis_connection
+from .streams import TaskQueue
+from .streams import get_task_queue
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Delayed jobs scheduler for a task queue."""
+
+    BATCH_SIZE = 100  # Jobs moved to the queue at once
+    MAX_WAIT = 60  # Seconds to wait at most between checks, in case of clock skews
+    RETRY_DELAY = 5  # Seconds to wait before retrying when the cache is unavailable
+
+    __slots__ = ('cache', 'queue')
+
+    def __init__(self, cache: LazyCache, queue: str):
+        """Delayed jobs scheduler.
+
+        :param cache: Tasks cache.
+        :param queue: Queue name.
+        """
+        self.cache: LazyCache = cache
+        self.queue: str = queue
+
+    async def _get_queue(self) -> TaskQueue:
+        return get_task_queue(await self.cache.get(), self.queue)
+
+    async def _schedule(self, connection: Redis) -> None:
+        while True:
+            queue = await self._get_queue()
+            while await queue.enqueue_due(count=self.BATCH_SIZE) == self.BATCH_SIZE:
+                pass
+
+            next_due = await queue.get_next_due()
+            if next_due is None:
+                wait = self.MAX_WAIT
+            else:
+                # Blocking commands take whole seconds
+                wait = min(max(math.ceil(next_due - time()), 1), self.MAX_WAIT)
+            await connection.blpop(queue.wakeup_key, timeout=wait)
+
+    async def run(self) -> None:
+        """Move delayed jobs to the queue once due, until cancelled."""
+        logger.info('Delayed jobs scheduler started for the %s queue', self.queue)
+        try:
+            while True:
+                connection = None
+                try:
+                    # Waiting blocks the connection, so it can't be a pooled one
+                    connection = await get_redis_connection(self.cache.alias)
+                    await self._schedule(connection)
+                except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+                    logger.warning('Error scheduling delayed jobs of the %s queue, '
+                                   'retrying in %d seconds: %s', self.queue,
+                                   self.RETRY_DELAY, repr(exc))
+                finally:
+                    if connection is not None:
+                        await close_connection(connection)
+                await asyncio.sleep(self.RETRY_DELAY)
+        finally:
+            logger.info('Delayed jobs scheduler stopped for the %s queue', self.queue)
@@ -0,0 +1,374 @@
+"""Durable task queue on Redis Streams.
+
+Jobs are appended to a stream and read through a consumer group, so each job is
+delivered to a single consumer and stays pending until it's acknowledged. A
+consumer keeps its running jobs alive with heartbeats: jobs whose consumer died
+or got stuck go without one, and once their visibility timeout elapses they are
+reclaimed by another consumer. Jobs that keep failing are moved to a dead letter
+stream after a maximum number of deliveries.
+
+There's a stream per queue, so that each kind of job can be consumed with its
+own concurrency. Acknowledged jobs are deleted from the stream, so it only holds
+pending work.
+
+Jobs can also be delayed: they are kept in a sorted set scored by their due time
+until a scheduler moves them to the stream, and can be cancelled meanwhile.
+"""
+import json
+import logging
+from time import time
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from aioredis import Redis
+from aioredis import ReplyError
+
+from yog_sothoth.cache import TASK_KEYS
+from yog_sothoth.conf import settings
+from yog_sothoth.utils.json import JSONEncoder
+from yog_sothoth.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP_NAME = 'workers'
+
+jobs_counter = registry.counter(
+    'yog_task_jobs_total',
+    'Jobs finished per outcome: done, failed (to be retried) or dead (moved to '
+    'the dead letter stream)',
+)
+delayed_jobs_counter = registry.counter(
+    'yog_task_delayed_jobs_total',
+    'Delayed jobs per action: scheduled, cancelled or enqueued (once due)',
+)
+
+# Move due delayed jobs to the stream, atomically so that a job is never
+# enqueued twice by concurrent schedulers
+ENQUEUE_DUE_JOBS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, key in ipairs(due) do
+    local job = redis.call('HGET', KEYS[2], key)
+    if job then
+        job = cjson.decode(job)
+        redis.call('XADD', KEYS[3], '*', 'name', job[1], 'payload', job[2])
+    end
+    redis.call('ZREM', KEYS[1], key)
+    redis.call('HDEL', KEYS[2], key)
+end
+return #due
+"""
+
+
+class Job(NamedTuple):
+    """Job read from the queue."""
+
+    id: str
+    name: str
+    payload: Dict[str, any]
+    deliveries: int = 1
+
+
+class TaskQueue:
+    """Durable task queue on a Redis stream, read through a consumer group."""
+
+    __slots__ = ('cache', 'name', 'group', 'visibility_timeout', 'max_deliveries',
+                 'dead_letter_max_length')
+
+    def __init__(self,
+                 cache: Redis,
+                 name: str,
+                 *,
+                 group: str = DEFAULT_GROUP_NAME,
+                 visibility_timeout: float = 60,
+                 max_deliveries: int = 5,
+                 dead_letter_max_length: int = 1000):
+        """Durable task queue.
+
+        :param cache: Tasks cache.
+        :param name: Queue name.
+        :param group: [optional] Consumer group name.
+        :param visibility_timeout: [optional] Seconds a job can go without a
+                                   heartbeat before being reclaimed.
+        :param max_deliveries: [optional] Maximum deliveries of a job before
+                               moving it to the dead letter stream.
+        :param dead_letter_max_length: [optional] Approximate maximum number of
+                                       jobs kept in the dead letter stream.
+        """
+        self.cache: Redis = cache
+        self.name: str = name
+        self.group: str = group
+        self.visibility_timeout: float = visibility_timeout
+        self.max_deliveries: int = max(max_deliveries, 1)
+        self.dead_letter_max_length: int = dead_letter_max_length
+
+    @property
+    def stream(self) -> str:
+        """Get the key of the queue stream."""
+        return TASK_KEYS.key(self.name)
+
+    @property
+    def dead_letter_stream(self) -> str:
+        """Get the key of the dead letter stream."""
+        return TASK_KEYS.key(f'{self.name}:dead')
+
+    @property
+    def delayed_key(self) -> str:
+        """Get the key of the sorted set of delayed jobs, scored by due time."""
+        return TASK_KEYS.key(f'{self.name}:delayed')
+
+    @property
+    def delayed_jobs_key(self) -> str:
+        """Get the key of the hash of delayed jobs data."""
+        return TASK_KEYS.key(f'{self.name}:delayed:jobs')
+
+    @property
+    def wakeup_key(self) -> str:
+        """Get the key of the list that wakes schedulers up when a job is delayed."""
+        return TASK_KEYS.key(f'{self.name}:wakeup')
+
+    @property
+    def _visibility_timeout_ms(self) -> int:
+        return int(self.visibility_timeout * 1000)
+
+    @staticmethod
+    def _parse_entries(entries: Sequence[tuple], *, deliveries: int = 1) -> List[Job]:
+        jobs = []
+        for entry_id, fields in entries:
+            entry_id = entry_id.decode()
+            try:
+                name = fields[b'name'].decode()
+                payload = json.loads(fields[b'payload'])
+            except (KeyError, ValueError):
+                logger.error('Discarding malformed job %s', entry_id)
+                name, payload = '', {}
+            jobs.append(Job(entry_id, name, payload, deliveries))
+        return jobs
+
+    async def enqueue(self, name: str, payload: Dict[str, any]) -> str:
+        """Add a job to the queue.
+
+        :param name: Job name, i.e. its handler.
+        :param payload: Job data, as a JSON serializable dictionary.
+        :return: The job id.
+        """
+        fields = {'name': name, 'payload': json.dumps(payload, cls=JSONEncoder)}
+        job_id = await self.cache.xadd(self.stream, fields)
+        return job_id.decode()
+
+    async def schedule(self, key: str, name: str, payload: Dict[str, any], *,
+                       delay: float) -> None:
+        """Add a delayed job, to be enqueued once due.
+
+        :param key: Job key, to cancel it (a job with the same key is replaced).
+        :param name: Job name, i.e. its handler.
+        :param payload: Job data, as a JSON serializable dictionary.
+        :param delay: Seconds until the job is due.
+        """
+        job = json.dumps([name, json.dumps(payload, cls=JSONEncoder)])
+        transaction = self.cache.multi_exec()
+        transaction.hset(self.delayed_jobs_key, key, job)
+        transaction.zadd(self.delayed_key, time() + delay, key)
+        # Wake a scheduler up in case this job is due before the ones it waits for
+        transaction.lpush(self.wakeup_key, 1)
+        transaction.ltrim(self.wakeup_key, 0, 0)
+        await transaction.execute()
+        delayed_jobs_counter.inc(queue=self.name, action='scheduled')
+
+    async def cancel(self, key: str) -> bool:
+        """Cancel a delayed job that is not due yet.
+
+        :param key: Job key.
+        :return: True if the job was cancelled, False if it didn't exist.
+        """
+        transaction = self.cache.multi_exec()
+        removed = transaction.zrem(self.delayed_key, key)
+        transaction.hdel(self.delayed_jobs_key, key)
+        await transaction.execute()
+        if not await removed:
+            return False
+        delayed_jobs_counter.inc(queue=self.name, action='cancelled')
+        return True
+
+    async def enqueue_due(self, *, count: int) -> int:
+        """Move due delayed jobs to the queue.
+
+        :param count: Maximum number of jobs.
+        :return: The number of jobs moved.
+        """
+        moved = await self.cache.eval(
+            ENQUEUE_DUE_JOBS_SCRIPT,
+            keys=[self.delayed_key, self.delayed_jobs_key, self.stream],
+            args=[time(), count],
+        )
+        if moved:
+            delayed_jobs_counter.inc(moved, queue=self.name, action='enqueued')
+        return moved
+
+    async def get_next_due(self) -> Optional[float]:
+        """Get the due time of the next delayed job, if any (as a timestamp)."""
+        entries = await self.cache.zrange(self.delayed_key, 0, 0, withscores=True)
+        if not entries:
+            return None
+        _, due = entries[0]
+        return due
+
+    async def ensure_group(self) -> None:
+        """Create the stream and its consumer group unless they exist."""
+        try:
+            await self.cache.xgroup_create(self.stream, self.group, latest_id='0',
+                                           mkstream=True)
+        except ReplyError as exc:
+            if not str(exc).startswith('BUSYGROUP'):
+                raise
+
+    async def read(self, connection: Redis, consumer: str, *, count: int,
+                   timeout: float) -> List[Job]:
+        """Read new jobs, waiting for them if there are none.
+
+        :param connection: Dedicated connection to the tasks cache (the command
+                           blocks it until there are jobs or the timeout elapses).
+        :param consumer: Consumer name.
+        :param count: Maximum number of jobs.
+        :param timeout: Seconds to wait for jobs.
+        :return: A list of jobs, possibly empty.
+        """
+        messages = await connection.xread_group(
+            self.group,
+            consumer,
+            [self.stream],
+            timeout=int(timeout * 1000),
+            count=count,
+            latest_ids=['>'],
+        )
+        return self._parse_entries([(entry_id, fields)
+                                    for _, entry_id, fields in messages])
+
+    async def reclaim(self, consumer: str, *, count: int) -> List[Job]:
+        """Claim jobs whose visibility timeout elapsed.
+
+        Jobs that reached the maximum deliveries are moved to the dead letter
+        stream instead.
+
+        :param consumer: Consumer name that claims the jobs.
+        :param count: Maximum number of jobs.
+        :return: A list of claimed jobs, possibly empty.
+        """
+        # Oldest jobs are the most likely to be stuck
+        pending = await self.cache.xpending(self.stream, self.group, '-', '+', count)
+        stuck = {entry_id: deliveries for entry_id, _, idle, deliveries in pending
+                 if idle >= self._visibility_timeout_ms}
+        if not stuck:
+            return []
+
+        entries = await self.cache.xclaim(self.stream, self.group, consumer,
+                                          self._visibility_timeout_ms, *stuck)
+        jobs = []
+        for entry_id, fields in entries:
+            # Claiming counts as a delivery
+            deliveries = stuck[entry_id] + 1
+            job = self._parse_entries([(entry_id, fields)], deliveries=deliveries)[0]
+            if deliveries > self.max_deliveries:
+                logger.error('Job %s (%s) failed %d times, moving it to the dead '
+                             'letter stream', job.id, job.name, deliveries - 1)
+                await self.bury(job._replace(deliveries=deliveries - 1),
+                                'Too many deliveries')
+            else:
+                logger.warning('Job %s (%s) timed out, retrying (delivery %d of %d)',
+                               job.id, job.name, deliveries, self.max_deliveries)
+                jobs.append(job)
+        return jobs
+
+    async def touch(self, consumer: str, jobs: Sequence[Job]) -> None:
+        """Send a heartbeat for running jobs, resetting their visibility timeout.
+
+        :param consumer: Consumer name running the jobs.
+        :param jobs: Running jobs.
+        """
+        if not jobs:
+            return
+        # Claiming without getting the entries doesn't count as a delivery
+        await self.cache.execute(b'XCLAIM', self.stream, self.group, consumer, 0,
+                                 *(job.id for job in jobs), b'JUSTID')
+
+    async def ack(self, job: Job) -> None:
+        """Acknowledge a job that finished, removing it from the queue.
+
+        :param job: Finished job.
+        """
+        transaction = self.cache.multi_exec()
+        transaction.xack(self.stream, self.group, job.id)
+        transaction.xdel(self.stream, job.id)
+        await transaction.execute()
+        jobs_counter.inc(queue=self.name, job=job.name, outcome='done')
+
+    async def bury(self, job: Job, error: str) -> None:
+        """Move a job that can't be run to the dead letter stream.
+
+        :param job: Failed job.
+        :param error: Reason why the job can't be run.
+        """
+        fields = {
+            'id': job.id,
+            'name': job.name,
+            'payload': json.dumps(job.payload, cls=JSONEncoder),
+            'deliveries': job.deliveries,
+            'error': error,
+            'failed_at': int(time()),
+        }
+        transaction = self.cache.multi_exec()
+        transaction.xadd(self.dead_letter_stream, fields,
+                         max_len=self.dead_letter_max_length)
+        # Dead letters may hold sensitive data, don't keep them forever
+        transaction.expire(self.dead_letter_stream, settings.CACHE_TTL)
+        transaction.xack(self.stream, self.group, job.id)
+        transaction.xdel(self.stream, job.id)
+        await transaction.execute()
+        jobs_counter.inc(queue=self.name, job=job.name, outcome='dead')
+
+    async def get_depth(self) -> Tuple[int, int]:
+        """Get the number of jobs in the queue (waiting or running) and dead ones.
+
+        Delayed jobs are not counted until due.
+        """
+        pipe = self.cache.pipeline()
+        jobs = pipe.xlen(self.stream)
+        dead_jobs = pipe.xlen(self.dead_letter_stream)
+        await pipe.execute()
+        return await jobs, await dead_jobs
+
+    async def prune_consumers(self, max_idle: float) -> List[str]:
+        """Remove consumers that have been idle for long and have no pending jobs.
+
+        Consumers are named after their process, so they pile up in the consumer
+        group as processes are restarted.
+
+        :param max_idle: Seconds a consumer must have been idle.
+        :return: The names of the removed consumers.
+        """
+        pruned = []
+        for consumer in await self.cache.xinfo_consumers(self.stream, self.group):
+            if consumer[b'pending'] or consumer[b'idle'] < max_idle * 1000:
+                continue
+            name = consumer[b'name'].decode()
+            await self.cache.xgroup_delconsumer(self.stream, self.group, name)
+            pruned.append(name)
+        return pruned
+
+
+def get_task_queue(cache: Redis, name: str) -> TaskQueue:
+    """Get a task queue as configured in the settings.
+
+    :param cache: Tasks cache.
+    :param name: Queue name.
+    """
+    return TaskQueue(
+        cache,
+        name,
+        visibility_timeout=settings.TASKS_VISIBILITY_TIMEOUT,
+        max_deliveries=settings.TASKS_MAX_DELIVERIES,
+        dead_letter_max_length=settings.TASKS_DEAD_LETTER_MAX_LENGTH,
+    )
@@ -1,6 +1,9 @@
 """Expose schema models."""
 from .registration import MatrixRegStatusEnum
 from .registration import MatrixRegStatusUpdateEnum
+from .registration import RegistrationBulkCreateAccountItem
+from .registration import RegistrationBulkCreateAccountResult
+from .registration import RegistrationBulkCreateAccounts
 from .registration import RegistrationCreate
 from .registration import RegistrationInfo
 from .registration import RegistrationInfoReduced
@@ -9,11 +12,15 @@ from .registration import RegistrationStatusUpdateEnum
 from .registration import RegistrationUpdateByManager
 from .registration import RegistrationUpdateByUser
 from .registration import RegistrationUpdateMatrixStatus
+from .registration import RegistrationUsernameAvailability
 from .registration import UserAuthBasic
 
 __all__ = (
     'MatrixRegStatusEnum',
     'MatrixRegStatusUpdateEnum',
+    'RegistrationBulkCreateAccountItem',
+    'RegistrationBulkCreateAccountResult',
+    'RegistrationBulkCreateAccounts',
     'RegistrationCreate',
     'RegistrationInfo',
     'RegistrationInfoReduced',
@@ -22,5 +29,6 @@ __all__ = (
     'RegistrationUpdateByManager',
     'RegistrationUpdateByUser',
     'RegistrationUpdateMatrixStatus',
+    'RegistrationUsernameAvailability',
     'UserAuthBasic',
 )
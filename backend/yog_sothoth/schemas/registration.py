@@ -2,6 +2,7 @@
 import re
 from datetime import datetime
 from enum import Enum
+from typing import List
 from typing import Optional
 
 from pydantic import BaseModel
@@ -88,6 +89,49 @@ class RegistrationUpdateByUser(BaseModel):
         raise ValueError('username can only be alphanumeric with symbols: _.-')
 
 
+class RegistrationUsernameAvailability(BaseModel):
+    """Schema model class for a Matrix username availability."""
+
+    username: str
+    available: bool
+
+
+class RegistrationBulkCreateAccountItem(RegistrationUpdateByUser):
+    """Schema model class for an item of a Matrix accounts bulk creation."""
+
+    rid: str = Schema(..., min_length=6, max_length=6)
+    manager_token: str = Schema(..., min_length=11, max_length=11)
+
+
+class RegistrationBulkCreateAccounts(BaseModel):
+    """Schema model class for a Matrix accounts bulk creation by manager."""
+
+    items: List[RegistrationBulkCreateAccountItem]
+
+    # noinspection PyMethodParameters
+    @validator('items', whole=True)
+    def unique_rids(cls, value) -> List[RegistrationBulkCreateAccountItem]:  # noqa: N805
+        """Validate that there are items and registrations are not repeated."""
+        if not value:
+            raise ValueError('at least one item is required')
+        rids = [item.rid for item in value]
+        if len(rids) == len(set(rids)):
+            return value
+        raise ValueError('registration ids must not be repeated')
+
+
+class RegistrationBulkCreateAccountResult(BaseModel):
+    """Schema model class for the result of an item of a Matrix accounts bulk creation.
+
+    If the account couldn't be created, the error is set.
+    """
+
+    rid: str
+    matrix_status: Optional[MatrixRegStatusEnum] = None
+    user_id: Optional[str] = None
+    error: Optional[str] = None
+
+
 class RegistrationUpdateMatrixStatus(BaseModel):
     """Schema model class for matrix registration status update."""
 
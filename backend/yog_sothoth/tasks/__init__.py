@@ -1,18 +1,58 @@
 """Expose tasks for background tasks."""
+from .digests import is_managers_digest_enabled
+from .digests import task_send_managers_digest
+from .digests import task_send_managers_digests
+from .dispatcher import EMAIL_CHANNEL
+from .dispatcher import dispatch
+from .jobs import EMAIL_QUEUE
+from .jobs import MATRIX_QUEUE
+from .jobs import REGISTRATION_TASKS
+from .jobs import REGISTRATION_TASK_QUEUES
+from .jobs import TASK_QUEUES
+from .jobs import TRegistrationTask
+from .jobs import TUnfinishedTask
+from .jobs import cancel_registration_task
+from .jobs import enqueue_registration_task
+from .jobs import get_registration_job_handlers
+from .jobs import recover_registration_tasks
+from .jobs import run_registration_tasks
+from .matrix import task_check_matrix_username_available
 from .matrix import task_create_matrix_account
+from .matrix import task_refresh_matrix_api_version
 from .notifications import task_notify_managers_matrix_status_changed
 from .notifications import task_notify_managers_registration_received
 from .notifications import task_notify_managers_status_changed
 from .notifications import task_notify_user_matrix_status_changed
 from .notifications import task_notify_user_registration_received
 from .notifications import task_notify_user_status_changed
+from .provisioning import task_create_matrix_accounts
 
 __all__ = (
+    'EMAIL_CHANNEL',
+    'EMAIL_QUEUE',
+    'MATRIX_QUEUE',
+    'REGISTRATION_TASKS',
+    'REGISTRATION_TASK_QUEUES',
+    'TASK_QUEUES',
+    'TRegistrationTask',
+    'TUnfinishedTask',
+    'cancel_registration_task',
+    'dispatch',
+    'enqueue_registration_task',
+    'get_registration_job_handlers',
+    'is_managers_digest_enabled',
+    'recover_registration_tasks',
+    'run_registration_tasks',
+    'task_check_matrix_username_available',
     'task_create_matrix_account',
+    'task_create_matrix_accounts',
     'task_notify_managers_matrix_status_changed',
     'task_notify_managers_registration_received',
     'task_notify_managers_status_changed',
     'task_notify_user_matrix_status_changed',
     'task_notify_user_registration_received',
     'task_notify_user_status_changed',
+    'task_refresh_matrix_api_version',
+    'task_send_managers_digest',
+    'task_send_managers_digests',
 )
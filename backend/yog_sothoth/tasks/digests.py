@@ -0,0 +1,255 @@
+"""Managers notifications digest tasks.
+
+Instead of sending an email per event, managers events are buffered in a list
+in the registrations cache and sent in a single digest email, grouped per
+registration request. The digest is sent when the oldest event is older than the
+digest window, or right away when the maximum number of events is reached.
+
+Events are taken from the buffer atomically, so any number of workers can send
+digests at the same time without sending an event twice. Events of a digest that
+could not be sent are put back in the buffer, to be sent with the next one.
+Digests carry the manager tokens, so they are sent right away instead of spooled:
+the buffer keeps the events to render them again.
+"""
+import asyncio
+import json
+import logging
+from email.mime.text import MIMEText
+from time import time
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from aioredis import Redis
+
+from yog_sothoth import emails
+from yog_sothoth import messages
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.cache import DIGEST_KEYS
+from yog_sothoth.conf import settings
+from yog_sothoth.messages.templates import MessageTemplate
+from yog_sothoth.messages.templates import RenderedMessage
+from yog_sothoth.messages.templates import compile_template
+from yog_sothoth.messages.templates import compiled
+from yog_sothoth.messages.templates import field
+from yog_sothoth.messages.templates import join_fragments
+from yog_sothoth.messages.templates import static
+from yog_sothoth.objects import Registration
+from yog_sothoth.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+TEvent = Dict[str, any]
+
+MANAGERS_DIGEST_KEY = DIGEST_KEYS.key('managers')
+
+# Event kinds
+REGISTRATION_RECEIVED = 'registration_received'
+STATUS_CHANGED = 'status_changed'
+MATRIX_STATUS_CHANGED = 'matrix_status_changed'
+
+digest_events_histogram = registry.histogram(
+    'yog_managers_digest_events',
+    'Number of events per managers digest email',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+
+def is_managers_digest_enabled() -> bool:
+    """Get whether managers are notified with digests instead of per event."""
+    return settings.MANAGERS_DIGEST_WINDOW > 0
+
+
+async def add_managers_digest_event(registration: Registration, kind: str) -> None:
+    """Add a registration event to the managers digest.
+
+    The digest is sent right away if the maximum number of events is reached.
+
+    :param registration: Registration the event is about.
+    :param kind: Event kind.
+    """
+    event = {
+        'kind': kind,
+        'rid': registration.rid,
+        'status': registration.status,
+        'matrix_status': registration.matrix_status,
+        'at': time(),
+    }
+    if kind == REGISTRATION_RECEIVED:
+        # Managers need it to approve or reject the registration
+        event['manager_token'] = registration.manager_token
+    length = await registration.cache.rpush(MANAGERS_DIGEST_KEY, json.dumps(event))
+    if length >= settings.MANAGERS_DIGEST_MAX_EVENTS:
+        await task_send_managers_digest(registration.cache)
+
+
+def _compile_fragment(build_parts: Callable[[bool], List[str]]) -> MessageTemplate:
+    return compile_template(build_parts(False), build_parts(True), fragment=True)
+
+
+@compiled
+def _digest_head_template() -> MessageTemplate:
+    return _compile_fragment(lambda html: [
+        *messages.manager.salutation(html=html),
+        *messages.manager.digest_introduction(field('events'), field('registrations'),
+                                              html=html),
+    ])
+
+
+@compiled
+def _digest_registration_template() -> MessageTemplate:
+    return _compile_fragment(lambda html: [
+        *messages.manager.digest_registration(field('rid'), html=html),
+    ])
+
+
+@compiled
+def _digest_registration_received_template() -> MessageTemplate:
+    return _compile_fragment(lambda html: [
+        *messages.generic.action_new_registration(static(settings.MATRIX_URL),
+                                                  html=html),
+        *messages.generic.registration_information(field('rid'),
+                                                   field('manager_token'),
+                                                   html=html),
+        *messages.manager.curl_registration_status(field('rid'),
+                                                   field('manager_token'),
+                                                   html=html),
+        *messages.manager.curl_change_registration_status(field('rid'),
+                                                          field('manager_token'),
+                                                          html=html),
+    ])
+
+
+@compiled
+def _digest_status_changed_template() -> MessageTemplate:
+    return _compile_fragment(lambda html: [
+        *messages.generic.status_changed(field('status'), field('rid'), html=html),
+    ])
+
+
+@compiled
+def _digest_matrix_status_changed_template() -> MessageTemplate:
+    return _compile_fragment(lambda html: [
+        *messages.generic.status_changed(field('matrix_status'), field('rid'),
+                                         matrix=True, html=html),
+    ])
+
+
+@compiled
+def _digest_footer_template() -> MessageTemplate:
+    def build_parts(html: bool) -> List[str]:
+        message_parts = []
+        if settings.FRONTEND_URL:
+            message_parts.extend(
+                messages.generic.frontend_propaganda(static(settings.FRONTEND_URL),
+                                                     html=html),
+            )
+        if settings.CONTACT_ADDRESS:
+            message_parts.extend(
+                messages.generic.contact_address(static(settings.CONTACT_ADDRESS),
+                                                 html=html),
+            )
+        message_parts.extend(
+            messages.generic.signature(html=html),
+        )
+        return message_parts
+
+    return _compile_fragment(build_parts)
+
+
+_EVENT_TEMPLATES: Dict[str, Callable[[], MessageTemplate]] = {
+    REGISTRATION_RECEIVED: _digest_registration_received_template,
+    STATUS_CHANGED: _digest_status_changed_template,
+    MATRIX_STATUS_CHANGED: _digest_matrix_status_changed_template,
+}
+
+
+def _render_digest(events: List[TEvent]) -> RenderedMessage:
+    by_rid: Dict[str, List[TEvent]] = {}
+    for event in events:  # Dicts keep the order of the first event per rid
+        by_rid.setdefault(event['rid'], []).append(event)
+
+    fragments = [
+        _digest_head_template().render(events=len(events), registrations=len(by_rid)),
+    ]
+    for rid, registration_events in by_rid.items():
+        fragments.append(_digest_registration_template().render(rid=rid))
+        for event in registration_events:
+            template = _EVENT_TEMPLATES[event['kind']]()
+            fragments.append(template.render(**event))
+    fragments.append(_digest_footer_template().render())
+    return join_fragments(fragments)
+
+
+async def _take_events(cache: Redis) -> List[str]:
+    transaction = cache.multi_exec()
+    taken = transaction.lrange(MANAGERS_DIGEST_KEY, 0,
+                               settings.MANAGERS_DIGEST_MAX_EVENTS - 1)
+    transaction.ltrim(MANAGERS_DIGEST_KEY, settings.MANAGERS_DIGEST_MAX_EVENTS, -1)
+    await transaction.execute()
+    return await taken
+
+
+async def _put_back_events(cache: Redis, taken: List[str]) -> None:
+    # Pushed in reverse to the head, so they keep their order ahead of newer ones
+    await cache.lpush(MANAGERS_DIGEST_KEY, *reversed(taken))
+
+
+async def task_send_managers_digest(cache: Redis) -> int:
+    """Send the buffered events to the managers in a digest email, if any.
+
+    The events are put back in the buffer if the digest could not be sent.
+
+    :param cache: Registrations cache.
+    :return: The number of events sent.
+    """
+    taken = await _take_events(cache)
+    if not taken:
+        return 0
+
+    events = [json.loads(event) for event in taken]
+    sent = False
+    try:
+        subject = f'Registration requests digest ({len(events)} events)'
+        message = _render_digest(events)
+        # noinspection PyArgumentEqualDefault
+        sent = await emails.send(to=settings.MANAGERS_ADDRESSES, subject=subject,
+                                 body_plain=MIMEText(message.plain, 'plain', 'utf-8'),
+                                 body_html=MIMEText(message.html, 'html', 'utf-8'),
+                                 sensitive=True)
+    finally:
+        if not sent:
+            logger.warning('Managers digest not sent, putting its %d events back',
+                           len(events))
+            await _put_back_events(cache, taken)
+    if not sent:
+        return 0
+    digest_events_histogram.observe(len(events))
+    return len(events)
+
+
+async def _is_managers_digest_due(cache: Redis) -> bool:
+    oldest = await cache.lindex(MANAGERS_DIGEST_KEY, 0)
+    if oldest is None:
+        return False
+    return time() - json.loads(oldest)['at'] >= settings.MANAGERS_DIGEST_WINDOW
+
+
+async def task_send_managers_digests(get_cache: Callable[[], Awaitable[Redis]]) -> None:
+    """Send the managers digest whenever it's due.
+
+    It runs forever: cancel it to stop it.
+
+    :param get_cache: Coroutine function to get the registrations cache.
+    """
+    interval = min(settings.MANAGERS_DIGEST_WINDOW, 10)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cache = await get_cache()
+            if await _is_managers_digest_due(cache):
+                await task_send_managers_digest(cache)
+        except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+            logger.warning('Error sending the managers digest: %s', repr(exc))
@@ -0,0 +1,109 @@
+"""Notifications dispatcher.
+
+Independent notifications are sent concurrently, so that notifying takes as long
+as the slowest notification instead of the sum of them all. Each channel (such
+as email) has its own concurrency limit, shared by the whole process, and a
+failing notification doesn't affect the others.
+"""
+import asyncio
+import logging
+from typing import Awaitable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from yog_sothoth.conf import settings
+from yog_sothoth.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Channels
+EMAIL_CHANNEL = 'email'
+
+TNotification = Tuple[str, Awaitable[any]]  # Channel and notification to send
+
+notifications_counter = registry.counter(
+    'yog_notifications_total',
+    'Notifications dispatched by channel and outcome',
+)
+
+
+class Dispatcher:
+    """Notifications dispatcher with per channel concurrency limits."""
+
+    __slots__ = ('limits', '_semaphores')
+
+    def __init__(self, limits: Dict[str, int]):
+        """Notifications dispatcher.
+
+        :param limits: Maximum number of notifications sent at the same time by
+                       channel (channels without a limit are not limited).
+        """
+        self.limits: Dict[str, int] = limits
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}  # Created within the loop
+
+    def _get_semaphore(self, channel: str) -> Optional[asyncio.Semaphore]:
+        if channel not in self.limits:
+            return None
+        if channel not in self._semaphores:
+            self._semaphores[channel] = asyncio.Semaphore(max(self.limits[channel], 1))
+        return self._semaphores[channel]
+
+    async def _send(self, channel: str, notification: Awaitable[any]) -> bool:
+        try:
+            await notification
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: B902
+            # A failing notification must not take the others down
+            logger.exception('Unexpected error while sending a notification through '
+                             'the %s channel', channel)
+            notifications_counter.inc(channel=channel, outcome='failed')
+            return False
+        notifications_counter.inc(channel=channel, outcome='sent')
+        return True
+
+    async def _send_limited(self, channel: str, notification: Awaitable[any]) -> bool:
+        semaphore = self._get_semaphore(channel)
+        if semaphore is None:
+            return await self._send(channel, notification)
+        async with semaphore:
+            return await self._send(channel, notification)
+
+    async def dispatch(self, *notifications: TNotification) -> List[bool]:
+        """Send notifications concurrently, within the limits of their channel.
+
+        :param notifications: Channel and notification to send pairs.
+        :return: Whether each notification was sent successfully, in order.
+        """
+        return list(await asyncio.gather(
+            *(self._send_limited(channel, notification)
+              for channel, notification in notifications),
+        ))
+
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+def get_dispatcher() -> Dispatcher:
+    """Get the process-wide notifications dispatcher.
+
+    The channels limits are defined by the settings.
+    """
+    global _dispatcher
+
+    if _dispatcher is None:
+        _dispatcher = Dispatcher({
+            EMAIL_CHANNEL: settings.NOTIFICATIONS_EMAIL_CONCURRENCY,
+        })
+    return _dispatcher
+
+
+async def dispatch(*notifications: TNotification) -> List[bool]:
+    """Send notifications concurrently through the process-wide dispatcher.
+
+    :param notifications: Channel and notification to send pairs.
+    :return: Whether each notification was sent successfully, in order.
+    """
+    return await get_dispatcher().dispatch(*notifications)
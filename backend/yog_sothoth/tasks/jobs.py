@@ -0,0 +1,193 @@
+"""Registration tasks run as durable jobs of the task queues.
+
+Emails and Matrix account creations go to separate queues, so that each can be
+consumed with its own concurrency.
+
+Jobs carry the registration data as it was when enqueued with its secrets
+hashed, and the registration is retrieved again when the job is run. The only
+plain secret a job carries is the one its task must email, if any (such as the
+token to the user when the registration is received): jobs are kept in the
+queue until done, and failed ones in its dead letter, so the password is never
+enqueued (it's generated by the task creating the account).
+
+Tasks that could not be enqueued run in this process, tracked as in-flight: on
+shutdown they are waited for, and the unfinished ones are enqueued again with
+`recover_registration_tasks`.
+"""
+import asyncio
+import functools
+import logging
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
+from aioredis import Redis
+
+from yog_sothoth import objects
+from yog_sothoth.cache import CACHE_ERRORS
+from yog_sothoth.cache import CacheUnavailableError
+from yog_sothoth.queue import THandler
+from yog_sothoth.queue import get_task_queue
+from yog_sothoth.utils.inflight import get_in_flight
+from .dispatcher import dispatch
+from .matrix import task_create_matrix_account
+from .notifications import task_notify_managers_registration_received
+from .notifications import task_notify_managers_status_changed
+from .notifications import task_notify_user_registration_received
+from .notifications import task_notify_user_status_changed
+
+logger = logging.getLogger(__name__)
+
+TRegistrationTask = Callable[[objects.Registration], Awaitable[any]]
+TUnfinishedTask = Tuple[TRegistrationTask, objects.Registration]
+
+EMAIL_QUEUE = 'email'  # Named as the notifications dispatcher email channel
+MATRIX_QUEUE = 'matrix'
+TASK_QUEUES = (EMAIL_QUEUE, MATRIX_QUEUE)
+
+# Job names must be kept stable: jobs may be waiting in the queue on upgrades
+REGISTRATION_TASKS: Dict[str, TRegistrationTask] = {
+    'create_matrix_account': task_create_matrix_account,
+    'notify_managers_registration_received': task_notify_managers_registration_received,
+    'notify_managers_status_changed': task_notify_managers_status_changed,
+    'notify_user_registration_received': task_notify_user_registration_received,
+    'notify_user_status_changed': task_notify_user_status_changed,
+}
+REGISTRATION_TASK_QUEUES: Dict[str, str] = {
+    'create_matrix_account': MATRIX_QUEUE,
+    'notify_managers_registration_received': EMAIL_QUEUE,
+    'notify_managers_status_changed': EMAIL_QUEUE,
+    'notify_user_registration_received': EMAIL_QUEUE,
+    'notify_user_status_changed': EMAIL_QUEUE,
+}
+# Plain secrets carried by the jobs whose task must email them
+REGISTRATION_TASK_SECRETS: Dict[str, Tuple[str, ...]] = {
+    'notify_managers_registration_received': ('manager_token',),
+    'notify_user_registration_received': ('token',),
+}
+# Registration fields carried by the jobs that are not stored
+_REGISTRATION_UNSTORED_FIELDS = ('username',)
+_REGISTRATION_TASK_NAMES: Dict[TRegistrationTask, str] = {
+    task: name for name, task in REGISTRATION_TASKS.items()
+}
+
+
+def _get_delayed_job_key(name: str, rid: str) -> str:
+    return f'{name}:{rid}'
+
+
+async def enqueue_registration_task(cache: Redis,
+                                    task: TRegistrationTask,
+                                    registration: objects.Registration,
+                                    *,
+                                    delay: float = 0) -> None:
+    """Enqueue a registration task to be run by any consumer of its queue.
+
+    :param cache: Tasks cache.
+    :param task: Registration task (one of `REGISTRATION_TASKS`).
+    :param registration: Registration to run the task for.
+    :param delay: [optional] Seconds to delay the task, which can be cancelled
+                  meanwhile (a delayed task for the same registration is
+                  replaced).
+    """
+    name = _REGISTRATION_TASK_NAMES[task]
+    queue = get_task_queue(cache, REGISTRATION_TASK_QUEUES[name])
+    payload = {
+        'registration': await registration.as_dict(hashed=True, hide=('password',)),
+        'secrets': {secret: getattr(registration, secret)
+                    for secret in REGISTRATION_TASK_SECRETS.get(name, ())},
+    }
+    if delay > 0:
+        await queue.schedule(_get_delayed_job_key(name, registration.rid), name,
+                             payload, delay=delay)
+    else:
+        await queue.enqueue(name, payload)
+
+
+async def cancel_registration_task(cache: Redis,
+                                   task: TRegistrationTask,
+                                   rid: str) -> bool:
+    """Cancel a delayed registration task that is not due yet.
+
+    :param cache: Tasks cache.
+    :param task: Registration task (one of `REGISTRATION_TASKS`).
+    :param rid: Registration id.
+    :return: True if the task was cancelled, False if there was none.
+    """
+    name = _REGISTRATION_TASK_NAMES[task]
+    queue = get_task_queue(cache, REGISTRATION_TASK_QUEUES[name])
+    return await queue.cancel(_get_delayed_job_key(name, rid))
+
+
+async def run_registration_tasks(registration: objects.Registration,
+                                 *registration_tasks: TRegistrationTask) -> None:
+    """Run registration tasks concurrently in this process, when not enqueued.
+
+    Tasks are dispatched through the channel named as their queue, and tracked as
+    in-flight: they keep running even if this is cancelled, until drained.
+
+    :param registration: Registration to run the tasks for.
+    :param registration_tasks: Registration tasks (any of `REGISTRATION_TASKS`).
+    """
+    in_flight = get_in_flight()
+    await asyncio.gather(*(
+        in_flight.run(
+            dispatch((REGISTRATION_TASK_QUEUES[_REGISTRATION_TASK_NAMES[task]],
+                      task(registration))),
+            label=(task, registration),
+        )
+        for task in registration_tasks
+    ))
+
+
+async def recover_registration_tasks(get_cache: Callable[[], Awaitable[Redis]],
+                                     unfinished: Sequence[TUnfinishedTask]) -> None:
+    """Enqueue again the registration tasks cancelled before finishing.
+
+    Tasks that can't be enqueued are logged as errors, to be run again by hand.
+
+    :param get_cache: Coroutine function to get the tasks cache.
+    :param unfinished: Registration task and registration pairs, such as the
+                       labels of the in-flight tasks cancelled on drain.
+    """
+    for task, registration in unfinished:
+        name = _REGISTRATION_TASK_NAMES[task]
+        try:
+            await enqueue_registration_task(await get_cache(), task, registration)
+        except (CacheUnavailableError, *CACHE_ERRORS) as exc:
+            logger.error('Could not recover the unfinished task %s for %s, it must '
+                         'be run again: %s', name, registration.rid, repr(exc))
+        else:
+            logger.info('Unfinished task %s for %s enqueued again', name,
+                        registration.rid)
+
+
+async def _run_registration_task(name: str,
+                                 get_cache: Callable[[], Awaitable[Redis]],
+                                 payload: Dict[str, any]) -> None:
+    data = payload['registration']
+    registration = objects.Registration(cache=await get_cache(), rid=data['rid'])
+    if not await registration.retrieve():
+        logger.info('Registration %s no longer exists, skipping task %s',
+                    registration.rid, name)
+        return
+    for field in _REGISTRATION_UNSTORED_FIELDS:
+        setattr(registration, field, data[field])
+    secrets = payload.get('secrets', data)  # Jobs enqueued before secrets split
+    for secret in REGISTRATION_TASK_SECRETS.get(name, ()):
+        setattr(registration, secret, secrets[secret])
+    await REGISTRATION_TASKS[name](registration)
+
+
+def get_registration_job_handlers(
+        get_cache: Callable[[], Awaitable[Redis]],
+) -> Dict[str, THandler]:
+    """Get the task queue job handlers of the registration tasks.
+
+    :param get_cache: Coroutine function to get the registrations cache.
+    :return: Job handlers by job name.
+    """
+    return {name: functools.partial(_run_registration_task, name, get_cache)
+            for name in REGISTRATION_TASKS}
@@ -1,49 +1,137 @@
 """Matrix-related tasks."""
+import asyncio
 import logging
+import random
+from time import monotonic
 from typing import Optional
+from typing import Tuple
 
 from yog_sothoth import crud
+from yog_sothoth import matrix_standin
 from yog_sothoth import objects
 from yog_sothoth import schemas
 from yog_sothoth.conf import settings
 from yog_sothoth.connectors import matrix
+from yog_sothoth.utils.circuit_breaker import CircuitBreaker
+from yog_sothoth.utils.circuit_breaker import get_circuit_breaker
+from yog_sothoth.utils.connectors import RetryPolicy
+from yog_sothoth.utils.pacing import TokenBucket
+from yog_sothoth.utils.pacing import get_pacer
+from .dispatcher import EMAIL_CHANNEL
+from .dispatcher import dispatch
 from .notifications import task_notify_managers_matrix_status_changed
 from .notifications import task_notify_user_matrix_status_changed
 
 logger = logging.getLogger(__name__)
 
 
-async def _create_matrix_account(
-        registration: objects.Registration,
-) -> Optional[matrix.MatrixAccount]:
+def _get_server() -> Tuple[str, Optional[str]]:
+    """Get the Matrix homeserver URL and registration shared secret."""
     if settings.DEVELOPMENT_MODE:
-        logger.info('Faking Matrix API...')
-        server_url = 'http://127.0.0.1:8000/v1/matrix'
-        registration_shared_secret = 'fakesecret'  # noqa: S105  # nosec
+        # Hardcode and bypass settings, this is done on purpose for dev mode.
+        logger.info('Using the local Matrix homeserver stand-in...')
+        server_url = (f'http://{matrix_standin.DEFAULT_HOST}:'
+                      f'{matrix_standin.DEFAULT_PORT}')
+        registration_shared_secret = matrix_standin.DEFAULT_SHARED_SECRET
     else:
         server_url = settings.MATRIX_URL
         registration_shared_secret = settings.MATRIX_REGISTRATION_SHARED_SECRET
+    return server_url, registration_shared_secret
+
+
+def _get_retry_policy() -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=settings.MATRIX_RETRY_MAX_ATTEMPTS,
+        hedge_after=settings.MATRIX_HEDGE_AFTER or None,
+        deadline=settings.MATRIX_RETRY_DEADLINE or None,
+    )
+
+
+def _get_circuit_breaker(server_url: str) -> CircuitBreaker:
+    return get_circuit_breaker(
+        f'matrix:{server_url}',
+        failure_rate_threshold=settings.MATRIX_CIRCUIT_BREAKER_FAILURE_RATE,
+        minimum_calls=settings.MATRIX_CIRCUIT_BREAKER_MINIMUM_CALLS,
+        open_timeout=settings.MATRIX_CIRCUIT_BREAKER_OPEN_TIMEOUT,
+    )
+
+
+def _get_pacer(server_url: str) -> TokenBucket:
+    return get_pacer(
+        f'matrix:{server_url}',
+        rate=settings.MATRIX_RATE_LIMIT,
+        burst=settings.MATRIX_RATE_LIMIT_BURST,
+    )
+
+
+def _get_nonce_pool(server_url: str) -> Optional[matrix.NoncePool]:
+    if not settings.MATRIX_NONCE_POOL_SIZE:
+        return None
+    return matrix.get_nonce_pool(server_url, timeout=settings.REQUESTS_TIMEOUT,
+                                 retry=_get_retry_policy())
+
+
+async def _create_matrix_account(
+        registration: objects.Registration,
+) -> Optional[matrix.MatrixAccount]:
+    server_url, registration_shared_secret = _get_server()
     connector = matrix.Matrix(
         server_url=server_url,
         registration=registration,
         timeout=settings.REQUESTS_TIMEOUT,
         registration_shared_secret=registration_shared_secret,
+        retry_policy=_get_retry_policy(),
+        circuit_breaker=_get_circuit_breaker(server_url),
+        nonce_pool=_get_nonce_pool(server_url) if registration_shared_secret else None,
+        pacer=_get_pacer(server_url),
     )
-    try:
-        account = await connector.create_account()
-    except matrix.MatrixError:
-        logger.exception('Error while trying to create a Matrix account for %s',
-                         registration.rid)
-        # ToDo: maybe retry a couple of times?
-        # ToDo: maybe return the failure information, removing sensitive data
-        account = None
-    else:
-        logger.info('Matrix account created successfully for %s', registration.rid)
-    return account
+    defer_deadline = monotonic() + settings.MATRIX_DEFER_TIMEOUT
+    while True:
+        try:
+            account = await connector.create_account()
+        except matrix.MatrixUnavailableError as exc:
+            # Defer while the homeserver is unavailable, spreading the retries so
+            # that they don't hit it all at once
+            wait = exc.retry_after + random.uniform(1, 2)  # noqa: S311  # nosec
+            if monotonic() + wait < defer_deadline:
+                logger.warning('Matrix homeserver is unavailable, deferring account '
+                               'creation for %s by %.2f seconds', registration.rid,
+                               wait)
+                await asyncio.sleep(wait)
+                continue
+            logger.error('Matrix homeserver is unavailable, could not create a '
+                         'Matrix account for %s', registration.rid)
+            account = None
+        except matrix.MatrixRejectedError as exc:
+            logger.warning('Matrix homeserver rejected the account for %s (%s)',
+                           registration.rid, exc.errcode)
+            account = None
+        except matrix.MatrixError:
+            logger.exception('Error while trying to create a Matrix account for %s',
+                             registration.rid)
+            # ToDo: maybe return the failure information, removing sensitive data
+            account = None
+        else:
+            logger.info('Matrix account created successfully for %s',
+                        registration.rid)
+        return account
 
 
-async def task_create_matrix_account(registration: objects.Registration) -> None:
-    """Create a matrix account."""
+async def task_create_matrix_account(
+        registration: objects.Registration,
+        *,
+        notify_managers: bool = True,
+) -> Optional[matrix.MatrixAccount]:
+    """Create a matrix account.
+
+    The account password is generated here, not to carry it around.
+
+    :param registration: Registration whose account is created.
+    :param notify_managers: [optional] False to skip notifying managers.
+    :return: The Matrix account if created successfully, None otherwise.
+    """
+    # Don't get password from user, create instead
+    registration.generate_password()
     account = await _create_matrix_account(registration)
 
     # Change and save status
@@ -59,6 +147,51 @@ async def task_create_matrix_account(registration: objects.Registration) -> None
     await crud.Registration(registration.cache, rid=registration.rid).update(update)
 
     # Notify
+    notifications = []
     if registration.email:
-        await task_notify_user_matrix_status_changed(registration, account=account)
-    await task_notify_managers_matrix_status_changed(registration)
+        notifications.append((
+            EMAIL_CHANNEL,
+            task_notify_user_matrix_status_changed(registration, account=account),
+        ))
+    if notify_managers:
+        notifications.append((
+            EMAIL_CHANNEL,
+            task_notify_managers_matrix_status_changed(registration),
+        ))
+    await dispatch(*notifications)
+
+    return account
+
+
+async def task_check_matrix_username_available(username: str) -> Optional[bool]:
+    """Check whether a username is available in the Matrix homeserver.
+
+    It's meant as a pre-check before creating an account, so errors are logged
+    but not raised.
+
+    :param username: Username to check.
+    :return: True if the username is available, False if it's not, or None if it
+             could not be checked.
+    """
+    server_url, _ = _get_server()
+    try:
+        return await matrix.is_username_available(
+            server_url,
+            username,
+            timeout=settings.REQUESTS_TIMEOUT,
+            retry=_get_retry_policy(),
+        )
+    except matrix.MatrixError as exc:
+        logger.warning('Could not check the availability of a Matrix username: %s',
+                       repr(exc))
+        return None
+
+
+async def task_refresh_matrix_api_version() -> None:
+    """Keep the Matrix homeserver API version fresh in the process-wide cache.
+
+    It runs forever: cancel it to stop it.
+    """
+    server_url, _ = _get_server()
+    await matrix.keep_api_version_fresh(server_url, timeout=settings.REQUESTS_TIMEOUT,
+                                        retry=_get_retry_policy())
@@ -1,5 +1,15 @@
-"""Notifications tasks."""
+"""Notifications tasks.
+
+Each notification is compiled once into a message template (see
+`messages.templates`), so that only the registration fields are substituted
+when sending it, as plain text and HTML alternatives.
+
+Notifications carrying secrets (the tokens) are sent right away instead of
+spooled, and raise `NotificationNotSentError` if they could not be: their
+registration job is retried then, rendering them again.
+"""
 from email.mime.text import MIMEText
+from typing import Callable
 from typing import List
 from typing import Optional
 from typing import Sequence
@@ -9,171 +19,249 @@ from yog_sothoth import messages
 from yog_sothoth import schemas
 from yog_sothoth.conf import settings
 from yog_sothoth.connectors import matrix
+from yog_sothoth.messages.templates import MessageTemplate
+from yog_sothoth.messages.templates import RenderedMessage
+from yog_sothoth.messages.templates import compile_template
+from yog_sothoth.messages.templates import compiled
+from yog_sothoth.messages.templates import field
+from yog_sothoth.messages.templates import static
 from yog_sothoth.objects import Registration
+from .digests import MATRIX_STATUS_CHANGED
+from .digests import REGISTRATION_RECEIVED
+from .digests import STATUS_CHANGED
+from .digests import add_managers_digest_event
+from .digests import is_managers_digest_enabled
 
+TPartsBuilder = Callable[[bool], List[str]]  # Gets the parts, as HTML if True
 
-# ToDo: please, please, refactor this
 
-
-async def _notify_from_parts(subject: str,
-                             to: Sequence[str],
-                             *,
-                             message_parts_pt: Optional[Sequence[str]] = None,
-                             message_parts_html: Optional[Sequence[str]] = None) -> None:
-    """Send a notification from message parts."""
-    # noinspection PyArgumentEqualDefault
-    body_plain = (
-        MIMEText('\n'.join(message_parts_pt), 'plain', 'utf-8')
-        if message_parts_pt
-        else None
-    )
-    body_html = (
-        MIMEText('\n'.join(message_parts_html), 'html', 'utf-8')
-        if message_parts_html
-        else None
-    )
-    await emails.send(to=to, subject=subject, body_plain=body_plain,
-                      body_html=body_html)
+class NotificationNotSentError(Exception):
+    """A notification carrying secrets could not be sent."""
 
 
-async def _finish_message(subject: str,
-                          to: Sequence[str],
-                          *,
-                          message_parts_pt: Optional[Sequence[str]] = None,
-                          message_parts_html: Optional[Sequence[str]] = None) -> None:
+def _get_footer_parts(html: bool) -> List[str]:
+    message_parts = []
     if settings.FRONTEND_URL:
-        message_parts_pt.extend(
-            messages.generic.frontend_propaganda(settings.FRONTEND_URL),
+        message_parts.extend(
+            messages.generic.frontend_propaganda(static(settings.FRONTEND_URL),
+                                                 html=html),
         )
-    message_parts_pt.extend(
-        messages.generic.status_changes_repetition(),
+    message_parts.extend(
+        messages.generic.status_changes_repetition(html=html),
     )
     if settings.CONTACT_ADDRESS:
-        message_parts_pt.extend(
-            messages.generic.contact_address(settings.CONTACT_ADDRESS),
+        message_parts.extend(
+            messages.generic.contact_address(static(settings.CONTACT_ADDRESS),
+                                             html=html),
         )
-    message_parts_pt.extend(
-        messages.generic.signature(),
+    message_parts.extend(
+        messages.generic.signature(html=html),
     )
-    await _notify_from_parts(subject, to, message_parts_pt=message_parts_pt,
-                             message_parts_html=message_parts_html)
+    return message_parts
+
 
+def _compile_message(build_parts: TPartsBuilder) -> MessageTemplate:
+    return compile_template(
+        [*build_parts(False), *_get_footer_parts(False)],
+        [*build_parts(True), *_get_footer_parts(True)],
+    )
 
-async def _finish_user_message(registration: Registration,
-                               message_parts_pt: List[str],
-                               subject: str) -> None:
-    await _finish_message(subject, [registration.email],
-                          message_parts_pt=message_parts_pt)
 
+async def _notify(subject: str,
+                  to: Sequence[str],
+                  message: RenderedMessage,
+                  *,
+                  sensitive: bool = False) -> None:
+    """Send a notification as plain text and HTML alternatives.
 
-async def _finish_managers_message(registration: Registration,
-                                   message_parts_pt: List[str],
-                                   subject: str) -> None:
-    await _finish_message(subject, settings.MANAGERS_ADDRESSES,
-                          message_parts_pt=message_parts_pt)
+    :param sensitive: [optional] True if the message carries secrets, so that it's
+                      not spooled (defaults to False).
+    :raise NotificationNotSentError: A sensitive notification could not be sent.
+    """
+    # noinspection PyArgumentEqualDefault
+    sent = await emails.send(to=to, subject=subject,
+                             body_plain=MIMEText(message.plain, 'plain', 'utf-8'),
+                             body_html=MIMEText(message.html, 'html', 'utf-8'),
+                             sensitive=sensitive)
+    if sensitive and not sent:
+        raise NotificationNotSentError(f'{subject} not sent to {", ".join(to)}')
+
+
+def _get_user_name(registration: Registration) -> str:
+    return registration.email.split('@')[0]
+
+
+@compiled
+def _user_registration_received_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.user.salutation(field('username'), html=html),
+        *messages.generic.action_new_registration(static(settings.MATRIX_URL),
+                                                  html=html),
+        *messages.user.registration_information(field('rid'), field('token'),
+                                                html=html),
+        *messages.user.curl_registration_status(field('rid'), field('token'),
+                                                html=html),
+        *messages.user.curl_delete_registration(field('rid'), field('token'),
+                                                html=html),
+    ])
+
+
+@compiled
+def _user_status_changed_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.user.salutation(field('username'), html=html),
+        *messages.generic.status_changed(field('status'), field('rid'), html=html),
+    ])
+
+
+@compiled
+def _user_status_approved_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.user.salutation(field('username'), html=html),
+        *messages.generic.status_changed(field('status'), field('rid'), html=html),
+        *messages.user.status_approved(field('rid'), '<your token>', html=html),
+    ])
+
+
+@compiled
+def _user_matrix_status_changed_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.user.salutation(field('username'), html=html),
+        *messages.generic.status_changed(field('matrix_status'), field('rid'),
+                                         matrix=True, html=html),
+    ])
+
+
+@compiled
+def _user_matrix_account_created_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.user.salutation(field('username'), html=html),
+        *messages.generic.status_changed(field('matrix_status'), field('rid'),
+                                         matrix=True, html=html),
+        *messages.user.matrix_account_created(field('user_id'),
+                                              field('home_server'), html=html),
+    ])
+
+
+@compiled
+def _managers_registration_received_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.manager.salutation(html=html),
+        *messages.generic.action_new_registration(static(settings.MATRIX_URL),
+                                                  html=html),
+        *messages.generic.registration_information(field('rid'),
+                                                   field('manager_token'),
+                                                   html=html),
+        *messages.manager.curl_registration_status(field('rid'),
+                                                   field('manager_token'),
+                                                   html=html),
+        *messages.manager.curl_change_registration_status(field('rid'),
+                                                          field('manager_token'),
+                                                          html=html),
+    ])
+
+
+@compiled
+def _managers_status_changed_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.manager.salutation(html=html),
+        *messages.generic.status_changed(field('status'), field('rid'), html=html),
+    ])
+
+
+@compiled
+def _managers_matrix_status_changed_template() -> MessageTemplate:
+    return _compile_message(lambda html: [
+        *messages.manager.salutation(html=html),
+        *messages.generic.status_changed(field('matrix_status'), field('rid'),
+                                         matrix=True, html=html),
+    ])
 
 
 async def task_notify_user_registration_received(registration: Registration) -> None:
     """Task to notify a user that its registration has been received."""
-    subject = 'Registration received'
-
-    user_name = registration.email.split('@')[0]
-    message_parts_pt = messages.user.salutation(user_name)
-    message_parts_pt.extend(
-        messages.generic.action_new_registration(settings.MATRIX_URL),
-    )
-    message_parts_pt.extend(
-        messages.user.registration_information(registration.rid,
-                                               registration.token),
+    message = _user_registration_received_template().render(
+        username=_get_user_name(registration),
+        rid=registration.rid,
+        token=registration.token,
     )
-    message_parts_pt.extend(
-        messages.user.curl_registration_status(registration.rid, registration.token),
-    )
-    message_parts_pt.extend(
-        messages.user.curl_delete_registration(registration.rid, registration.token),
-    )
-
-    await _finish_user_message(registration, message_parts_pt, subject)
+    await _notify('Registration received', [registration.email], message,
+                  sensitive=True)
 
 
 async def task_notify_user_status_changed(registration: Registration) -> None:
     """Task to notify a user that the registration status changed."""
-    subject = 'Registration status changed'
-
-    user_name = registration.email.split('@')[0]
-    message_parts_pt = messages.user.salutation(user_name)
-    message_parts_pt.extend(messages.generic.status_changed(registration.status,
-                                                            registration.rid))
     if registration.status == schemas.RegistrationStatusEnum.approved:
-        message_parts_pt.extend(
-            messages.user.status_approved(registration.rid, '<your token>'),
-        )
-
-    await _finish_user_message(registration, message_parts_pt, subject)
+        template = _user_status_approved_template()
+    else:
+        template = _user_status_changed_template()
+    message = template.render(
+        username=_get_user_name(registration),
+        status=registration.status,
+        rid=registration.rid,
+    )
+    await _notify('Registration status changed', [registration.email], message)
 
 
 async def task_notify_user_matrix_status_changed(
         registration: Registration, *, account: Optional[matrix.MatrixAccount] = None,
 ) -> None:
     """Task to notify a user that the matrix registration status changed."""
-    subject = 'Matrix registration status changed'
-
-    message_parts_pt = messages.user.salutation(registration.username)
-    message_parts_pt.extend(
-        messages.generic.status_changed(registration.matrix_status, registration.rid,
-                                        matrix=True),
-    )
     if account:
-        message_parts_pt.extend(
-            messages.user.matrix_account_created(account.user_id, account.home_server),
+        message = _user_matrix_account_created_template().render(
+            username=registration.username,
+            matrix_status=registration.matrix_status,
+            rid=registration.rid,
+            user_id=account.user_id,
+            home_server=account.home_server,
+        )
+    else:
+        message = _user_matrix_status_changed_template().render(
+            username=registration.username,
+            matrix_status=registration.matrix_status,
+            rid=registration.rid,
         )
-    await _finish_user_message(registration, message_parts_pt, subject)
+    await _notify('Matrix registration status changed', [registration.email],
+                  message)
 
 
 async def task_notify_managers_registration_received(registration: Registration) -> None:
     """Task to notify the managers that a registration has been received."""
-    subject = 'Registration received'
+    if is_managers_digest_enabled():
+        await add_managers_digest_event(registration, REGISTRATION_RECEIVED)
+        return
 
-    message_parts_pt = messages.manager.salutation()
-    message_parts_pt.extend(
-        messages.generic.action_new_registration(settings.MATRIX_URL),
-    )
-    message_parts_pt.extend(
-        messages.generic.registration_information(registration.rid,
-                                                  registration.manager_token),
-    )
-    message_parts_pt.extend(
-        messages.manager.curl_registration_status(registration.rid,
-                                                  registration.manager_token),
-    )
-    message_parts_pt.extend(
-        messages.manager.curl_change_registration_status(registration.rid,
-                                                         registration.manager_token),
+    message = _managers_registration_received_template().render(
+        rid=registration.rid,
+        manager_token=registration.manager_token,
     )
-
-    await _finish_managers_message(registration, message_parts_pt, subject)
+    await _notify('Registration received', settings.MANAGERS_ADDRESSES, message,
+                  sensitive=True)
 
 
 async def task_notify_managers_status_changed(registration: Registration) -> None:
     """Task to notify the managers that the registration status changed."""
-    subject = 'Registration status changed'
+    if is_managers_digest_enabled():
+        await add_managers_digest_event(registration, STATUS_CHANGED)
+        return
 
-    message_parts_pt = messages.manager.salutation()
-    message_parts_pt.extend(
-        messages.generic.status_changed(registration.status, registration.rid),
+    message = _managers_status_changed_template().render(
+        status=registration.status,
+        rid=registration.rid,
     )
-
-    await _finish_managers_message(registration, message_parts_pt, subject)
+    await _notify('Registration status changed', settings.MANAGERS_ADDRESSES,
+                  message)
 
 
 async def task_notify_managers_matrix_status_changed(registration: Registration) -> None:
     """Task to notify the managers that the matrix registration status changed."""
-    subject = 'Matrix registration status changed'
+    if is_managers_digest_enabled():
+        await add_managers_digest_event(registration, MATRIX_STATUS_CHANGED)
+        return
 
-    message_parts_pt = messages.manager.salutation()
-    message_parts_pt.extend(
-        messages.generic.status_changed(registration.matrix_status, registration.rid,
-                                        matrix=True),
+    message = _managers_matrix_status_changed_template().render(
+        matrix_status=registration.matrix_status,
+        rid=registration.rid,
     )
-
-    await _finish_managers_message(registration, message_parts_pt, subject)
+    await _notify('Matrix registration status changed', settings.MANAGERS_ADDRESSES,
+                  message)
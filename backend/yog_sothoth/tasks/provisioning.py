@@ -0,0 +1,143 @@
+"""Matrix accounts bulk creation tasks.
+
+Many approved registration requests are handled concurrently, up to a limit,
+sharing the HTTP client connection pool. Results are yielded as soon as each
+account is created so that progress can be streamed.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator
+from typing import Iterable
+
+from aioredis import Redis
+
+from yog_sothoth import crud
+from yog_sothoth import objects
+from yog_sothoth import schemas
+from yog_sothoth.utils.inflight import get_in_flight
+from .matrix import task_check_matrix_username_available
+from .matrix import task_create_matrix_account
+
+logger = logging.getLogger(__name__)
+
+TItem = schemas.RegistrationBulkCreateAccountItem
+TResult = schemas.RegistrationBulkCreateAccountResult
+
+
+class _Verifications:
+    """Manager token verifications of a bulk creation, counting the failed ones."""
+
+    __slots__ = ('max_failures', 'failures')
+
+    def __init__(self, max_failures: int):
+        """Count the manager token verifications of a bulk creation.
+
+        :param max_failures: Failed verifications after which no more are made
+                             (0 for no limit).
+        """
+        self.max_failures: int = max_failures
+        self.failures: int = 0
+
+    @property
+    def exhausted(self) -> bool:
+        """Get whether there were too many failed verifications."""
+        return bool(self.max_failures) and self.failures >= self.max_failures
+
+    async def verify(self, registration: objects.Registration, token: str) -> bool:
+        """Verify the manager token of a registration, in the default executor."""
+        loop = asyncio.get_running_loop()
+        verified = await loop.run_in_executor(None, registration.verify_manager_token,
+                                              token)
+        if not verified:
+            self.failures += 1
+        return verified
+
+
+async def _create_account(cache: Redis, item: TItem,
+                          verifications: _Verifications) -> TResult:
+    registration_crud = crud.Registration(cache, rid=item.rid)
+    if not await registration_crud.read():
+        return TResult(rid=item.rid, error='Registration request not found')
+    registration = registration_crud.registration
+
+    # Verifying is costly: stop after too many incorrect tokens
+    if verifications.exhausted:
+        return TResult(rid=item.rid, error='Not processed because of too many '
+                                           'incorrect tokens')
+    if not await verifications.verify(registration, item.manager_token):
+        return TResult(rid=item.rid, error='Incorrect RID or Token')
+
+    if not registration.can_create_account():
+        return TResult(rid=item.rid, matrix_status=registration.matrix_status,
+                       error='The registration request is not yet approved or '
+                             'already in process')
+
+    if await task_check_matrix_username_available(item.username) is False:
+        return TResult(rid=item.rid, matrix_status=registration.matrix_status,
+                       error='The username is not available')
+
+    if not item.email:
+        item.email = registration.email
+    update = schemas.RegistrationUpdateMatrixStatus(**item.dict())
+    if not await registration_crud.update(update):
+        return TResult(rid=item.rid, error='Update operation failed for an unknown '
+                                           'reason')
+
+    registration.username = item.username
+
+    # Tracked as in-flight once processing, so it's drained or recovered on shutdown
+    account = await get_in_flight().run(
+        task_create_matrix_account(registration, notify_managers=False),
+        label=(task_create_matrix_account, registration),
+    )
+    return TResult(rid=item.rid, matrix_status=registration.matrix_status,
+                   user_id=account.user_id if account else None)
+
+
+async def _create_account_isolated(cache: Redis, item: TItem,
+                                   semaphore: asyncio.Semaphore,
+                                   verifications: _Verifications) -> TResult:
+    async with semaphore:
+        try:
+            return await _create_account(cache, item, verifications)
+        except Exception:  # noqa: B902
+            # A failing item must not take the whole bulk down
+            logger.exception('Unexpected error while creating the Matrix account '
+                             'for %s', item.rid)
+            return TResult(rid=item.rid, error='Unexpected error')
+
+
+async def task_create_matrix_accounts(
+        cache: Redis,
+        items: Iterable[TItem],
+        *,
+        concurrency: int,
+        max_failed_verifications: int = 0,
+) -> AsyncIterator[TResult]:
+    """Create Matrix accounts for many approved registration requests.
+
+    Each item requires the registration manager token. Managers are not
+    notified, but users are. Once there are too many incorrect manager tokens,
+    the items still to be verified are not processed.
+
+    Creation is started for every item right away, so it continues even if the
+    results stop being consumed. Accounts being created are tracked as in-flight
+    work, to be drained or recovered on shutdown.
+
+    :param cache: Registrations cache.
+    :param items: Registration id, manager token and username of each account.
+    :param concurrency: Maximum number of accounts being created at the same time.
+    :param max_failed_verifications: [optional] Incorrect manager tokens after
+                                     which the rest of the items are not
+                                     processed (0 for no limit).
+    :return: An async iterator of each item result, in completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    verifications = _Verifications(max_failed_verifications)
+    futures = [
+        asyncio.ensure_future(_create_account_isolated(cache, item, semaphore,
+                                                       verifications))
+        for item in items
+    ]
+    for future in asyncio.as_completed(futures):
+        yield await future
@@ -0,0 +1,246 @@
+"""Circuit breaker to protect the app from failing dependencies.
+
+A circuit breaker keeps track of the outcome of the latest calls to a
+dependency: when the failure rate reaches a threshold, it opens and calls fail
+fast. After a while it gets half-open and lets a few probe calls through: if
+they succeed, it closes again, otherwise it opens again. Only the outcome of the
+probe calls counts while half-open, not that of calls made before.
+
+Circuit breakers are kept per process (i.e. per worker).
+"""
+import logging
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum
+from time import monotonic
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Type
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+circuit_state_gauge = registry.gauge(
+    'yog_circuit_breaker_state',
+    'Circuit breaker state: closed (0), half-open (1) or open (2)',
+)
+circuit_transitions_counter = registry.counter(
+    'yog_circuit_breaker_transitions_total',
+    'Circuit breaker state transitions',
+)
+circuit_rejected_counter = registry.counter(
+    'yog_circuit_breaker_rejected_total',
+    'Calls rejected by an open circuit breaker',
+)
+
+
+class CircuitState(str, Enum):
+    """Circuit breaker states."""
+
+    closed = 'closed'
+    half_open = 'half-open'
+    open = 'open'  # noqa: A003
+
+
+_STATE_VALUES = {
+    CircuitState.closed: 0,
+    CircuitState.half_open: 1,
+    CircuitState.open: 2,
+}
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open: the call was not made."""
+
+    def __init__(self, name: str, retry_after: float):
+        """Circuit breaker for the given name is open.
+
+        :param name: Circuit breaker name.
+        :param retry_after: Seconds until the circuit breaker gets half-open.
+        """
+        super().__init__(name, retry_after)
+        self.name: str = name
+        self.retry_after: float = retry_after
+
+    def __str__(self) -> str:
+        """Get the error message."""
+        return (f'Circuit breaker {self.name} is open, retry in '
+                f'{self.retry_after:.2f} seconds')
+
+
+class CircuitBreaker:
+    """Circuit breaker based on the failure rate of a sliding window of calls."""
+
+    __slots__ = ('name', 'failure_rate_threshold', 'minimum_calls', 'open_timeout',
+                 'half_open_max_calls', '_state', '_outcomes', '_opened_at',
+                 '_half_open_calls', '_epoch')
+
+    def __init__(self, name: str, *, failure_rate_threshold: float = 0.5,
+                 minimum_calls: int = 5, window_size: int = 20,
+                 open_timeout: float = 30, half_open_max_calls: int = 1):
+        """Circuit breaker for calls to a dependency.
+
+        :param name: Circuit breaker name, used in logs and metrics.
+        :param failure_rate_threshold: Failure rate (from 0 to 1) of the latest
+                                       calls that opens the circuit breaker.
+        :param minimum_calls: Minimum number of calls in the window to compute the
+                              failure rate.
+        :param window_size: Number of latest calls to compute the failure rate.
+        :param open_timeout: Seconds to stay open before getting half-open.
+        :param half_open_max_calls: Maximum number of simultaneous probe calls
+                                    while half-open.
+        """
+        self.name: str = name
+        self.failure_rate_threshold: float = failure_rate_threshold
+        self.minimum_calls: int = minimum_calls
+        self.open_timeout: float = open_timeout
+        self.half_open_max_calls: int = half_open_max_calls
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)  # True on failure
+        self._opened_at: float = 0.0
+        self._half_open_calls: int = 0
+        self._epoch: int = 0  # Changes on every transition, to identify probes
+        self._state: CircuitState = CircuitState.closed
+        circuit_state_gauge.set(_STATE_VALUES[self._state], name=self.name)
+
+    def _transition(self, state: CircuitState) -> None:
+        logger.info('Circuit breaker %s changed from %s to %s', self.name,
+                    self._state.value, state.value)
+        self._state = state
+        self._half_open_calls = 0
+        self._epoch += 1
+        if state == CircuitState.open:
+            self._opened_at = monotonic()
+        else:
+            self._outcomes.clear()
+        circuit_state_gauge.set(_STATE_VALUES[state], name=self.name)
+        circuit_transitions_counter.inc(name=self.name, state=state.value)
+
+    @property
+    def state(self) -> CircuitState:
+        """Get the circuit breaker state, getting half-open after the open timeout."""
+        if self._state == CircuitState.open and not self.retry_after:
+            self._transition(CircuitState.half_open)
+        return self._state
+
+    @property
+    def retry_after(self) -> float:
+        """Get the seconds until the circuit breaker gets half-open (0 if not open)."""
+        if self._state != CircuitState.open:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_timeout - monotonic())
+
+    @property
+    def failure_rate(self) -> float:
+        """Get the failure rate of the latest calls."""
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def before_call(self) -> Optional[int]:
+        """Check whether a call is allowed, registering it if it's a probe call.
+
+        :return: The probe identifier if it's a probe call, to pass along with its
+                 outcome, None otherwise.
+        :raises CircuitOpenError: The call is not allowed.
+        """
+        state = self.state
+        if state == CircuitState.closed:
+            return None
+        probe_allowed = self._half_open_calls < self.half_open_max_calls
+        if state == CircuitState.half_open and probe_allowed:
+            self._half_open_calls += 1
+            return self._epoch
+        circuit_rejected_counter.inc(name=self.name)
+        raise CircuitOpenError(self.name, self.retry_after)
+
+    def _is_probe(self, probe: Optional[int]) -> bool:
+        """Check whether a call is a probe of the current half-open state."""
+        if probe is None or self._state != CircuitState.half_open:
+            return False
+        return probe == self._epoch
+
+    def record_success(self, probe: Optional[int] = None) -> None:
+        """Record a successful call.
+
+        :param probe: [optional] Probe identifier, if it's a probe call.
+        """
+        if self._is_probe(probe):
+            self._transition(CircuitState.closed)
+        elif self._state == CircuitState.closed:
+            self._outcomes.append(False)
+
+    def record_failure(self, probe: Optional[int] = None) -> None:
+        """Record a failed call, opening the circuit breaker if necessary.
+
+        :param probe: [optional] Probe identifier, if it's a probe call.
+        """
+        if self._is_probe(probe):
+            self._transition(CircuitState.open)
+        elif self._state == CircuitState.closed:
+            self._outcomes.append(True)
+            enough_calls = len(self._outcomes) >= self.minimum_calls
+            if enough_calls and self.failure_rate >= self.failure_rate_threshold:
+                self._transition(CircuitState.open)
+
+    def release(self, probe: Optional[int] = None) -> None:
+        """Release a call that ended without a recordable outcome.
+
+        :param probe: [optional] Probe identifier, if it's a probe call.
+        """
+        if self._is_probe(probe) and self._half_open_calls:
+            self._half_open_calls -= 1
+
+    @contextmanager
+    def protect(self, failures: Tuple[Type[BaseException], ...] = (Exception,),
+                successes: Tuple[Type[BaseException], ...] = (),
+                ) -> Iterator[None]:
+        """Protect a call with the circuit breaker, recording its outcome.
+
+        :param failures: Exceptions that are recorded as failures: any other
+                         exception is propagated without recording an outcome.
+        :param successes: [optional] Exceptions that are recorded as successes,
+                          i.e. errors reported by a dependency that works.
+        :raises CircuitOpenError: The call is not allowed.
+        """
+        probe = self.before_call()
+        failed: Optional[bool] = None  # None if there's no recordable outcome
+        try:
+            yield
+            failed = False
+        except successes:
+            failed = False
+            raise
+        except failures:
+            failed = True
+            raise
+        finally:
+            if failed is None:
+                self.release(probe)
+            elif failed:
+                self.record_failure(probe)
+            else:
+                self.record_success(probe)
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Get the circuit breaker for the given name, creating it if necessary.
+
+    :param name: Circuit breaker name.
+    :param kwargs: Circuit breaker parameters, only used when creating it.
+    :return: The circuit breaker shared across this process.
+    """
+    if name not in _circuit_breakers:
+        _circuit_breakers[name] = CircuitBreaker(name, **kwargs)
+    return _circuit_breakers[name]
+
+
+def get_circuit_breakers() -> Dict[str, CircuitBreaker]:
+    """Get every circuit breaker in this process by name."""
+    return dict(_circuit_breakers)
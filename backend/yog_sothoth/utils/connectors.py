@@ -1,7 +1,7 @@
-"""Wrappers around Python 3 Requests library.
+"""Wrappers around Python 3 Requests and aiohttp libraries.
 
-This lib will log errors, warnings and request duration, not raising any
-exception: in such error cases, an empty dict is returned. To identify, if
+This lib will log errors and warnings, not raising any exception: in such
+error cases, an empty dict is returned. To identify, if
 necessary, that there where errors, a with_error flag must be set in the
 arguments so that the methods return a tuple in the form of
 (response_data: any, error: bool).
@@ -11,19 +11,45 @@ JSON-converted as-is, which means it's either valid JSON (string, number,
 list, dict) or an empty dict (default response value, which is still valid
 JSON).
 
+Asynchronous requests can be retried following a declarative `RetryPolicy`,
+which also defines hedging for safe requests and a total deadline budget.
+
+Asynchronous requests are done natively in the event loop using a shared
+aiohttp client session, whose connector keeps per-host pools of keep-alive
+connections: open it on startup with `open_session` and close it on shutdown
+with `close_session`. Otherwise a session with default limits is created on
+first use.
+
+The outcome and timing of every request (including the DNS, connection pool
+queue, connect and time to first byte phases of asynchronous requests, where
+available) are passed to the request observers added with
+`add_request_observer`, i.e. to record metrics. Requests can be labelled with
+a route template so that they can be grouped.
+
 """
 
 import asyncio
-import functools
+import json
 import logging
-from time import time
+import random
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+from types import SimpleNamespace
+from typing import Callable
+from typing import Dict
+from typing import FrozenSet
+from typing import List
 from typing import NamedTuple
 from typing import Optional
 from typing import Union
 
+import aiohttp
 import requests
 
-__version__ = '0.4.0'
+__version__ = '0.8.0'
 __author__ = 'HacKan (https://hackan.net)'
 __license__ = 'GPL-3+'
 
@@ -32,6 +58,151 @@ logger = logging.getLogger(__name__)
 VERIFY_SSL: bool = True
 TJSONData = Optional[Union[dict, list, int, str]]
 
+# Connection pool defaults
+POOL_LIMIT: int = 100  # Total simultaneous connections (0 for no limit)
+POOL_LIMIT_PER_HOST: int = 10  # Simultaneous connections per host (0 for no limit)
+KEEPALIVE_TIMEOUT: Union[int, float] = 30  # Seconds to keep idle connections open
+
+# Methods that can be hedged because they don't change the server state
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class RequestStats(NamedTuple):
+    """Outcome and timing of a request, passed to the request observers."""
+
+    method: str
+    url: str
+    route: Optional[str]  # Route template, if given
+    status: Optional[int]  # None if there was no response
+    error: Optional[str]  # Exception class name, if any
+    duration: float  # Seconds, including reading the response
+    phases: Dict[str, float]  # Seconds of each request phase, where available
+
+
+TRequestObserver = Callable[[RequestStats], None]
+
+_request_observers: List[TRequestObserver] = []
+
+
+def add_request_observer(observer: TRequestObserver) -> None:
+    """Add a callable to be called with the stats of every request.
+
+    It's called in the event loop for asynchronous requests: it must be fast and
+    must not raise exceptions.
+    """
+    if observer not in _request_observers:
+        _request_observers.append(observer)
+
+
+def remove_request_observer(observer: TRequestObserver) -> None:
+    """Remove a request observer, if it was added."""
+    if observer in _request_observers:
+        _request_observers.remove(observer)
+
+
+def _notify_request_observers(stats: RequestStats) -> None:
+    for observer in _request_observers:
+        observer(stats)
+
+
+def _phase_timer(phase: str, *, start: bool):
+    """Create a trace callback that times a request phase into the trace context.
+
+    Phases are stored in the dict given as the trace request context, if any.
+    """
+    async def on_phase(_session: aiohttp.ClientSession,
+                       context: SimpleNamespace, _params) -> None:
+        if not isinstance(context.trace_request_ctx, dict):
+            return
+        if start:
+            setattr(context, phase, monotonic())
+        elif hasattr(context, phase):
+            context.trace_request_ctx[phase] = monotonic() - getattr(context, phase)
+
+    return on_phase
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """Create a trace config that times request phases.
+
+    The connect phase includes the TLS handshake, and the time to first byte
+    (ttfb) goes from the request start until the response headers are received.
+    """
+    trace_config = aiohttp.TraceConfig()
+    for phase, start_signal, end_signal in (
+            ('dns', trace_config.on_dns_resolvehost_start,
+             trace_config.on_dns_resolvehost_end),
+            ('queue', trace_config.on_connection_queued_start,
+             trace_config.on_connection_queued_end),
+            ('connect', trace_config.on_connection_create_start,
+             trace_config.on_connection_create_end),
+            ('ttfb', trace_config.on_request_start, trace_config.on_request_end),
+    ):
+        start_signal.append(_phase_timer(phase, start=True))
+        end_signal.append(_phase_timer(phase, start=False))
+    return trace_config
+
+
+def create_session(*, limit: int = POOL_LIMIT,
+                   limit_per_host: int = POOL_LIMIT_PER_HOST,
+                   keepalive_timeout: Union[int, float] = KEEPALIVE_TIMEOUT,
+                   ) -> aiohttp.ClientSession:
+    """Create a client session whose connector pools keep-alive connections.
+
+    It must be called within a running event loop.
+
+    :param limit: Maximum number of simultaneous connections (0 for no limit).
+    :param limit_per_host: Maximum number of simultaneous connections to the same
+                           host (0 for no limit).
+    :param keepalive_timeout: Time in seconds to keep idle connections open.
+    :return: A client session.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector,
+                                 trace_configs=[create_trace_config()])
+
+
+async def open_session(**kwargs) -> aiohttp.ClientSession:
+    """Open the shared client session used for asynchronous requests.
+
+    If there was a previous session, it is closed.
+
+    :param kwargs: Connection pool limits passed to `create_session`.
+    :return: The shared client session.
+    """
+    global _session
+
+    await close_session()
+    _session = create_session(**kwargs)
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared client session, if any, and all of its connections."""
+    global _session
+
+    if _session is not None:
+        session, _session = _session, None
+        await session.close()
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Get the shared client session, creating it with default limits if necessary.
+
+    It must be called within a running event loop.
+    """
+    global _session
+
+    if _session is None or _session.closed:
+        _session = create_session()
+    return _session
+
 
 class SimpleResponse(NamedTuple):
     """Simple response class."""
@@ -47,57 +218,159 @@ class SimpleDataResponse(NamedTuple):
     error: bool
 
 
+class FullDataResponse(NamedTuple):
+    """Full data response class, including details of non-OK responses."""
+
+    response_data: TJSONData
+    error: bool
+    status: Optional[int] = None  # None if there was no response
+    error_data: TJSONData = None  # JSON converted non-OK response if any
+    retry_after: Optional[float] = None  # Seconds, from the Retry-After header
+    exception: Optional[Exception] = None  # Request error if any, i.e. a timeout
+
+    @property
+    def ok(self) -> bool:
+        """Check whether there was a response and it's OK."""
+        return not self.error and self.status is not None and self.status < 400
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Declarative retry policy for asynchronous requests.
+
+    Failed attempts are retried after waiting an exponential back-off with full
+    jitter, or what the server asks for in the Retry-After header if longer.
+    The default policy makes a single attempt.
+
+    Hedging starts a concurrent attempt if the first one didn't finish after a
+    given time, using the first successful response: it only applies to safe
+    methods (GET, HEAD, OPTIONS).
+    """
+
+    # Total attempts, including the first one
+    max_attempts: int = 1
+    # Back-off in seconds before the first retry, doubled for every following one
+    backoff_base: float = 0.5
+    # Maximum back-off in seconds
+    backoff_max: float = 10
+    # Response status codes that are retried
+    retry_statuses: FrozenSet[int] = frozenset((429, 502, 503, 504))
+    # Retry connection errors and timeouts: only safe for idempotent requests as
+    # the server might have processed it
+    retry_errors: bool = True
+    # Maximum time in seconds to wait when asked by the server through the
+    # Retry-After header: if it asks for more, retrying stops
+    retry_after_max: float = 60
+    # Seconds after which a concurrent attempt is started (None to disable)
+    hedge_after: Optional[float] = None
+    # Total time budget in seconds for all attempts and waits (None for no limit)
+    deadline: Optional[float] = None
+
+    def backoff(self, retry: int) -> float:
+        """Get the jittered time to wait in seconds before the given retry (1-based)."""
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (retry - 1))
+        return random.uniform(0, backoff)  # noqa: S311  # nosec
+
+    def get_wait(self, attempt: FullDataResponse,
+                 attempt_number: int) -> Optional[float]:
+        """Get the time to wait in seconds before retrying the given attempt.
+
+        :param attempt: The attempt result.
+        :param attempt_number: The attempt number (1-based).
+        :return: Seconds to wait, or None if the attempt must not be retried.
+        """
+        if attempt_number >= self.max_attempts or attempt.ok:
+            return None
+        if attempt.error:
+            retryable = self.retry_errors
+        else:
+            retryable = attempt.status in self.retry_statuses
+        if not retryable:
+            return None
+
+        wait = self.backoff(attempt_number)
+        if attempt.retry_after is not None:
+            if attempt.retry_after > self.retry_after_max:
+                return None
+            wait = max(wait, attempt.retry_after)
+        return wait
+
+
+NO_RETRY = RetryPolicy()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header value, either in seconds or as an HTTP date.
+
+    :return: Seconds to wait, or None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
 class SimpleRequest:
     """Wrapper over requests lib that catches and logs errors and connection times."""
 
     @staticmethod
     def request(method: str, url: str, *, timeout: Union[int, float],
-                **kwargs) -> SimpleResponse:
+                route: Optional[str] = None, **kwargs) -> SimpleResponse:
         """Make a request to an endpoint, return the response if any.
 
-        Request time, errors and exceptions are all logged using the standard
-        logger.
+        Errors and exceptions are logged using the standard logger, and the
+        request stats are passed to the request observers.
 
         :param method: The request method as string, such as GET, POST, PUT, etc.
         :param url: Endpoint URL as string.
         :param timeout: Connection timeout in seconds (0 for inf).
+        :param route: [optional] Route template to group requests.
         :return: An object with the response (if any) and a bool representing
                  the occurrence of an error.
         """
         error = False
         response = None
+        error_class = None
         if timeout > 0:
             kwargs['timeout'] = timeout
         if 'verify' not in kwargs:
             kwargs['verify'] = VERIFY_SSL
-        request_time_start = time()
+        request_time_start = monotonic()
         try:
             response = requests.request(method, url, **kwargs)
-            request_time_end = time()
         except (requests.exceptions.ConnectionError,
-                requests.exceptions.ReadTimeout):
-            request_time_end = time()
+                requests.exceptions.ReadTimeout) as exc:
             logger.exception(
-                'Error [%s]ing data (kwargs: %s) to/from the endpoint (url: %s)',
+                'Error [%s]ing data to/from the endpoint (url: %s)',
                 method,
-                str(kwargs),
                 url,
             )
             error = True
+            error_class = type(exc).__name__
         else:
             if not response.ok:
                 logger.warning(
-                    'Response from endpoint %s (kwargs: %s) is NOT OK: %d %s',
+                    'Response from endpoint %s is NOT OK: %d %s',
                     url,
-                    str(kwargs),
                     response.status_code,
                     response.text,
                 )
-        logger.debug(
-            'Request to endpoint %s took %.2f seconds',
+        _notify_request_observers(RequestStats(
+            method.upper(),
             url,
-            request_time_end - request_time_start,
-        )
+            route,
+            response.status_code if response is not None else None,
+            error_class,
+            monotonic() - request_time_start,
+            {},
+        ))
 
         return SimpleResponse(response, error)
 
@@ -106,12 +379,186 @@ class JSONConnectorAsync:
     """Generic requests wrapper class to handle JSON endpoints asynchronously."""
 
     @staticmethod
-    async def request(method: str, url: str, *, timeout: Union[int, float],
-                      **kwargs) -> SimpleDataResponse:
+    async def _attempt(method: str, url: str, *, timeout: Optional[float],
+                       route: Optional[str] = None, **kwargs) -> FullDataResponse:
+        """Make a single request attempt to a JSON endpoint."""
+        response_data = None
+        error = False
+        status = None
+        error_data = None
+        retry_after = None
+        error_class = None
+        exception = None
+        phases = {}  # Filled by the session trace config
+        session = get_session()
+        request_time_start = monotonic()
+        try:
+            async with session.request(
+                    method,
+                    url,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                    trace_request_ctx=phases,
+                    **kwargs,
+            ) as response:
+                status = response.status
+                response_text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            # Logged once retries are exhausted, with its traceback
+            logger.warning(
+                'Error [%s]ing data to/from the endpoint (url: %s): %s',
+                method,
+                url,
+                repr(exc),
+            )
+            error = True
+            error_class = type(exc).__name__
+            exception = exc
+        else:
+            if status >= 400:
+                logger.warning(
+                    'Response from endpoint %s is NOT OK: %d %s',
+                    url,
+                    status,
+                    response_text,
+                )
+                retry_after = parse_retry_after(response.headers.get('retry-after'))
+                try:
+                    error_data = json.loads(response_text)
+                except ValueError:
+                    pass
+            elif response_text:  # Could be an empty response
+                try:
+                    response_data = json.loads(response_text)
+                except ValueError:
+                    logger.warning(
+                        'Response from endpoint %s is not valid JSON: %d %s',
+                        url,
+                        status,
+                        response_text,
+                    )
+        _notify_request_observers(RequestStats(
+            method,
+            url,
+            route,
+            status,
+            error_class,
+            monotonic() - request_time_start,
+            phases,
+        ))
+
+        return FullDataResponse(response_data, error, status, error_data, retry_after,
+                                exception)
+
+    @classmethod
+    async def _hedged_attempt(cls, method: str, url: str, *, timeout: Optional[float],
+                              hedge_after: float, **kwargs) -> FullDataResponse:
+        """Make a request attempt, starting a concurrent one if it takes too long.
+
+        The first successful attempt is returned, cancelling the other one.
+        """
+        first = asyncio.ensure_future(cls._attempt(method, url, timeout=timeout,
+                                                   **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        logger.debug('Hedging request to endpoint %s', url)
+        second = asyncio.ensure_future(cls._attempt(method, url, timeout=timeout,
+                                                    **kwargs))
+        pending = {first, second}
+        attempt = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    attempt = task.result()
+                    if attempt.ok:
+                        return attempt
+        finally:
+            for task in pending:
+                task.cancel()
+        return attempt
+
+    @classmethod
+    async def request_full(cls, method: str, url: str, *, timeout: Union[int, float],
+                           retry: RetryPolicy = NO_RETRY, route: Optional[str] = None,
+                           **kwargs) -> FullDataResponse:
+        """Make a request to a JSON endpoint, return the full response details.
+
+        Same as `request`, but the response status is returned as well, along
+        with the JSON converted body and the Retry-After header of non-OK
+        responses, so that callers can act on API specific errors.
+
+        :param method: The request method as string, such as GET, POST, PUT, etc.
+        :param url: Endpoint URL as string.
+        :param timeout: Connection timeout in seconds (0 for inf).
+        :param retry: Retry policy (defaults to a single attempt).
+        :param route: [optional] Route template to group requests, i.e. in metrics.
+        :return: An object with the response data (if any), a bool representing
+                 the occurrence of an error, the response status (if any) and
+                 the non-OK response details.
+        """
+        method = method.upper()
+        kwargs['headers'] = {
+            'content-type': 'application/json',
+        }
+        verify = kwargs.pop('verify', VERIFY_SSL)
+        if not verify:
+            kwargs['ssl'] = False
+        hedge = retry.hedge_after is not None and method in SAFE_METHODS
+        deadline = monotonic() + retry.deadline if retry.deadline else None
+
+        attempt_number = 0
+        while True:
+            attempt_number += 1
+            attempt_timeout = timeout if timeout > 0 else None
+            if deadline:
+                remaining = deadline - monotonic()
+                attempt_timeout = min(attempt_timeout or remaining, remaining)
+            if hedge:
+                attempt = await cls._hedged_attempt(method, url,
+                                                    timeout=attempt_timeout,
+                                                    hedge_after=retry.hedge_after,
+                                                    route=route, **kwargs)
+            else:
+                attempt = await cls._attempt(method, url, timeout=attempt_timeout,
+                                             route=route, **kwargs)
+
+            wait = retry.get_wait(attempt, attempt_number)
+            if wait is None:
+                break
+            if deadline and monotonic() + wait >= deadline:
+                logger.warning('Not retrying [%s] request to endpoint %s: deadline '
+                               'exceeded', method, url)
+                break
+            logger.info('Retrying [%s] request to endpoint %s in %.2f seconds '
+                        '(attempt %d of %d)', method, url, wait, attempt_number + 1,
+                        retry.max_attempts)
+            await asyncio.sleep(wait)
+
+        if attempt.exception is not None:  # Out of its except block
+            logger.error(  # noqa: G201
+                'Error [%s]ing data to/from the endpoint (url: %s)',
+                method,
+                url,
+                exc_info=attempt.exception,
+            )
+        return attempt
+
+    @classmethod
+    async def request(cls, method: str, url: str, *, timeout: Union[int, float],
+                      retry: RetryPolicy = NO_RETRY, **kwargs) -> SimpleDataResponse:
         """Make a request to a JSON endpoint, return the JSON converted response if any.
 
-        Request time, errors and exceptions are all logged using the standard
-        logger.
+        The request is done in the event loop using the shared client session, so
+        that connections are reused, and retried according to the given policy.
+
+        Errors and exceptions are logged using the standard logger, and the stats
+        of every attempt are passed to the request observers (a route template
+        can be given in the route keyword argument to group requests).
 
         Note that the type of the returned response depends on the endpoint,
         but it will always be some valid JSON.
@@ -122,41 +569,21 @@ class JSONConnectorAsync:
         :param method: The request method as string, such as GET, POST, PUT, etc.
         :param url: Endpoint URL as string.
         :param timeout: Connection timeout in seconds (0 for inf).
+        :param retry: Retry policy (defaults to a single attempt).
         :return: An object with the response data (if any) and a bool representing
                  the occurrence of an error.
         """
-        response_data = None
-        kwargs['headers'] = {
-            'content-type': 'application/json',
-        }
-        loop = asyncio.get_running_loop()
-        response, error = await loop.run_in_executor(None, functools.partial(
-            SimpleRequest.request,
-            method,
-            url,
-            timeout=timeout,
-            **kwargs,
-        ))
-        if not error and response.ok:
-            try:
-                response_data = response.json()
-            except ValueError:
-                if response.text:  # Could be an empty response
-                    logger.warning(
-                        'Response from endpoint %s is not valid JSON: %d %s',
-                        url,
-                        response.status_code,
-                        response.text,
-                    )
-        return SimpleDataResponse(response_data, error)
+        response = await cls.request_full(method, url, timeout=timeout, retry=retry,
+                                          **kwargs)
+        return SimpleDataResponse(response.response_data, response.error)
 
     @classmethod
     async def get(cls, url: str, *, timeout: Union[int, float],
-                  **kwargs) -> SimpleDataResponse:
+                  retry: RetryPolicy = NO_RETRY, **kwargs) -> SimpleDataResponse:
         """Retrieve data from a JSON endpoint, return the JSON converted response if any.
 
-        Request time, errors and exceptions are all logged using the standard
-        logger.
+        Errors and exceptions are logged using the standard logger, and the stats
+        of every attempt are passed to the request observers.
 
         Note that the type of the returned response depends on the endpoint,
         but it will always be some valid JSON.
@@ -166,21 +593,23 @@ class JSONConnectorAsync:
 
         :param url: Endpoint URL as string.
         :param timeout: Connection timeout in seconds (0 for inf).
+        :param retry: Retry policy (defaults to a single attempt).
         :return: An object with the response data (if any) and a bool representing
                  the occurrence of an error.
         """
-        return await cls.request('GET', url, timeout=timeout, **kwargs)
+        return await cls.request('GET', url, timeout=timeout, retry=retry, **kwargs)
 
     @classmethod
     async def post(cls, url: str, data: Union[str, dict, bytes, list, tuple],
-                   *, timeout: Union[int, float], **kwargs) -> SimpleDataResponse:
+                   *, timeout: Union[int, float], retry: RetryPolicy = NO_RETRY,
+                   **kwargs) -> SimpleDataResponse:
         """Post data to a JSON endpoint, return the JSON converted response if any.
 
         If given data is a string, it will be previously encoded as if it were UTF-8.
         It is recommended to not send strings but encoded ones as bytes.
 
-        Request time, errors and exceptions are all logged using the standard
-        logger.
+        Errors and exceptions are logged using the standard logger, and the stats
+        of every attempt are passed to the request observers.
 
         Note that the type of the returned response depends on the endpoint,
         but it will always be some valid JSON.
@@ -191,11 +620,15 @@ class JSONConnectorAsync:
         :param url: Endpoint URL as string.
         :param data: Data to post, either as a dictionary (JSON valid) or a string.
         :param timeout: Connection timeout in seconds (0 for inf).
+        :param retry: Retry policy (defaults to a single attempt): note that
+                      posting is usually not idempotent.
         :return: An object with the response data (if any) and a bool representing
                  the occurrence of an error.
         """
         if isinstance(data, (dict, list, tuple)):
-            return await cls.request('POST', url, timeout=timeout, json=data, **kwargs)
+            kwargs['json'] = data
         elif isinstance(data, str):
-            data = data.encode()
-        return await cls.request('POST', url, timeout=timeout, data=data, **kwargs)
+            kwargs['data'] = data.encode()
+        else:
+            kwargs['data'] = data
+        return await cls.request('POST', url, timeout=timeout, retry=retry, **kwargs)
@@ -0,0 +1,105 @@
+"""Registry of in-flight background work, drained on shutdown.
+
+Work that runs in the background of a request (such as registration tasks that
+could not be enqueued) is tracked until it finishes, so that on shutdown it can
+be waited for before closing the connections it needs, up to a timeout. The
+unfinished work is cancelled, and its labels are returned so that it can be
+recovered, i.e. enqueued again.
+
+Tracked work runs as its own task: cancelling whoever awaits it, such as a
+request being cancelled on shutdown, doesn't cancel the work.
+
+The registry is kept per process (i.e. per worker).
+"""
+import asyncio
+import logging
+from typing import Awaitable
+from typing import Dict
+from typing import List
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+in_flight_gauge = registry.gauge(
+    'yog_in_flight_tasks',
+    'Background tasks being run by this process',
+)
+in_flight_cancelled_counter = registry.counter(
+    'yog_in_flight_tasks_cancelled_total',
+    'Background tasks cancelled on shutdown because they did not finish in time',
+)
+
+
+class InFlight:
+    """Registry of in-flight background tasks."""
+
+    __slots__ = ('_tasks',)
+
+    def __init__(self):
+        """Registry of in-flight background tasks."""
+        self._tasks: Dict[asyncio.Future, any] = {}
+
+    def __len__(self) -> int:
+        """Get the number of in-flight tasks."""
+        return len(self._tasks)
+
+    def _forget(self, task: asyncio.Future) -> None:
+        self._tasks.pop(task, None)
+        in_flight_gauge.set(len(self._tasks))
+
+    def track(self, work: Awaitable[any], *, label: any = None) -> asyncio.Future:
+        """Run the given work as a task, tracked until it finishes.
+
+        :param work: Work to run.
+        :param label: [optional] Anything identifying the work, to recover it if
+                      it's cancelled on drain.
+        :return: The task running the work.
+        """
+        task = asyncio.ensure_future(work)
+        self._tasks[task] = label
+        in_flight_gauge.set(len(self._tasks))
+        task.add_done_callback(self._forget)
+        return task
+
+    async def run(self, work: Awaitable[any], *, label: any = None) -> any:
+        """Run the given work as a tracked task, and wait for it to finish.
+
+        If the waiter is cancelled, the work keeps running until drained.
+
+        :param work: Work to run.
+        :param label: [optional] Anything identifying the work, to recover it if
+                      it's cancelled on drain.
+        :return: The work result.
+        """
+        return await asyncio.shield(self.track(work, label=label))
+
+    async def drain(self, timeout: float) -> List[any]:
+        """Wait for the in-flight tasks to finish, and cancel the unfinished ones.
+
+        :param timeout: Seconds to wait for the tasks to finish.
+        :return: The labels of the cancelled tasks that have one.
+        """
+        if not self._tasks:
+            return []
+        logger.info('Waiting up to %.1f seconds for %d in-flight tasks to finish...',
+                    timeout, len(self._tasks))
+        _, pending = await asyncio.wait(list(self._tasks), timeout=max(timeout, 0))
+        if not pending:
+            return []
+        labels = [self._tasks[task] for task in pending]
+        logger.warning('Cancelling %d in-flight tasks that did not finish in time',
+                       len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        in_flight_cancelled_counter.inc(len(pending))
+        return [label for label in labels if label is not None]
+
+
+_in_flight = InFlight()
+
+
+def get_in_flight() -> InFlight:
+    """Get the registry of in-flight background tasks of this process."""
+    return _in_flight
@@ -0,0 +1,203 @@
+"""Lightweight in-process metrics.
+
+Metrics are kept per process (i.e. per worker) and can be rendered in the
+Prometheus text exposition format.
+"""
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+TLabels = Tuple[Tuple[str, str], ...]
+TNumber = Union[int, float]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels: Dict[str, any]) -> TLabels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: TLabels, extra: Optional[TLabels] = None) -> str:
+    labels = labels + (extra or ())
+    if not labels:
+        return ''
+    formatted = ','.join(f'{name}="{value}"' for name, value in labels)
+    return f'{{{formatted}}}'
+
+
+def _format_number(value: TNumber) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base metric class."""
+
+    TYPE = 'untyped'
+
+    __slots__ = ('name', 'description', '_lock', '_values')
+
+    def __init__(self, name: str, description: str):
+        """Define a metric with its name and description."""
+        self.name: str = name
+        self.description: str = description
+        self._lock: Lock = Lock()
+        self._values: Dict[TLabels, any] = {}
+
+    def _render_values(self) -> List[str]:
+        return [f'{self.name}{_format_labels(labels)} {_format_number(value)}'
+                for labels, value in self._values.items()]
+
+    def render(self) -> str:
+        """Render the metric in Prometheus text format."""
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.TYPE}',
+        ]
+        with self._lock:
+            lines.extend(self._render_values())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    TYPE = 'counter'
+
+    __slots__ = ()
+
+    def inc(self, amount: TNumber = 1, **labels) -> None:
+        """Increment the counter for the given labels."""
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> TNumber:
+        """Get the counter value for the given labels."""
+        return self._values.get(_labels_key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    TYPE = 'gauge'
+
+    __slots__ = ()
+
+    def set(self, value: TNumber, **labels) -> None:  # noqa: A003
+        """Set the gauge value for the given labels."""
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+
+    def inc(self, amount: TNumber = 1, **labels) -> None:
+        """Increment the gauge value for the given labels."""
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: TNumber = 1, **labels) -> None:
+        """Decrement the gauge value for the given labels."""
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> TNumber:
+        """Get the gauge value for the given labels."""
+        return self._values.get(_labels_key(labels), 0)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    TYPE = 'histogram'
+
+    __slots__ = ('buckets',)
+
+    def __init__(self, name: str, description: str,
+                 buckets: Sequence[TNumber] = DEFAULT_BUCKETS):
+        """Define a histogram with its name, description and upper bounds."""
+        super().__init__(name, description)
+        self.buckets: Tuple[TNumber, ...] = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: TNumber, **labels) -> None:
+        """Observe a value for the given labels."""
+        key = _labels_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def quantile(self, q: float, **labels) -> Optional[TNumber]:
+        """Estimate a quantile from the buckets for the given labels.
+
+        :param q: Quantile to estimate, between 0 and 1.
+        :return: The upper bound of the bucket where the quantile falls, or None
+                 if there are no observations.
+        """
+        counts, _ = self._values.get(_labels_key(labels)) or ([], 0)
+        rank = q * sum(counts)
+        accumulated = 0
+        for bound, count in zip(self.buckets, counts):
+            accumulated += count
+            if count and accumulated >= rank:
+                return bound
+        return None
+
+    def _render_values(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self._values.items():
+            accumulated = 0
+            for bound, count in zip(self.buckets, counts):
+                accumulated += count
+                bucket_labels = _format_labels(labels, (('le', _format_number(bound)),))
+                lines.append(f'{self.name}_bucket{bucket_labels} {accumulated}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} '
+                         f'{_format_number(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {accumulated}')
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics."""
+
+    __slots__ = ('_metrics', '_lock')
+
+    def __init__(self):
+        """Collect metrics, getting or creating them by name."""
+        self._metrics: Dict[str, Metric] = {}
+        self._lock: Lock = Lock()
+
+    def _get_or_create(self, cls: type, name: str, description: str,
+                       **kwargs) -> Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if not metric:
+                metric = self._metrics[name] = cls(name, description, **kwargs)
+        if not isinstance(metric, cls):
+            raise TypeError(f'Metric {name} is already registered as {metric.TYPE}')
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Get or create a counter."""
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        """Get or create a gauge."""
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str,
+                  buckets: Sequence[TNumber] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram."""
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def render(self) -> str:
+        """Render every metric in Prometheus text format."""
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,150 @@
+"""Token bucket pacer to respect the rate limits of a dependency.
+
+Calls acquire a token before being made: tokens are added at a steady rate up
+to a burst size, so calls are spread over time instead of hitting the
+dependency all at once. When the dependency says it's being called too often,
+the pacer is paused for exactly as long as told, holding every call. Once
+resumed, the calls that were held are paced, even if the pacer has no rate.
+
+Pacers are kept per process (i.e. per worker).
+"""
+import asyncio
+import logging
+from time import monotonic
+from typing import Dict
+from typing import Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+pacer_wait_histogram = registry.histogram(
+    'yog_pacer_wait_seconds',
+    'Time calls waited for a pacer token',
+)
+pacer_paused_counter = registry.counter(
+    'yog_pacer_paused_total',
+    'Times a pacer was paused because the rate limit was exceeded',
+)
+
+
+class TokenBucket:
+    """Token bucket pacer that can be paused."""
+
+    __slots__ = ('name', 'rate', 'burst', '_tokens', '_updated_at', '_paused_until',
+                 '_resume_rate', '_waiters', '_lock')
+
+    def __init__(self, name: str, *, rate: float = 0, burst: int = 1):
+        """Token bucket pacer for calls to a dependency.
+
+        :param name: Pacer name, used in logs and metrics.
+        :param rate: Tokens per second (0 for no limit, only pausing).
+        :param burst: Maximum number of tokens, i.e. calls that can be made at once.
+        """
+        self.name: str = name
+        self.rate: float = rate
+        self.burst: int = max(burst, 1)
+        self._tokens: float = self.burst
+        self._updated_at: float = monotonic()
+        self._paused_until: float = 0.0
+        # Rate after a pause while calls are waiting, if there's no rate
+        self._resume_rate: float = 0.0
+        self._waiters: int = 0
+        self._lock: Optional[asyncio.Lock] = None  # Created within the event loop
+
+    @property
+    def _rate(self) -> float:
+        return self.rate or self._resume_rate
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated_at)
+        self._tokens = min(self.burst, self._tokens + elapsed * self._rate)
+        self._updated_at = max(now, self._updated_at)
+
+    def _get_wait(self) -> float:
+        """Take a token if possible, otherwise get the seconds to wait for one."""
+        now = monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        if not self._rate:
+            return 0.0
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    @property
+    def paused_for(self) -> float:
+        """Get the seconds until the pacer resumes (0 if not paused)."""
+        return max(0.0, self._paused_until - monotonic())
+
+    def pause(self, seconds: float, *, acquired_at: Optional[float] = None) -> None:
+        """Pause the pacer, holding every call for the given seconds.
+
+        Once resumed, a single call goes through right away and the following
+        ones are paced again. If the pacer has no rate, they're paced a call per
+        paused seconds until no calls are waiting, halving it every time a call
+        paced this way is told to wait again.
+
+        :param seconds: Seconds to pause, i.e. as told by the dependency.
+        :param acquired_at: [optional] Monotonic time when the call told to wait
+                            got its token.
+        """
+        now = monotonic()
+        paused_until = now + seconds
+        if paused_until <= self._paused_until:
+            return
+        logger.info('Pacer %s paused for %.2f seconds', self.name, seconds)
+        pacer_paused_counter.inc(name=self.name)
+        if not self.rate and seconds > 0:
+            resume_rate = 1 / seconds
+            if self._resume_rate:
+                paced = acquired_at is not None and acquired_at >= self._paused_until
+                # Calls made before resuming don't tell whether it's still too fast
+                resume_rate = min(resume_rate,
+                                  self._resume_rate / 2 if paced else self._resume_rate)
+            self._resume_rate = resume_rate
+        self._paused_until = paused_until
+        self._tokens = min(self._tokens, 1)
+        self._updated_at = paused_until
+
+    async def acquire(self) -> float:
+        """Wait for a token, in order of arrival.
+
+        :return: Seconds waited.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        started_at = monotonic()
+        self._waiters += 1
+        try:
+            async with self._lock:
+                wait = self._get_wait()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = self._get_wait()  # It might have been paused meanwhile
+        finally:
+            self._waiters -= 1
+        if self._resume_rate and not self._waiters:
+            # The calls held by a pause went through, and weren't paused again
+            if monotonic() >= self._paused_until + 1 / self._resume_rate:
+                self._resume_rate = 0.0
+        waited = monotonic() - started_at
+        pacer_wait_histogram.observe(waited, name=self.name)
+        return waited
+
+
+_pacers: Dict[str, TokenBucket] = {}
+
+
+def get_pacer(name: str, **kwargs) -> TokenBucket:
+    """Get the pacer for the given name, creating it if necessary.
+
+    :param name: Pacer name.
+    :param kwargs: Pacer parameters, only used when creating it.
+    :return: The pacer shared across this process.
+    """
+    if name not in _pacers:
+        _pacers[name] = TokenBucket(name, **kwargs)
+    return _pacers[name]
@@ -0,0 +1,41 @@
+"""Metrics of outbound requests done from the app.
+
+The outcome and timing of every request done through the connectors are
+recorded into histograms labelled by host and route template, so that latency
+percentiles can be computed per dependency. Add `observe_request` as a request
+observer to start recording.
+"""
+from urllib.parse import urlsplit
+
+from .connectors import RequestStats
+from .metrics import registry
+
+request_duration_histogram = registry.histogram(
+    'yog_http_client_request_duration_seconds',
+    'Outbound request duration, including reading the response',
+)
+request_phase_histogram = registry.histogram(
+    'yog_http_client_request_phase_seconds',
+    'Outbound request phases duration: dns, queue (waiting for a pooled '
+    'connection), connect (including TLS) and ttfb (time to first byte)',
+)
+
+
+def observe_request(stats: RequestStats) -> None:
+    """Record the stats of an outbound request.
+
+    Requests without a route template are grouped by host only, to keep the
+    number of label values bounded.
+    """
+    host = urlsplit(stats.url).netloc
+    route = stats.route or 'other'
+    request_duration_histogram.observe(
+        stats.duration,
+        host=host,
+        route=route,
+        method=stats.method,
+        status=stats.status or '',
+        error=stats.error or '',
+    )
+    for phase, duration in stats.phases.items():
+        request_phase_histogram.observe(duration, host=host, route=route, phase=phase)
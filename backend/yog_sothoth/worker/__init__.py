@@ -0,0 +1,8 @@
+"""Expose the dedicated task worker."""
+from .worker import main
+from .worker import run_worker
+
+__all__ = (
+    'main',
+    'run_worker',
+)
@@ -0,0 +1,4 @@
+"""Run a dedicated task worker with `python -m yog_sothoth.worker`."""
+from .worker import main
+
+main()
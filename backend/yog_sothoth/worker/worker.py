@@ -0,0 +1,143 @@
+"""Dedicated task worker.
+
+Run it with `python -m yog_sothoth.worker` to consume the jobs of the task
+queues, sending emails and creating Matrix accounts, outside of the app workers.
+Each queue is consumed with its own concurrency, and the worker exposes its own
+metrics. It delivers the spooled emails through the pooled SMTP connections,
+enqueues delayed jobs once due and sends the managers digest as well.
+
+On SIGTERM or SIGINT it stops reading jobs and waits for the running ones to
+finish, up to a timeout: the unfinished ones are retried by any consumer.
+"""
+import asyncio
+import logging
+import signal
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from aiohttp import web
+
+from yog_sothoth.cache import REGISTRATIONS_CACHE_ALIAS
+from yog_sothoth.cache import TASKS_CACHE_ALIAS
+from yog_sothoth.cache import close_lazy_caches
+from yog_sothoth.cache import get_lazy_caches
+from yog_sothoth.conf import settings
+from yog_sothoth.connectors.matrix import close_nonce_pools
+from yog_sothoth.emails import OUTBOX_QUEUE
+from yog_sothoth.emails import close_smtp_pool
+from yog_sothoth.emails import close_spool
+from yog_sothoth.emails import get_spool_job_handlers
+from yog_sothoth.emails import open_smtp_pool
+from yog_sothoth.emails import open_spool
+from yog_sothoth.messages.templates import compile_templates
+from yog_sothoth.queue import Consumer
+from yog_sothoth.queue import Scheduler
+from yog_sothoth.tasks import EMAIL_QUEUE
+from yog_sothoth.tasks import MATRIX_QUEUE
+from yog_sothoth.tasks import get_registration_job_handlers
+from yog_sothoth.tasks import is_managers_digest_enabled
+from yog_sothoth.tasks import task_refresh_matrix_api_version
+from yog_sothoth.tasks import task_send_managers_digests
+from yog_sothoth.utils.connectors import add_request_observer
+from yog_sothoth.utils.connectors import close_session
+from yog_sothoth.utils.connectors import open_session
+from yog_sothoth.utils.metrics import registry
+from yog_sothoth.utils.project import check_settings
+from yog_sothoth.utils.request_metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+
+def _get_queues_concurrency() -> Dict[str, int]:
+    return {
+        EMAIL_QUEUE: settings.TASKS_WORKER_EMAIL_CONCURRENCY,
+        MATRIX_QUEUE: settings.TASKS_WORKER_MATRIX_CONCURRENCY,
+    }
+
+
+async def _read_metrics(_: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+async def _start_metrics_server() -> Optional[web.AppRunner]:
+    if not settings.TASKS_WORKER_METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', _read_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.TASKS_WORKER_METRICS_HOST,
+                       settings.TASKS_WORKER_METRICS_PORT)
+    await site.start()
+    logger.info('Task worker metrics exposed at http://%s:%d/metrics',
+                settings.TASKS_WORKER_METRICS_HOST, settings.TASKS_WORKER_METRICS_PORT)
+    return runner
+
+
+def _stop(consumers: List[Consumer]) -> None:
+    logger.info('Stopping the task worker...')
+    for consumer in consumers:
+        consumer.stop()
+
+
+async def run_worker() -> None:
+    """Consume the task queues until SIGTERM or SIGINT is received."""
+    caches = get_lazy_caches()
+    for cache in caches.values():
+        cache.warm_up()
+    add_request_observer(observe_request)
+    await open_session(
+        limit=settings.REQUESTS_POOL_LIMIT,
+        limit_per_host=settings.REQUESTS_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=settings.REQUESTS_KEEPALIVE_TIMEOUT,
+    )
+    await open_smtp_pool()
+    open_spool(caches[TASKS_CACHE_ALIAS])
+    compile_templates()
+    background_tasks = [
+        asyncio.ensure_future(task_refresh_matrix_api_version()),
+    ]
+    metrics_runner = await _start_metrics_server()
+
+    handlers = get_registration_job_handlers(caches[REGISTRATIONS_CACHE_ALIAS].get)
+    consumers = []
+    for queue, concurrency in _get_queues_concurrency().items():
+        consumers.append(Consumer(caches[TASKS_CACHE_ALIAS], queue, handlers,
+                                  concurrency=concurrency,
+                                  drain_timeout=settings.TASKS_WORKER_DRAIN_TIMEOUT))
+        scheduler = Scheduler(caches[TASKS_CACHE_ALIAS], queue)
+        background_tasks.append(asyncio.ensure_future(scheduler.run()))
+    consumers.append(Consumer(caches[TASKS_CACHE_ALIAS], OUTBOX_QUEUE,
+                              get_spool_job_handlers(),
+                              concurrency=settings.EMAIL_POOL_SIZE,
+                              drain_timeout=settings.TASKS_WORKER_DRAIN_TIMEOUT))
+    if is_managers_digest_enabled():
+        background_tasks.append(asyncio.ensure_future(
+            task_send_managers_digests(caches[REGISTRATIONS_CACHE_ALIAS].get),
+        ))
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, _stop, consumers)
+
+    try:
+        await asyncio.gather(*(consumer.run() for consumer in consumers))
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        close_spool()
+        await close_nonce_pools()
+        await close_session()
+        await close_smtp_pool()
+        await close_lazy_caches(caches)
+        logger.info('Task worker stopped')
+
+
+def main() -> None:
+    """Run a dedicated task worker."""
+    check_settings()
+    asyncio.run(run_worker())